@@ -0,0 +1,186 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Caches for the embeddings computed by the chain server.
+
+:class:`ContentCache` is a persistent, content addressed cache of parsed documents and chunk embeddings.
+
+The cache directory is laid out as::
+
+    documents/<file sha256>.json            parsed text, metadata and chunk boundaries of a file
+    embeddings/<model>/<xx>/<chunk sha256>.npy  float16 embedding of a chunk
+
+Entries are immutable and written atomically, so several processes can share one directory.
+
+:class:`QueryEmbeddingCache` is an in-memory cache of query embeddings shared by every retrieval endpoint.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def hash_file(file_path: str) -> str:
+    """Calculate the SHA256 hash of the file content."""
+    sha256_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for byte_block in iter(lambda: f.read(65536), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+
+def hash_text(text: str) -> str:
+    """Calculate the SHA256 hash of a chunk of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ContentCache:
+    """Parsed chunks keyed by file hash and embeddings keyed by chunk text hash."""
+
+    def __init__(self, directory: str, model_name: str) -> None:
+        """Initialize the cache directories."""
+        self._documents_dir = os.path.join(directory, "documents")
+        self._embeddings_dir = os.path.join(directory, "embeddings", model_name.replace("/", "__"))
+        os.makedirs(self._documents_dir, exist_ok=True)
+        os.makedirs(self._embeddings_dir, exist_ok=True)
+
+    @staticmethod
+    def _write_atomic(path: str, write: Any) -> None:
+        """Write a file next to its destination and move it into place."""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _embedding_path(self, chunk_hash: str) -> str:
+        # shard by the first byte so no directory grows to millions of entries
+        return os.path.join(self._embeddings_dir, chunk_hash[:2], f"{chunk_hash}.npy")
+
+    def get_document(self, doc_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the parsed texts and chunks of a previously seen file."""
+        try:
+            with open(os.path.join(self._documents_dir, f"{doc_hash}.json"), encoding="utf-8") as f:
+                return json.load(f)  # type: ignore[no-any-return]
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_document(
+        self,
+        doc_hash: str,
+        texts: List[str],
+        chunks: List[Dict[str, Any]],
+        metadata: List[Dict[str, Any]],
+        parser_version: int = 0,
+        chunking: Optional[Dict[str, Any]] = None,
+        num_facts: int = 0,
+    ) -> None:
+        """Store the parsed texts of a file and the boundaries of its chunks.
+
+        :param texts: The text of every document parsed from the file.
+        :param chunks: One entry per chunk with its ``document`` index, ``start``/``end`` offsets and ``text``.
+        :param metadata: The extracted metadata of every document parsed from the file.
+        :param parser_version: The version of the parsing and chunking code, so outdated entries can be ignored.
+        :param chunking: The settings the chunks were cut with, so entries cut differently can be ignored.
+        :param num_facts: The number of XBRL facts stored for the file, so entries whose facts are gone are ignored.
+        """
+        payload = json.dumps(
+            {
+                "texts": texts,
+                "chunks": chunks,
+                "metadata": metadata,
+                "parser_version": parser_version,
+                "chunking": chunking,
+                "num_facts": num_facts,
+            }
+        ).encode("utf-8")
+        self._write_atomic(os.path.join(self._documents_dir, f"{doc_hash}.json"), lambda f: f.write(payload))
+
+    def get_embedding(self, chunk_hash: str) -> Optional[List[float]]:
+        """Return the cached embedding of a chunk."""
+        try:
+            return np.load(self._embedding_path(chunk_hash)).astype(np.float32).tolist()  # type: ignore[no-any-return]
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_embedding(self, chunk_hash: str, embedding: List[float]) -> None:
+        """Store the embedding of a chunk as a float16 array."""
+        vector = np.asarray(embedding, dtype=np.float16)
+        self._write_atomic(self._embedding_path(chunk_hash), lambda f: np.save(f, vector))
+
+
+class QueryEmbeddingCache:
+    """A bounded, thread safe LRU cache of query embeddings with a time to live."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0) -> None:
+        """Initialize the cache."""
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(model_name: str, query: str) -> Tuple[str, str]:
+        # queries differing only by whitespace or unicode composition embed identically
+        return model_name, " ".join(unicodedata.normalize("NFC", query).split())
+
+    def get(self, model_name: str, query: str) -> Optional[List[float]]:
+        """Return the cached embedding of a query, if present and not expired."""
+        key = self._key(model_name, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self._ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, model_name: str, query: str, embedding: List[float]) -> None:
+        """Store the embedding of a query, evicting the least recently used entries."""
+        key = self._key(model_name, query)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hit and miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Splitting of documents into chunks measured with the embedding model's own tokenizer.
+
+e5 reads at most 512 tokens, two of them special, and silently ignores the rest. Chunks are cut from the token
+offsets of one batched pass of the model's fast tokenizer, so each holds at most ``chunk_size`` tokens and is
+embedded whole. A chunk ends at the last sentence or line break of its second half when there is one, and the next
+chunk starts ``chunk_overlap`` tokens before that end.
+"""
+from typing import Any, List, Sequence, Tuple
+
+# characters after which a chunk may end cleanly
+_SENTENCE_ENDS = ".!?;:"
+
+
+class TokenChunker:
+    """Cut texts into character spans of at most ``chunk_size`` tokens.
+
+    :param tokenizer: A Hugging Face fast tokenizer, which reports the character offsets of its tokens.
+    :param chunk_size: Maximum number of tokens of a chunk, special tokens excluded.
+    :param chunk_overlap: Number of tokens a chunk shares with the previous one.
+    :param batch_size: Number of texts tokenized per call.
+    """
+
+    def __init__(self, tokenizer: Any, chunk_size: int, chunk_overlap: int, batch_size: int = 64) -> None:
+        if not getattr(tokenizer, "is_fast", False):
+            raise ValueError("The chunker needs a fast tokenizer to map tokens back to characters.")
+        if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("Expected 0 <= chunk_overlap < chunk_size.")
+        self._tokenizer = tokenizer
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._batch_size = batch_size
+
+    def _offsets(self, texts: Sequence[str]) -> List[List[Tuple[int, int]]]:
+        offsets: List[List[Tuple[int, int]]] = []
+        for start in range(0, len(texts), self._batch_size):
+            encoded = self._tokenizer(
+                list(texts[start : start + self._batch_size]),
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                return_attention_mask=False,
+                verbose=False,
+            )
+            offsets.extend([tuple(span) for span in spans] for spans in encoded["offset_mapping"])
+        return offsets
+
+    def count_tokens(self, text: str) -> int:
+        """Count the tokens of a text, special tokens excluded."""
+        return len(self._tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"])
+
+    def split(self, texts: Sequence[str]) -> List[List[Tuple[int, int]]]:
+        """Return the ``(start, end)`` character spans of the chunks of every text."""
+        return [self._split(text, offsets) for text, offsets in zip(texts, self._offsets(texts))]
+
+    def _split(self, text: str, offsets: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        if not offsets:
+            return []
+        spans = []
+        start = 0
+        while start < len(offsets):
+            end = min(start + self.chunk_size, len(offsets))
+            if end < len(offsets):
+                end = self._boundary(text, offsets, start, end)
+            spans.append((offsets[start][0], offsets[end - 1][1]))
+            if end == len(offsets):
+                break
+            start = max(end - self.chunk_overlap, start + 1)
+        return spans
+
+    @staticmethod
+    def _boundary(text: str, offsets: List[Tuple[int, int]], start: int, end: int) -> int:
+        """Move the end of a chunk back to the last sentence or line break of its second half, if any."""
+        for idx in range(end, start + (end - start) // 2, -1):
+            gap = text[offsets[idx - 1][1] : offsets[idx][0]]
+            if "\n" in gap or (gap and text[offsets[idx - 1][1] - 1] in _SENTENCE_ENDS):
+                return idx
+        return end
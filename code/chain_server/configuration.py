@@ -19,16 +19,406 @@ from chain_server.configuration_wizard import ConfigWizard, configclass, configf
 
 @configclass
 class MilvusConfig(ConfigWizard):
-    """Configuration class for the Weaviate connection.
+    """Configuration class for the Milvus connection.
 
     :cvar url: URL of Milvus DB
+    :cvar collection_name: The collection holding the document chunks.
+    :cvar index_type: The vector index type: HNSW, IVF_FLAT, IVF_SQ8, IVF_PQ, DISKANN, AUTOINDEX or FLAT.
+    :cvar metric_type: The similarity metric, IP or L2.
+    :cvar hnsw_m: Maximum number of edges per node of an HNSW graph.
+    :cvar hnsw_ef_construction: Size of the candidate list while building an HNSW graph.
+    :cvar ef: Size of the candidate list of an HNSW search; higher is more accurate and slower.
+    :cvar nlist: Number of clusters of an IVF index.
+    :cvar nprobe: Number of clusters scanned by an IVF search; higher is more accurate and slower.
+    :cvar pq_m: Number of sub-vectors of an IVF_PQ index; must divide the embedding dimension.
+    :cvar pq_nbits: Number of bits per sub-vector code of an IVF_PQ index.
+    :cvar search_list: Size of the candidate list of a DISKANN search.
+    :cvar rescore: Whether the candidates of a compressed index are re-scored with the exact embeddings.
+    :cvar rescore_factor: How many times more candidates than needed are fetched from Milvus for re-scoring.
+    :cvar vector_file_directory: The directory holding the exact embeddings used for re-scoring.
+    :cvar vector_file_dtype: The precision of the exact embeddings, float32 or float16.
     """
 
     url: str = configfield(
         "url",
-        default="http://localhost:9091",
+        default="http://127.0.0.1:19530",
         help_txt="The host of the machine running Milvus DB",
     )
+    collection_name: str = configfield(
+        "collectionName",
+        default="llamalection",
+        help_txt="The collection holding the document chunks.",
+    )
+    index_type: str = configfield(
+        "indexType",
+        default="HNSW",
+        help_txt="The vector index type: HNSW, IVF_FLAT, IVF_SQ8, IVF_PQ, DISKANN, AUTOINDEX or FLAT.",
+    )
+    metric_type: str = configfield(
+        "metricType",
+        default="IP",
+        help_txt="The similarity metric, IP or L2.",
+    )
+    hnsw_m: int = configfield(
+        "hnswM",
+        default=16,
+        help_txt="The maximum number of edges per node of an HNSW graph.",
+    )
+    hnsw_ef_construction: int = configfield(
+        "hnswEfConstruction",
+        default=200,
+        help_txt="The size of the candidate list while building an HNSW graph.",
+    )
+    ef: int = configfield(
+        "ef",
+        default=64,
+        help_txt="The size of the candidate list of an HNSW search.",
+    )
+    nlist: int = configfield(
+        "nlist",
+        default=1024,
+        help_txt="The number of clusters of an IVF index.",
+    )
+    nprobe: int = configfield(
+        "nprobe",
+        default=16,
+        help_txt="The number of clusters scanned by an IVF search.",
+    )
+    pq_m: int = configfield(
+        "pqM",
+        default=64,
+        help_txt="The number of sub-vectors of an IVF_PQ index.",
+    )
+    pq_nbits: int = configfield(
+        "pqNbits",
+        default=8,
+        help_txt="The number of bits per sub-vector code of an IVF_PQ index.",
+    )
+    search_list: int = configfield(
+        "searchList",
+        default=100,
+        help_txt="The size of the candidate list of a DISKANN search.",
+    )
+    rescore: bool = configfield(
+        "rescore",
+        default=False,
+        help_txt="Whether the candidates of a compressed index are re-scored with the exact embeddings.",
+    )
+    rescore_factor: int = configfield(
+        "rescoreFactor",
+        default=4,
+        help_txt="How many times more candidates than needed are fetched from Milvus for re-scoring.",
+    )
+    vector_file_directory: str = configfield(
+        "vectorFileDirectory",
+        default="/project/data/vectors",
+        help_txt="The directory holding the exact embeddings used for re-scoring.",
+    )
+    vector_file_dtype: str = configfield(
+        "vectorFileDtype",
+        default="float32",
+        help_txt="The precision of the exact embeddings, float32 or float16.",
+    )
+
+
+@configclass
+class VectorStoreConfig(ConfigWizard):
+    """Configuration class for the choice of vector store.
+
+    :cvar backend: ``milvus``, or ``embedded`` to keep the chunks in local files inside the chain server process.
+    :cvar directory: The directory holding the embedded store.
+    :cvar hnsw: Whether the embedded store searches an HNSW graph instead of scanning every chunk; needs hnswlib.
+    :cvar hnsw_m: Maximum number of edges per node of the HNSW graph.
+    :cvar hnsw_ef_construction: Size of the candidate list while building the HNSW graph.
+    :cvar hnsw_ef: Size of the candidate list of an HNSW search.
+    """
+
+    backend: str = configfield(
+        "backend",
+        default="milvus",
+        help_txt="The vector store, milvus or embedded.",
+    )
+    directory: str = configfield(
+        "directory",
+        default="/project/data/vector-store",
+        help_txt="The directory holding the embedded store.",
+    )
+    hnsw: bool = configfield(
+        "hnsw",
+        default=False,
+        help_txt="Whether the embedded store searches an HNSW graph instead of scanning every chunk.",
+    )
+    hnsw_m: int = configfield(
+        "hnswM",
+        default=16,
+        help_txt="The maximum number of edges per node of the HNSW graph.",
+    )
+    hnsw_ef_construction: int = configfield(
+        "hnswEfConstruction",
+        default=200,
+        help_txt="The size of the candidate list while building the HNSW graph.",
+    )
+    hnsw_ef: int = configfield(
+        "hnswEf",
+        default=64,
+        help_txt="The size of the candidate list of an HNSW search.",
+    )
+
+
+@configclass
+class IngestionConfig(ConfigWizard):
+    """Configuration class for the document ingestion pipeline.
+
+    :cvar parse_workers: Number of worker processes used to parse uploaded files.
+    :cvar queue_size: Maximum number of items waiting between two pipeline stages.
+    :cvar embed_batch_size: Number of chunks embedded and inserted per batch.
+    :cvar max_jobs: Number of finished ingestion jobs kept for status queries.
+    :cvar table_directory: The directory holding the numeric cells of parsed tables.
+    :cvar fact_directory: The directory holding the numeric facts of parsed XBRL filings.
+    :cvar chunk_size: Maximum number of embedding model tokens of a chunk; at most 510 for e5. Every collection is
+                      served by its own configuration file, so this and ``chunk_overlap`` are set per collection.
+    :cvar chunk_overlap: Number of tokens a chunk shares with the previous chunk of the same page.
+    :cvar page_batch_size: Number of pages of a PDF parsed per task. Longer PDFs are parsed by several tasks in
+                           parallel and their first chunks are embedded while later pages are being parsed; 0 parses
+                           every file whole.
+    :cvar fast_parsing: Whether HTML and text files are parsed directly and born-digital PDFs read from their text
+                        layer, leaving only scans, other formats and the PDF pages holding tables to unstructured.
+    """
+
+    parse_workers: int = configfield(
+        "parseWorkers",
+        default=2,
+        help_txt="The number of worker processes used to parse uploaded files.",
+    )
+    queue_size: int = configfield(
+        "queueSize",
+        default=8,
+        help_txt="The maximum number of items waiting between two ingestion stages.",
+    )
+    embed_batch_size: int = configfield(
+        "embedBatchSize",
+        default=32,
+        help_txt="The number of chunks embedded and inserted per batch.",
+    )
+    max_jobs: int = configfield(
+        "maxJobs",
+        default=1000,
+        help_txt="The number of finished ingestion jobs kept for status queries.",
+    )
+    table_directory: str = configfield(
+        "tableDirectory",
+        default="/project/data/tables",
+        help_txt="The directory holding the numeric cells of parsed tables.",
+    )
+    fact_directory: str = configfield(
+        "factDirectory",
+        default="/project/data/facts",
+        help_txt="The directory holding the numeric facts of parsed XBRL filings.",
+    )
+    chunk_size: int = configfield(
+        "chunkSize",
+        default=500,
+        help_txt="The maximum number of embedding model tokens of a chunk.",
+    )
+    chunk_overlap: int = configfield(
+        "chunkOverlap",
+        default=50,
+        help_txt="The number of tokens a chunk shares with the previous one.",
+    )
+    page_batch_size: int = configfield(
+        "pageBatchSize",
+        default=16,
+        help_txt="The number of pages of a PDF parsed per task, 0 to parse every file whole.",
+    )
+    fast_parsing: bool = configfield(
+        "fastParsing",
+        default=True,
+        help_txt="Whether HTML, text and born-digital PDF pages without tables are parsed without unstructured.",
+    )
+
+
+@configclass
+class CacheConfig(ConfigWizard):
+    """Configuration class for the parsed chunk and embedding cache.
+
+    :cvar enabled: Whether ingestion reuses previously parsed chunks and embeddings.
+    :cvar directory: The directory holding the cache.
+    :cvar query_cache_size: The maximum number of query embeddings kept in memory.
+    :cvar query_cache_ttl: The number of seconds a query embedding stays cached.
+    """
+
+    enabled: bool = configfield(
+        "enabled",
+        default=True,
+        help_txt="Whether ingestion reuses previously parsed chunks and embeddings.",
+    )
+    directory: str = configfield(
+        "directory",
+        default="/project/data/cache",
+        help_txt="The directory holding the parsed chunk and embedding cache.",
+    )
+    query_cache_size: int = configfield(
+        "queryCacheSize",
+        default=1024,
+        help_txt="The maximum number of query embeddings kept in memory.",
+    )
+    query_cache_ttl: float = configfield(
+        "queryCacheTtl",
+        default=3600.0,
+        help_txt="The number of seconds a query embedding stays cached.",
+    )
+
+
+@configclass
+class RetrievalConfig(ConfigWizard):
+    """Configuration class for document retrieval.
+
+    :cvar workers: Number of threads running blocking retrievals for the async chains.
+    :cvar embed_max_batch: Maximum number of concurrent queries embedded in one batch.
+    :cvar embed_window_ms: Milliseconds a query waits for others to share its embedding batch.
+    :cvar candidates: Number of chunks fetched from the vector db before reranking.
+    :cvar rerank: Whether a cross-encoder reorders the candidates.
+    :cvar rerank_model: The cross-encoder model used for reranking.
+    :cvar rerank_device: The device the cross-encoder runs on.
+    :cvar rerank_batch_size: Number of candidates scored per cross-encoder forward pass.
+    :cvar hybrid: Whether a BM25 index is searched alongside the vector db and fused with its results.
+    :cvar sparse_directory: The directory holding the BM25 index.
+    :cvar rrf_k: The rank offset of reciprocal rank fusion; larger values flatten the weight of top ranks.
+    :cvar sparse_filter_factor: Multiple of the requested matches fetched from the BM25 index when metadata filters
+                                are set, since the index cannot apply them itself.
+    :cvar max_context_tokens: Maximum number of tokens of retrieved context placed in a prompt. The context window
+                              of the target model is always enforced; this cap only keeps prefill short.
+    :cvar fact_answers: How single number questions matching an indexed XBRL fact are answered: ``context`` places
+                        the fact first in the retrieved context of the LLM, ``direct`` replies with the fact without
+                        retrieval or the LLM, ``off`` never looks facts up.
+    """
+
+    workers: int = configfield(
+        "workers",
+        default=8,
+        help_txt="The number of threads running blocking retrievals for the async chains.",
+    )
+    embed_max_batch: int = configfield(
+        "embedMaxBatch",
+        default=16,
+        help_txt="The maximum number of concurrent queries embedded in one batch.",
+    )
+    embed_window_ms: float = configfield(
+        "embedWindowMs",
+        default=3.0,
+        help_txt="The number of milliseconds a query waits for others to share its embedding batch.",
+    )
+    candidates: int = configfield(
+        "candidates",
+        default=50,
+        help_txt="The number of chunks fetched from the vector db before reranking.",
+    )
+    rerank: bool = configfield(
+        "rerank",
+        default=True,
+        help_txt="Whether a cross-encoder reorders the retrieved candidates.",
+    )
+    rerank_model: str = configfield(
+        "rerankModel",
+        default="cross-encoder/ms-marco-MiniLM-L-6-v2",
+        help_txt="The cross-encoder model used for reranking.",
+    )
+    rerank_device: str = configfield(
+        "rerankDevice",
+        default="cpu",
+        help_txt="The device the cross-encoder runs on.",
+    )
+    rerank_batch_size: int = configfield(
+        "rerankBatchSize",
+        default=32,
+        help_txt="The number of candidates scored per cross-encoder forward pass.",
+    )
+    hybrid: bool = configfield(
+        "hybrid",
+        default=True,
+        help_txt="Whether a BM25 index is searched alongside the vector db and fused with its results.",
+    )
+    sparse_directory: str = configfield(
+        "sparseDirectory",
+        default="/project/data/sparse-index",
+        help_txt="The directory holding the BM25 index.",
+    )
+    rrf_k: int = configfield(
+        "rrfK",
+        default=60,
+        help_txt="The rank offset of reciprocal rank fusion.",
+    )
+    sparse_filter_factor: int = configfield(
+        "sparseFilterFactor",
+        default=4,
+        help_txt="The multiple of BM25 matches fetched when metadata filters are set.",
+    )
+    max_context_tokens: int = configfield(
+        "maxContextTokens",
+        default=2000,
+        help_txt="The maximum number of tokens of retrieved context placed in a prompt, below the model's window.",
+    )
+    fact_answers: str = configfield(
+        "factAnswers",
+        default="context",
+        help_txt="How questions matching an XBRL fact are answered: context, direct or off.",
+    )
+
+
+@configclass
+class LLMConfig(ConfigWizard):
+    """Configuration class for the connections to the LLM backends.
+
+    :cvar max_clients: Maximum number of backend clients kept open at once.
+    :cvar max_connections: Maximum number of open connections per backend.
+    :cvar max_keepalive_connections: Maximum number of idle connections kept alive per backend.
+    :cvar http2: Whether to use HTTP/2 where the backend and installed packages support it.
+    :cvar timeout: Number of seconds to wait for a backend response.
+    :cvar local_max_input_tokens: Maximum number of prompt tokens the local inference server accepts.
+    :cvar local_max_total_tokens: Maximum number of prompt and generated tokens the local inference server accepts.
+    :cvar remote_context_window: Context window assumed for hosted and NIM models.
+    """
+
+    max_clients: int = configfield(
+        "maxClients",
+        default=16,
+        help_txt="The maximum number of LLM backend clients kept open at once.",
+    )
+    max_connections: int = configfield(
+        "maxConnections",
+        default=100,
+        help_txt="The maximum number of open connections per LLM backend.",
+    )
+    max_keepalive_connections: int = configfield(
+        "maxKeepaliveConnections",
+        default=20,
+        help_txt="The maximum number of idle connections kept alive per LLM backend.",
+    )
+    http2: bool = configfield(
+        "http2",
+        default=True,
+        help_txt="Whether to use HTTP/2 where the backend and installed packages support it.",
+    )
+    timeout: float = configfield(
+        "timeout",
+        default=120.0,
+        help_txt="The number of seconds to wait for an LLM backend response.",
+    )
+    local_max_input_tokens: int = configfield(
+        "localMaxInputTokens",
+        default=5000,
+        help_txt="The maximum number of prompt tokens the local inference server accepts (--max-input-tokens).",
+    )
+    local_max_total_tokens: int = configfield(
+        "localMaxTotalTokens",
+        default=5500,
+        help_txt="The maximum number of prompt and generated tokens the local inference server accepts (--max-total-tokens).",
+    )
+    remote_context_window: int = configfield(
+        "remoteContextWindow",
+        default=8192,
+        help_txt="The context window assumed for hosted and NIM models.",
+    )
 
 
 # @configclass
@@ -57,12 +447,55 @@ class AppConfig(ConfigWizard):
 
     :cvar milvus: The configuration of the Milvus vector db connection.
     :type milvus: MilvusConfig
+    :cvar vector_store: The choice of vector store.
+    :type vector_store: VectorStoreConfig
+    :cvar ingestion: The configuration of the document ingestion pipeline.
+    :type ingestion: IngestionConfig
+    :cvar cache: The configuration of the parsed chunk and embedding cache.
+    :type cache: CacheConfig
+    :cvar retrieval: The configuration of document retrieval.
+    :type retrieval: RetrievalConfig
+    :cvar llm: The configuration of the connections to the LLM backends.
+    :type llm: LLMConfig
     :cvar triton: The configuration of the backend Triton server.
     :type triton: TritonConfig
     """
 
     milvus: MilvusConfig = configfield(
-        "milvus", env=False, default="http://127.0.0.1:19530", help_txt="The configuration of the Milvus connection."
+        "milvus",
+        env=False,
+        default_factory=MilvusConfig,
+        help_txt="The configuration of the Milvus connection.",
+    )
+    vector_store: VectorStoreConfig = configfield(
+        "vectorStore",
+        env=False,
+        default_factory=VectorStoreConfig,
+        help_txt="The choice of vector store.",
+    )
+    ingestion: IngestionConfig = configfield(
+        "ingestion",
+        env=False,
+        default_factory=IngestionConfig,
+        help_txt="The configuration of the document ingestion pipeline.",
+    )
+    cache: CacheConfig = configfield(
+        "cache",
+        env=False,
+        default_factory=CacheConfig,
+        help_txt="The configuration of the parsed chunk and embedding cache.",
+    )
+    retrieval: RetrievalConfig = configfield(
+        "retrieval",
+        env=False,
+        default_factory=RetrievalConfig,
+        help_txt="The configuration of document retrieval.",
+    )
+    llm: LLMConfig = configfield(
+        "llm",
+        env=False,
+        default_factory=LLMConfig,
+        help_txt="The configuration of the connections to the LLM backends.",
     )
     # triton: TritonConfig = configfield(
     #     "triton",
@@ -0,0 +1,175 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Packing of retrieved chunks into the context window of the target model.
+
+Chunks are taken greedily by score. Text a chunk shares with an already packed chunk of the same document (the
+splitter overlaps neighbouring chunks) is dropped, and the chunk that no longer fits is cut at the last sentence
+boundary within the budget, so the prompt never exceeds what the model accepts. Table chunks are never cut; one
+that does not fit is skipped in favour of smaller chunks.
+"""
+import re
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set, Tuple
+
+from llama_index.schema import NodeWithScore, TextNode
+
+from chain_server.tables import CONTENT_TYPE, TABLE
+
+if TYPE_CHECKING:
+    from llama_index.schema import BaseNode
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+class ContextPacker:
+    """Fit the best retrieved chunks into a token budget measured with the target model's tokenizer."""
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        max_input_tokens: int,
+        max_total_tokens: Optional[int] = None,
+        separator: str = "\n\n",
+        min_sentence_tokens: int = 16,
+    ) -> None:
+        """Initialize the packer.
+
+        :param count_tokens: Counts the tokens of a text with the target model's tokenizer.
+        :param max_input_tokens: The number of prompt tokens the model accepts.
+        :param max_total_tokens: The number of prompt and generated tokens the model accepts, if limited separately.
+        :param min_sentence_tokens: Truncated chunks shorter than this are left out.
+        """
+        self._count_tokens = count_tokens
+        self._max_input_tokens = max_input_tokens
+        self._max_total_tokens = max_total_tokens
+        self._separator = separator
+        self._separator_tokens = count_tokens(separator)
+        self._min_sentence_tokens = min_sentence_tokens
+
+    def budget(self, prompt_tokens: int, num_tokens: int, max_context_tokens: Optional[int] = None) -> int:
+        """Return the number of context tokens left once the prompt and the generated tokens are accounted for."""
+        limit = self._max_input_tokens
+        if self._max_total_tokens is not None:
+            limit = min(limit, self._max_total_tokens - num_tokens)
+        budget = limit - prompt_tokens
+        if max_context_tokens is not None:
+            budget = min(budget, max_context_tokens)
+        return max(budget, 0)
+
+    def pack(self, nodes: List[NodeWithScore], budget: int) -> List[NodeWithScore]:
+        """Return copies of the best nodes, deduplicated and truncated so their texts fit in ``budget`` tokens."""
+        packed: List[NodeWithScore] = []
+        covered: Dict[str, List[Tuple[int, int]]] = {}
+        seen_texts: Set[str] = set()
+        remaining = budget
+
+        for node in sorted(nodes, key=lambda node: node.score or 0.0, reverse=True):
+            text = self._uncovered_text(node.node, covered)
+            key = " ".join(text.split())
+            if not key or key in seen_texts:
+                continue
+
+            cost = self._count_tokens(text) + (self._separator_tokens if packed else 0)
+            if cost > remaining:
+                # a truncated table loses the rows the question was about; a smaller chunk may still fit
+                if node.node.metadata.get(CONTENT_TYPE) == TABLE:
+                    continue
+                text = self._truncate(text, remaining - (self._separator_tokens if packed else 0))
+                if not text:
+                    break
+                cost = remaining
+
+            seen_texts.add(key)
+            packed.append(self._copy(node, text))
+            remaining -= cost
+            self._mark_covered(node.node, covered)
+            if remaining <= 0:
+                break
+        return packed
+
+    def join(self, nodes: List[NodeWithScore]) -> str:
+        """Join packed nodes into the context string of a prompt."""
+        return self._separator.join(node.node.get_content() for node in nodes)
+
+    @staticmethod
+    def _span(node: "BaseNode") -> Optional[Tuple[str, int, int]]:
+        start = getattr(node, "start_char_idx", None)
+        end = getattr(node, "end_char_idx", None)
+        if node.ref_doc_id is None or start is None or end is None:
+            return None
+        return node.ref_doc_id, start, end
+
+    def _uncovered_text(self, node: "BaseNode", covered: Dict[str, List[Tuple[int, int]]]) -> str:
+        """Return the longest part of a chunk not already covered by packed chunks of the same document."""
+        text = node.get_content()
+        span = self._span(node)
+        if span is None or span[0] not in covered:
+            return text
+        _, start, end = span
+
+        # walk the packed ranges and keep the longest gap inside [start, end)
+        best = (0, 0)
+        cursor = start
+        for covered_start, covered_end in sorted(covered[span[0]]):
+            if covered_end <= cursor or covered_start >= end:
+                continue
+            if covered_start > cursor and covered_start - cursor > best[1] - best[0]:
+                best = (cursor, covered_start)
+            cursor = max(cursor, covered_end)
+        if end > cursor and end - cursor > best[1] - best[0]:
+            best = (cursor, end)
+        if best == (start, end):
+            return text
+        if best[1] <= best[0]:
+            return ""
+        return text[best[0] - start : best[1] - start].strip()
+
+    def _mark_covered(self, node: "BaseNode", covered: Dict[str, List[Tuple[int, int]]]) -> None:
+        span = self._span(node)
+        if span is not None:
+            covered.setdefault(span[0], []).append((span[1], span[2]))
+
+    def _truncate(self, text: str, budget: int) -> str:
+        """Cut a text at the last sentence boundary that fits in ``budget`` tokens."""
+        if budget < self._min_sentence_tokens:
+            return ""
+        kept: List[str] = []
+        used = 0
+        for sentence in _SENTENCE_END.split(text):
+            if not sentence.strip():
+                continue
+            # counting sentences one by one may differ by a token at each boundary, so leave one spare
+            cost = self._count_tokens(sentence) + 1
+            if used + cost > budget:
+                break
+            kept.append(sentence.strip())
+            used += cost
+        if used < self._min_sentence_tokens:
+            return ""
+        return " ".join(kept)
+
+    @staticmethod
+    def _copy(node: NodeWithScore, text: str) -> NodeWithScore:
+        """Copy a node with a new text, leaving the retrieved node untouched for the API response."""
+        if text == node.node.get_content():
+            return node
+        copy = TextNode(
+            id_=node.node.node_id,
+            text=text,
+            metadata=dict(node.node.metadata),
+            excluded_llm_metadata_keys=node.node.excluded_llm_metadata_keys,
+            excluded_embed_metadata_keys=node.node.excluded_embed_metadata_keys,
+        )
+        return NodeWithScore(node=copy, score=node.score)
@@ -0,0 +1,253 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A vector store embedded in the chain server process, for deployments too small to justify running Milvus.
+
+Opening it maps files instead of starting a database, so the server is ready in well under a second::
+
+    vectors/        the embeddings, a memory mapped matrix with its append log, see :class:`vector_file.VectorFile`
+    nodes.jsonl     the append log of the chunks: ``[node id, record]`` for an insert, ``[node id, null]`` for a delete
+    hnsw.bin        the optional HNSW graph over the rows of the matrix
+    hnsw.json       how many rows the saved graph covers
+
+Records are the flattened node dictionaries llama_index stores in Milvus rows, so both stores rebuild nodes the
+same way and metadata filters see the same fields. Searches scan the matrix exactly unless the HNSW graph is enabled;
+filtered searches always scan the matching chunks exactly. Rows of deleted or replaced chunks stay in the matrix and
+in the graph and are skipped; ``rm -r`` the directory and re-upload to reclaim them.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.schema import BaseNode
+from llama_index.vector_stores.types import VectorStore, VectorStoreQuery, VectorStoreQueryResult
+from llama_index.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+from chain_server.metadata import matches_filters
+from chain_server.vector_file import VectorFile, read_log
+
+_LOGGER = logging.getLogger(__name__)
+
+# the graph is saved once this many rows were added since the last save; rows added after it are re-inserted on load
+_HNSW_SAVE_EVERY = 4096
+
+
+class _HnswGraph:
+    """An hnswlib graph labelled by row of the vector file, saved to disk from time to time."""
+
+    def __init__(self, directory: str, dim: int, m: int, ef_construction: int, ef: int) -> None:
+        try:
+            # pylint: disable=import-outside-toplevel; optional dependency
+            import hnswlib
+        except ImportError as err:
+            raise ImportError("The HNSW graph of the embedded vector store requires `pip install hnswlib`.") from err
+
+        self._path = os.path.join(directory, "hnsw.bin")
+        self._meta_path = os.path.join(directory, "hnsw.json")
+        self._lock = threading.Lock()
+        self._index = hnswlib.Index(space="ip", dim=dim)
+        self._covered = 0
+        if os.path.exists(self._path) and os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                self._covered = json.load(f)["rows"]
+            self._index.load_index(self._path)
+        else:
+            self._index.init_index(max_elements=1024, ef_construction=ef_construction, M=m)
+        self._saved = self._covered
+        self._index.set_ef(ef)
+
+    def sync(self, vectors: VectorFile) -> None:
+        """Insert the rows appended to the vector file since the graph last saw it."""
+        with self._lock:
+            if self._covered >= vectors.num_rows:
+                return
+            needed = vectors.num_rows
+            if needed > self._index.get_max_elements():
+                self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+            for start in range(self._covered, needed, 8192):
+                stop = min(start + 8192, needed)
+                self._index.add_items(vectors.rows(start, stop), np.arange(start, stop))
+            self._covered = needed
+            if self._covered - self._saved >= _HNSW_SAVE_EVERY:
+                self._save()
+
+    def _save(self) -> None:
+        self._index.save_index(self._path + ".tmp")
+        os.replace(self._path + ".tmp", self._path)
+        with open(self._meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"rows": self._covered}, f)
+        os.replace(self._meta_path + ".tmp", self._meta_path)
+        self._saved = self._covered
+
+    def search(self, vectors: VectorFile, query: Sequence[float], top_k: int) -> List[Tuple[str, float]]:
+        """Return the ``top_k`` best live nodes for a query, best first."""
+        with self._lock:
+            num_live = min(top_k, len(vectors))
+            if num_live == 0:
+                return []
+            labels, distances = self._index.knn_query(
+                np.asarray([query], dtype=np.float32),
+                k=num_live,
+                # rows of deleted and replaced chunks stay in the graph to route searches
+                filter=lambda row: vectors.node_id(row) is not None,
+            )
+        # hnswlib reports the inner product as the distance 1 - ip
+        return [(vectors.node_id(int(row)), 1.0 - float(dist)) for row, dist in zip(labels[0], distances[0])]
+
+
+class EmbeddedVectorStore(VectorStore):
+    """A llama_index vector store keeping chunks and embeddings in local files.
+
+    Chunks are scored by inner product, like the default ``IP`` metric of the Milvus collection. The embedding
+    backends do not normalize the e5 embeddings, so the scores are not cosine similarities.
+
+    :param directory: The directory holding the store.
+    :param dim: The dimension of the embeddings.
+    :param hnsw: Whether searches go through an HNSW graph instead of an exact scan.
+    :param hnsw_m: Maximum number of edges per node of the graph.
+    :param hnsw_ef_construction: Size of the candidate list while building the graph.
+    :param hnsw_ef: Size of the candidate list of a search.
+    """
+
+    stores_text: bool = True
+
+    def __init__(
+        self,
+        directory: str,
+        dim: int,
+        hnsw: bool = False,
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 200,
+        hnsw_ef: int = 64,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._vectors = VectorFile(os.path.join(directory, "vectors"), dim)
+        self._log_path = os.path.join(directory, "nodes.jsonl")
+        self._records: Dict[str, Dict[str, Any]] = {}
+        for node_id, record in read_log(self._log_path):
+            if record is None:
+                self._records.pop(node_id, None)
+            else:
+                self._records[node_id] = record
+
+        self._graph: Optional[_HnswGraph] = None
+        if hnsw:
+            self._graph = _HnswGraph(directory, dim, hnsw_m, hnsw_ef_construction, hnsw_ef)
+            self._graph.sync(self._vectors)
+        _LOGGER.info("Opened the embedded vector store with %d chunks", len(self._records))
+
+    @property
+    def client(self) -> "EmbeddedVectorStore":
+        """The store is its own client."""
+        return self
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """Store embedded nodes, replacing earlier versions with the same id."""
+        if not nodes:
+            return []
+        records = [
+            (node.node_id, node_to_metadata_dict(node, remove_text=False, flat_metadata=True)) for node in nodes
+        ]
+        with self._lock:
+            # embeddings first: a chunk whose record is not logged yet is skipped by searches
+            self._vectors.add((node.node_id, node.get_embedding()) for node in nodes)
+            with open(self._log_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps([node_id, record]) + "\n" for node_id, record in records)
+            self._records.update(records)
+        if self._graph is not None:
+            self._graph.sync(self._vectors)
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """Delete every chunk of a source document."""
+        with self._lock:
+            node_ids = [node_id for node_id, record in self._records.items() if record.get("ref_doc_id") == ref_doc_id]
+        self.delete_nodes(node_ids)
+
+    def delete_nodes(self, node_ids: Sequence[str]) -> None:
+        """Delete chunks by id."""
+        with self._lock:
+            deleted = [node_id for node_id in node_ids if self._records.pop(node_id, None) is not None]
+            if deleted:
+                with open(self._log_path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps([node_id, None]) + "\n" for node_id in deleted)
+                self._vectors.delete(deleted)
+
+    def node_ids(self, filename: Optional[str] = None) -> List[str]:
+        """Return the ids of every stored chunk, or of those of one file."""
+        with self._lock:
+            if filename is None:
+                return list(self._records)
+            return [node_id for node_id, record in self._records.items() if record.get("filename") == filename]
+
+    def get(self, node_ids: Sequence[str], filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Return the records of the given chunks that match the API filters, see :func:`metadata.matches_filters`."""
+        with self._lock:
+            records = [self._records.get(node_id) for node_id in node_ids]
+        return [record for record in records if record is not None and matches_filters(record, filters)]
+
+    def _nearest(
+        self, embedding: Sequence[float], top_k: int, candidates: Optional[List[str]]
+    ) -> List[Tuple[str, Dict[str, Any], float]]:
+        hits = None
+        if self._graph is not None and candidates is None:
+            try:
+                hits = self._graph.search(self._vectors, embedding, top_k)
+            except RuntimeError:
+                # hnswlib fails when too many of the rows it reaches are deleted ones
+                _LOGGER.warning("The HNSW search found fewer than %d live chunks, scanning instead", top_k)
+        if hits is None:
+            hits = self._vectors.search(embedding, top_k, node_ids=candidates)
+        with self._lock:
+            return [
+                (node_id, self._records[node_id], score) for node_id, score in hits if node_id in self._records
+            ]
+
+    def search(
+        self, embedding: Sequence[float], top_k: int, filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """Return the records and scores of the ``top_k`` chunks closest to an embedding, best first."""
+        candidates = None
+        if filters:
+            with self._lock:
+                candidates = [node_id for node_id, record in self._records.items() if matches_filters(record, filters)]
+        return [(record, score) for _, record, score in self._nearest(embedding, top_k, candidates)]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """Answer a llama_index query; exact match metadata filters and node id restrictions are honoured."""
+        candidates = None
+        if query.node_ids is not None or query.filters is not None:
+            conditions = [(f.key, f.value) for f in query.filters.filters] if query.filters is not None else []
+            wanted = set(query.node_ids) if query.node_ids is not None else None
+            with self._lock:
+                candidates = [
+                    node_id
+                    for node_id, record in self._records.items()
+                    if (wanted is None or node_id in wanted) and all(record.get(k) == v for k, v in conditions)
+                ]
+        hits = self._nearest(query.query_embedding, query.similarity_top_k, candidates)
+        return VectorStoreQueryResult(
+            nodes=[metadata_dict_to_node(record) for _, record, _ in hits],
+            similarities=[score for _, _, score in hits],
+            ids=[node_id for node_id, _, _ in hits],
+        )
@@ -0,0 +1,132 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Selectable inference backends for the embedding model.
+
+The backend is chosen with the ``EMBEDDING_BACKEND`` environment variable:
+
+* ``torch`` (default): fp32 PyTorch through sentence-transformers.
+* ``torch-bf16``: PyTorch with bfloat16 weights, about twice as fast on CPUs with AVX512-BF16/AMX and on GPUs.
+* ``onnx-int8``: ONNX Runtime with dynamic int8 quantisation, the fastest option on CPU. Requires the
+  optional ``optimum[onnxruntime]`` package.
+
+Every backend implements the langchain ``Embeddings`` interface and mean-pools like the fp32 model, so the
+outputs are interchangeable up to numerical error. ``scripts/helpers/embedding-parity.py`` measures that error.
+"""
+import os
+import platform
+from typing import Any, List
+
+import numpy as np
+from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings.base import Embeddings
+
+BACKEND_TORCH = "torch"
+BACKEND_TORCH_BF16 = "torch-bf16"
+BACKEND_ONNX_INT8 = "onnx-int8"
+BACKENDS = (BACKEND_TORCH, BACKEND_TORCH_BF16, BACKEND_ONNX_INT8)
+MAX_SEQ_LENGTH = 512
+
+
+class TorchBF16Embeddings(Embeddings):
+    """A sentence-transformers model running with bfloat16 weights."""
+
+    def __init__(self, model_name: str, device: str) -> None:
+        """Load the model and cast its weights."""
+        # pylint: disable=import-outside-toplevel; only needed by this backend
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(model_name, device=device)
+        self._model.to(torch.bfloat16)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts."""
+        embeddings = self._model.encode(texts, convert_to_tensor=True, normalize_embeddings=False)
+        # numpy has no bfloat16, so widen on the way out
+        return embeddings.float().cpu().tolist()  # type: ignore[no-any-return]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single text."""
+        return self.embed_documents([text])[0]
+
+
+class OnnxInt8Embeddings(Embeddings):
+    """A dynamically int8 quantised ONNX export of a Hugging Face encoder running on ONNX Runtime."""
+
+    def __init__(self, model_name: str, model_dir: str) -> None:
+        """Load the quantised model, exporting and quantising it on first use."""
+        try:
+            # pylint: disable=import-outside-toplevel; optional dependency
+            from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            from transformers import AutoTokenizer
+        except ImportError as err:
+            raise ImportError(
+                f"The {BACKEND_ONNX_INT8} embedding backend requires `pip install optimum[onnxruntime]`."
+            ) from err
+
+        quantized_dir = os.path.join(model_dir, model_name.replace("/", "__") + "-int8")
+        if not os.path.exists(os.path.join(quantized_dir, "model_quantized.onnx")):
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            if platform.machine() in ("arm64", "aarch64"):
+                qconfig = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+            else:
+                qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            ORTQuantizer.from_pretrained(model).quantize(save_dir=quantized_dir, quantization_config=qconfig)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(quantized_dir)
+
+        self._tokenizer = AutoTokenizer.from_pretrained(quantized_dir)
+        self._model = ORTModelForFeatureExtraction.from_pretrained(quantized_dir, file_name="model_quantized.onnx")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts."""
+        inputs = self._tokenizer(
+            texts, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np"
+        )
+        hidden = self._model(**inputs).last_hidden_state
+        hidden = np.asarray(hidden, dtype=np.float32)
+        # mean pooling over the real tokens, as the sentence-transformers config of the model does
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled.tolist()  # type: ignore[no-any-return]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single text."""
+        return self.embed_documents([text])[0]
+
+
+def get_embedding_backend() -> str:
+    """Return the embedding backend selected in the environment."""
+    backend = os.environ.get("EMBEDDING_BACKEND", BACKEND_TORCH).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)}.")
+    return backend
+
+
+def create_embeddings(backend: str, model_name: str, device: str, model_dir: str) -> Any:
+    """Instantiate an embedding model on the requested backend.
+
+    :param model_dir: Where converted models, such as the quantised ONNX export, are kept.
+    """
+    if backend == BACKEND_TORCH_BF16:
+        return TorchBF16Embeddings(model_name, device)
+    if backend == BACKEND_ONNX_INT8:
+        return OnnxInt8Embeddings(model_name, model_dir)
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": device},
+        encode_kwargs={"normalize_embeddings": False},
+    )
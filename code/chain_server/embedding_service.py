@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Dynamic micro-batching of concurrent embedding requests.
+
+Requests arriving within a short window are embedded together in one forward pass, which costs little more
+than embedding a single text, and the results are handed back to the waiting callers.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Collect concurrent embedding requests and run them as batches on a background thread."""
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 3.0,
+        sort_by_length: bool = False,
+        sub_batch_size: int = 8,
+    ) -> None:
+        """Start the batching thread.
+
+        :param embed_batch: Embeds a list of texts in a single call.
+        :param max_batch_size: Maximum number of requests run together.
+        :param max_wait_ms: How long the first request of a batch waits for others to join it.
+        :param sort_by_length: Group texts of similar length into sub-batches of ``sub_batch_size`` so little
+                               compute is spent on padding. Worth it on CPU, where padding is not free.
+        """
+        self._embed_batch = embed_batch
+        self._max_batch_size = max(1, max_batch_size)
+        self._max_wait = max_wait_ms / 1000
+        self._sort_by_length = sort_by_length
+        self._sub_batch_size = max(1, sub_batch_size)
+        self._queue: "queue.Queue[Tuple[str, Future[List[float]]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._largest_batch = 0
+        thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        thread.start()
+
+    def submit(self, text: str) -> "Future[List[float]]":
+        """Queue a text and return the future of its embedding."""
+        future: "Future[List[float]]" = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        """Embed a text, blocking until its batch has run."""
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect(self) -> List[Tuple[str, "Future[List[float]]"]]:
+        """Wait for a request, then gather more until the batch is full or the window closes."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        if not self._sort_by_length or len(texts) <= self._sub_batch_size:
+            return self._embed_batch(texts)
+
+        order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]))
+        embeddings: List[Any] = [None] * len(texts)
+        for start in range(0, len(order), self._sub_batch_size):
+            indices = order[start : start + self._sub_batch_size]
+            for idx, embedding in zip(indices, self._embed_batch([texts[idx] for idx in indices])):
+                embeddings[idx] = embedding
+        return embeddings
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                embeddings = self._embed_texts([text for text, _ in batch])
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                _LOGGER.error("Embedding a batch of %d texts failed: %s", len(batch), err)
+                for _, future in batch:
+                    future.set_exception(err)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+            with self._lock:
+                self._requests += len(batch)
+                self._batches += 1
+                self._largest_batch = max(self._largest_batch, len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the batching counters."""
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "batches": self._batches,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "pending": self._queue.qsize(),
+            }
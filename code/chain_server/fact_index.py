@@ -0,0 +1,516 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-memory index of the headline XBRL facts, answering single number questions without retrieval.
+
+Questions like "What was NVIDIA's Q3 FY2024 revenue?" have one number for an answer, which the filing states as a
+tagged fact. The facts of the fact store, see :mod:`chain_server.xbrl`, are indexed by ``(entity, metric, fiscal
+year, fiscal quarter)``, with quarter 0 for a whole fiscal year, so such a question costs one dictionary lookup.
+
+Only facts about the entity as a whole, without dimensions, of the metrics in :data:`METRICS` are indexed. Fiscal
+periods are derived from the reported dates and the entity's fiscal year end, as stated on the cover page of its
+filings. When several filings report the same fact, the most recent filing wins, so restated figures replace the
+original ones. Questions are answered from the index only when nothing but a company, a metric, a period and filler
+words is left of them, see :func:`parse_question`.
+"""
+import datetime
+import logging
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from chain_server.metadata import matches_filters
+from chain_server.xbrl import FactStore
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Metric(NamedTuple):
+    """A metric questions ask about.
+
+    :param label: How answers name the metric.
+    :param concepts: The XBRL concepts reporting it, preferred first.
+    :param phrases: How questions name it.
+    """
+
+    label: str
+    concepts: Tuple[str, ...]
+    phrases: Tuple[str, ...]
+
+
+METRICS: Dict[str, Metric] = {
+    "revenue": Metric(
+        "revenue",
+        (
+            "us-gaap:Revenues",
+            "us-gaap:RevenueFromContractWithCustomerExcludingAssessedTax",
+            "us-gaap:RevenueFromContractWithCustomerIncludingAssessedTax",
+            "us-gaap:SalesRevenueNet",
+        ),
+        ("total revenues", "total revenue", "net revenues", "net revenue", "revenues", "revenue", "total net sales",
+         "net sales", "sales", "top line"),
+    ),
+    "cost_of_revenue": Metric(
+        "cost of revenue",
+        ("us-gaap:CostOfRevenue", "us-gaap:CostOfGoodsAndServicesSold", "us-gaap:CostOfGoodsSold"),
+        ("cost of revenues", "cost of revenue", "cost of sales", "cost of goods sold", "cogs"),
+    ),
+    "gross_profit": Metric("gross profit", ("us-gaap:GrossProfit",), ("gross profit",)),
+    "operating_income": Metric(
+        "operating income",
+        ("us-gaap:OperatingIncomeLoss",),
+        ("operating income", "income from operations", "operating profit", "operating loss"),
+    ),
+    "net_income": Metric(
+        "net income",
+        ("us-gaap:NetIncomeLoss", "us-gaap:ProfitLoss"),
+        ("net income", "net earnings", "net loss", "net profit", "bottom line"),
+    ),
+    "eps_diluted": Metric(
+        "diluted earnings per share",
+        ("us-gaap:EarningsPerShareDiluted",),
+        ("diluted earnings per share", "earnings per diluted share", "diluted eps", "earnings per share", "eps"),
+    ),
+    "eps_basic": Metric(
+        "basic earnings per share",
+        ("us-gaap:EarningsPerShareBasic",),
+        ("basic earnings per share", "earnings per basic share", "basic eps"),
+    ),
+    "research_and_development": Metric(
+        "research and development expense",
+        ("us-gaap:ResearchAndDevelopmentExpense",),
+        ("research and development", "r&d"),
+    ),
+    "operating_expenses": Metric(
+        "operating expenses",
+        ("us-gaap:OperatingExpenses",),
+        ("total operating expenses", "operating expenses", "opex"),
+    ),
+    "operating_cash_flow": Metric(
+        "cash from operating activities",
+        ("us-gaap:NetCashProvidedByUsedInOperatingActivities",),
+        ("net cash provided by operating activities", "cash provided by operating activities", "operating cash flow",
+         "cash flow from operations", "cash from operations"),
+    ),
+    "capital_expenditures": Metric(
+        "capital expenditures",
+        ("us-gaap:PaymentsToAcquirePropertyPlantAndEquipment",),
+        ("capital expenditures", "capital expenditure", "capex"),
+    ),
+    "total_assets": Metric("total assets", ("us-gaap:Assets",), ("total assets",)),
+    "total_liabilities": Metric("total liabilities", ("us-gaap:Liabilities",), ("total liabilities",)),
+    "stockholders_equity": Metric(
+        "stockholders' equity",
+        ("us-gaap:StockholdersEquity",),
+        ("total stockholders' equity", "total shareholders' equity", "stockholders' equity", "shareholders' equity",
+         "stockholders equity", "shareholders equity", "total equity"),
+    ),
+    "cash": Metric(
+        "cash and cash equivalents",
+        ("us-gaap:CashAndCashEquivalentsAtCarryingValue",),
+        ("cash and cash equivalents", "cash balance"),
+    ),
+}
+
+# concept -> (metric, preference), lower preferences first
+_CONCEPTS = {
+    concept: (metric, rank) for metric, spec in METRICS.items() for rank, concept in enumerate(spec.concepts)
+}
+# question phrases, longest first so "gross profit" is not read as "profit"
+_PHRASES = sorted(
+    ((phrase, metric) for metric, spec in METRICS.items() for phrase in spec.phrases), key=lambda p: -len(p[0])
+)
+
+_ENTITY_SUFFIXES = {
+    "the", "inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited", "plc", "llc", "lp",
+    "holdings", "group", "sa", "nv", "ag", "se",
+}
+_QUARTER = re.compile(
+    r"\b(?:q([1-4])|([1-4])q|(first|second|third|fourth|1st|2nd|3rd|4th)\s+(?:fiscal\s+)?quarter)\b", re.IGNORECASE
+)
+_QUARTER_WORDS = {"first": 1, "second": 2, "third": 3, "fourth": 4, "1st": 1, "2nd": 2, "3rd": 3, "4th": 4}
+_YEAR = re.compile(r"\b(?:fy\s?'?|fiscal\s+(?:year\s+)?)?((?:19|20)\d{2})\b|\bfy\s?'?(\d{2})\b", re.IGNORECASE)
+# the words a single number question may hold besides its company, metric and period; any other word, as in
+# "iPhone revenue", "revenue from China" or "net income attributable to noncontrolling interests", narrows or changes
+# the question, which then goes through retrieval and generation
+_FILLER_WORDS = {
+    "what", "whats", "which", "was", "were", "is", "are", "be", "of", "for", "in", "on", "at", "as", "during", "did",
+    "does", "do", "how", "much", "report", "reported", "reports", "its", "their", "fiscal", "year", "quarter",
+    "period", "end", "ended", "ending", "tell", "me", "show", "give", "please", "a", "an",
+    *_ENTITY_SUFFIXES,
+}
+# dei:CurrentFiscalYearEndDate, e.g. --01-28
+_YEAR_END = re.compile(r"--(\d{2})-(\d{2})")
+
+
+def entity_key(name: str) -> str:
+    """Normalise a company name for matching, e.g. ``NVIDIA CORPORATION`` and ``Nvidia Corp.`` to ``nvidia``."""
+    words = re.findall(r"[a-z0-9&]+", name.lower())
+    return " ".join(word for word in words if word not in _ENTITY_SUFFIXES)
+
+
+def _month(date: datetime.date) -> Tuple[int, int]:
+    """Return the year and month a period end belongs to; 52/53 week years end in the first days of a month too."""
+    if date.day <= 7:
+        date -= datetime.timedelta(days=date.day)
+    return date.year, date.month
+
+
+def year_end_month(stated: Optional[str]) -> Optional[int]:
+    """Return the month of a ``--MM-DD`` fiscal year end as stated by ``dei:CurrentFiscalYearEndDate``."""
+    match = _YEAR_END.fullmatch((stated or "").strip())
+    if match is None:
+        return None
+    try:
+        # 2000 is a leap year, so --02-29 is a date too
+        return _month(datetime.date(2000, int(match.group(1)), int(match.group(2))))[1]
+    except ValueError:
+        return None
+
+
+def fiscal_periods(
+    start: Optional[datetime.date], end: datetime.date, year_end_month: int
+) -> List[Tuple[int, int]]:
+    """Return the ``(fiscal year, quarter)`` keys of a fact's period; quarter 0 is the whole fiscal year.
+
+    Fiscal years are named after the calendar year they end in. Balances at the end of a fiscal year are keyed both
+    as the year and as its fourth quarter. Year to date periods of six or nine months have no key.
+    """
+    year, month = _month(end)
+    offset = (month - year_end_month) % 12
+    if offset % 3:
+        return []
+    fiscal_year = year + 1 if month > year_end_month else year
+    quarter = offset // 3 or 4
+    if start is None:
+        return [(fiscal_year, 0), (fiscal_year, 4)] if quarter == 4 else [(fiscal_year, quarter)]
+    days = (end - start).days
+    if 350 <= days <= 380 and quarter == 4:
+        return [(fiscal_year, 0)]
+    if 80 <= days <= 100:
+        return [(fiscal_year, quarter)]
+    return []
+
+
+class FactQuery(NamedTuple):
+    """A single number question: which metric of which entity for which fiscal period."""
+
+    entity: Optional[str]
+    metric: str
+    fiscal_year: Optional[int]
+    fiscal_quarter: int
+
+
+def parse_question(question: str, entities: Iterable[str] = ()) -> Optional[FactQuery]:
+    """Read the company, metric and fiscal period a question asks for; None for questions not asking for one number.
+
+    A question qualifies only when nothing but one of the ``entities``, one metric, one period and filler words is
+    left of it. Questions naming no company leave the entity to :meth:`FactIndex.answer`.
+    """
+    text = re.sub(r"'s\b", "", question.lower().replace("\u2019", "'"))
+    text = " " + " ".join(re.findall(r"[a-z0-9&']+", text)) + " "
+
+    named = set()
+    # longest first, so "apple hospitality" is not read as "apple"
+    for entity in sorted(entities, key=lambda name: -len(name)):
+        if entity and f" {entity} " in text:
+            named.add(entity)
+            text = text.replace(f" {entity} ", " ")
+    metrics = set()
+    for phrase, metric in _PHRASES:
+        if f" {phrase} " in text:
+            metrics.add(metric)
+            # "cost of revenue" does not also ask for revenue
+            text = text.replace(f" {phrase} ", " ")
+    # "net income and revenue" asks for two numbers, "apple and nvidia" about two companies
+    if len(metrics) != 1 or len(named) > 1:
+        return None
+
+    quarter = 0
+    quarters = {
+        int(m.group(1) or m.group(2) or _QUARTER_WORDS[m.group(3).lower()]) for m in _QUARTER.finditer(text)
+    }
+    if len(quarters) > 1:
+        return None
+    if quarters:
+        quarter = quarters.pop()
+        text = _QUARTER.sub(" ", text)
+    years = {int(m.group(1)) if m.group(1) else 2000 + int(m.group(2)) for m in _YEAR.finditer(text)}
+    if len(years) > 1:
+        return None
+    text = _YEAR.sub(" ", text)
+
+    if any(word not in _FILLER_WORDS for word in text.split()):
+        return None
+    return FactQuery(named.pop() if named else None, metrics.pop(), years.pop() if years else None, quarter)
+
+
+class _IndexedFact(NamedTuple):
+    filing_rank: datetime.date
+    concept_rank: int
+    fact: Dict[str, Any]
+
+
+class FactAnswer(NamedTuple):
+    """The fact answering a question.
+
+    :param text: A one sentence answer.
+    :param context: The fact with its period and unit, as context for the LLM.
+    :param fact: The fact row with its dates as ISO strings, see :meth:`xbrl.FactCollector.rows`.
+    """
+
+    text: str
+    context: str
+    fact: Dict[str, Any]
+
+
+def _period_name(fiscal_year: int, fiscal_quarter: int) -> str:
+    return f"Q{fiscal_quarter} fiscal {fiscal_year}" if fiscal_quarter else f"fiscal year {fiscal_year}"
+
+
+def format_value(value: float, unit: str) -> str:
+    """Write a fact value the way a financial report would, e.g. ``$60.92 billion`` or ``$11.93 per share``."""
+    if unit == "USD/shares":
+        return f"-${-value:,.2f} per share" if value < 0 else f"${value:,.2f} per share"
+    if unit == "USD":
+        magnitude = abs(value)
+        sign = "-" if value < 0 else ""
+        for scale, name in ((1e12, "trillion"), (1e9, "billion"), (1e6, "million")):
+            if magnitude >= scale:
+                return f"{sign}${magnitude / scale:,.2f} {name}"
+        return f"{sign}${magnitude:,.0f}"
+    if unit == "shares":
+        return f"{value:,.0f} shares"
+    return f"{value:,g} {unit}"
+
+
+class _Document(NamedTuple):
+    # the most recent period the filing reports on ranks it; restatements come in later filings
+    filing_rank: datetime.date
+    # the month of the fiscal year end stated on the cover page, if any
+    year_end_month: Optional[int]
+    # the headline facts with their entity, metric and concept preference
+    facts: List[Tuple[str, str, int, Dict[str, Any]]]
+
+
+class FactIndex:
+    """The headline facts of the fact store, keyed by ``(entity, metric, fiscal year, fiscal quarter)``.
+
+    Facts are indexed per file, the current version of every file in the fact store, see :meth:`FactStore.linked`.
+    Adding or removing a file keys every fact of its entities again, so the fiscal periods of an entity do not
+    depend on the order its filings were ingested in.
+
+    :param store: The fact store the index is loaded from.
+    """
+
+    def __init__(self, store: FactStore) -> None:
+        self._store = store
+        self._lock = threading.Lock()
+        self._documents: Dict[str, _Document] = {}
+        # the files reporting on every entity, the display name of every entity, and its facts keyed by
+        # ``(metric, fiscal year, fiscal quarter)``
+        self._entity_files: Dict[str, Set[str]] = {}
+        self._issuers: Dict[str, str] = {}
+        self._facts: Dict[str, Dict[Tuple[str, int, int], _IndexedFact]] = {}
+        self.load()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(facts) for facts in self._facts.values())
+
+    def load(self) -> None:
+        """Index the current version of every file of the fact store."""
+        documents = {filename: self._store.facts(doc_hash) for filename, doc_hash in self._store.linked().items()}
+        with self._lock:
+            for filename, facts in documents.items():
+                self._add(filename, facts)
+            for entity in list(self._entity_files):
+                self._rebuild(entity)
+        _LOGGER.info("Indexed %d facts of %d filings", len(self), len(documents))
+
+    def add(self, filename: str, facts: List[Dict[str, Any]]) -> None:
+        """Index the facts of a file, replacing those of its earlier version."""
+        with self._lock:
+            for entity in self._remove(filename) | self._add(filename, facts):
+                self._rebuild(entity)
+
+    def remove(self, filename: str) -> None:
+        """Drop the facts of a file."""
+        with self._lock:
+            for entity in self._remove(filename):
+                self._rebuild(entity)
+
+    def _add(self, filename: str, facts: List[Dict[str, Any]]) -> Set[str]:
+        if not facts:
+            return set()
+        headline = []
+        for fact in facts:
+            if fact["dimensions"] or fact["concept"] not in _CONCEPTS:
+                continue
+            entity = entity_key(fact["issuer"] or fact["entity"])
+            if entity:
+                headline.append((entity, *_CONCEPTS[fact["concept"]], fact))
+        # files stored before the fiscal year end was recorded have no such column
+        stated = next((fact.get("fiscal_year_end") for fact in facts if fact.get("fiscal_year_end")), None)
+        self._documents[filename] = _Document(
+            max(fact["period_end"] for fact in facts), year_end_month(stated), headline
+        )
+        entities = {entity for entity, _, _, _ in headline}
+        for entity in entities:
+            self._entity_files.setdefault(entity, set()).add(filename)
+        return entities
+
+    def _remove(self, filename: str) -> Set[str]:
+        document = self._documents.pop(filename, None)
+        if document is None:
+            return set()
+        entities = {entity for entity, _, _, _ in document.facts}
+        for entity in entities:
+            self._entity_files[entity].discard(filename)
+        return entities
+
+    def _year_end(self, entity: str, documents: List[_Document]) -> int:
+        """Return the fiscal year end month of an entity.
+
+        It is the one stated by its latest filing, or else the month most of its annual periods end in. December,
+        the most common one, stands in until a filing tells.
+        """
+        for document in documents:
+            if document.year_end_month:
+                return document.year_end_month
+        months: Counter = Counter()
+        for document in documents:
+            for fact_entity, _, _, fact in document.facts:
+                start, end = fact["period_start"], fact["period_end"]
+                if fact_entity == entity and start is not None and 350 <= (end - start).days <= 380:
+                    months[_month(end)[1]] += 1
+        return months.most_common(1)[0][0] if months else 12
+
+    def _rebuild(self, entity: str) -> None:
+        """Key every fact of an entity again."""
+        files = self._entity_files.get(entity)
+        if not files:
+            self._entity_files.pop(entity, None)
+            self._issuers.pop(entity, None)
+            self._facts.pop(entity, None)
+            return
+        # latest filing first
+        documents = sorted(
+            (self._documents[filename] for filename in sorted(files)), key=lambda d: d.filing_rank, reverse=True
+        )
+        year_end = self._year_end(entity, documents)
+        facts: Dict[Tuple[str, int, int], _IndexedFact] = {}
+        for document in documents:
+            for fact_entity, metric, concept_rank, fact in document.facts:
+                if fact_entity != entity:
+                    continue
+                self._issuers.setdefault(entity, fact["issuer"] or fact["entity"])
+                candidate = _IndexedFact(document.filing_rank, concept_rank, fact)
+                for fiscal_year, fiscal_quarter in fiscal_periods(fact["period_start"], fact["period_end"], year_end):
+                    key = (metric, fiscal_year, fiscal_quarter)
+                    current = facts.get(key)
+                    if current is None or (
+                        (candidate.filing_rank, -concept_rank) > (current.filing_rank, -current.concept_rank)
+                    ):
+                        facts[key] = candidate
+        self._facts[entity] = facts
+
+    def lookup(self, query: FactQuery) -> Optional[Tuple[FactQuery, Dict[str, Any]]]:
+        """Find the fact of a fully resolved query; without a fiscal year, the latest year having the fact is used."""
+        with self._lock:
+            facts = self._facts.get(query.entity or "", {})
+            if query.fiscal_year is not None:
+                indexed = facts.get((query.metric, query.fiscal_year, query.fiscal_quarter))
+                return (query, indexed.fact) if indexed is not None else None
+            years = [
+                year for metric, year, quarter in facts if metric == query.metric and quarter == query.fiscal_quarter
+            ]
+            if not years:
+                return None
+            query = query._replace(fiscal_year=max(years))
+            return query, facts[(query.metric, max(years), query.fiscal_quarter)].fact
+
+    @staticmethod
+    def _entities(entities: List[str], filters: Dict[str, Any]) -> List[str]:
+        """Return the entities a question naming no company may be about."""
+        issuer = filters.get("issuer")
+        if isinstance(issuer, str):
+            return [entity for entity in entities if entity.startswith(entity_key(issuer))]
+        # a question naming no company is unambiguous only when the filings are all about one
+        return entities if len(entities) == 1 else []
+
+    def answer(self, question: str, filters: Optional[Dict[str, Any]] = None) -> Optional[FactAnswer]:
+        """Answer a single number question from the indexed facts, or return None to use retrieval instead.
+
+        Scalar ``issuer``, ``fiscal_year`` and ``fiscal_quarter`` filters stand in for a company or period the
+        question does not name, and the answer must match every filter. Filters on other fields, e.g. a filing
+        type, restrict retrieval to some documents and always use retrieval.
+        """
+        filters = filters or {}
+        if set(filters) - {"issuer", "fiscal_year", "fiscal_quarter"}:
+            return None
+        with self._lock:
+            entities = list(self._issuers)
+        query = parse_question(question, entities)
+        if query is None:
+            return None
+        if query.entity is None:
+            candidates = self._entities(entities, filters)
+            if len(candidates) != 1:
+                return None
+            query = query._replace(entity=candidates[0])
+        if query.fiscal_year is None and isinstance(filters.get("fiscal_year"), int):
+            query = query._replace(fiscal_year=filters["fiscal_year"])
+        if not query.fiscal_quarter and isinstance(filters.get("fiscal_quarter"), int):
+            query = query._replace(fiscal_quarter=filters["fiscal_quarter"])
+
+        found = self.lookup(query)
+        if found is None:
+            return None
+        query, fact = found
+        with self._lock:
+            issuer = self._issuers.get(query.entity or "", "")
+        if not issuer:
+            return None
+        stated = {"issuer": issuer.upper(), "fiscal_year": query.fiscal_year, "fiscal_quarter": query.fiscal_quarter}
+        if not matches_filters(stated, filters):
+            return None
+        return self._answer(query, issuer, fact)
+
+    @staticmethod
+    def _answer(query: FactQuery, issuer: str, fact: Dict[str, Any]) -> FactAnswer:
+        label = METRICS[query.metric].label
+        period = _period_name(query.fiscal_year or 0, query.fiscal_quarter)
+        start, end = fact["period_start"], fact["period_end"]
+        if start is None:
+            text = f"{issuer} reported {label} of {format_value(fact['value'], fact['unit'])} as of {end.isoformat()}"
+            dates = f"as of {end.isoformat()}"
+        else:
+            text = f"{issuer} reported {label} of {format_value(fact['value'], fact['unit'])} for {period}"
+            dates = f"{start.isoformat()} to {end.isoformat()}"
+        text += f" ({fact['concept']}, {dates})."
+        context = (
+            f"{issuer}, {label} ({fact['concept']}), {period}, {dates}: {fact['value']:,.2f} {fact['unit']}"
+        )
+        public = {
+            **fact,
+            "period_start": start.isoformat() if start is not None else None,
+            "period_end": end.isoformat(),
+            "metric": query.metric,
+            "fiscal_year": query.fiscal_year,
+            "fiscal_quarter": query.fiscal_quarter,
+        }
+        return FactAnswer(text, context, public)
@@ -0,0 +1,393 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A staged, batched pipeline for ingesting documents into the VectorDB.
+
+Uploaded files flow through four stages connected by bounded queues:
+
+    parse (process pool) -> chunk -> embed (fixed size batches) -> insert (bulk)
+
+Long PDFs are parsed in batches of pages by several workers at once, and every batch flows on to the chunker as soon
+as it is parsed, so the first chunks of a file are searchable while its later pages are still being parsed.
+
+Each upload is tracked as an :class:`IngestJob` so the API can return immediately and report progress later.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from typing import IO, TYPE_CHECKING, Any, Deque, Dict, List, Optional, Tuple
+
+from chain_server import chains
+from chain_server.cache import hash_file
+from chain_server.parsing import page_batches, parse_file
+
+if TYPE_CHECKING:
+    from llama_index.schema import BaseNode
+
+_LOGGER = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_PARSING = "parsing"
+JOB_EMBEDDING = "embedding"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+_COPY_BUFSIZE = 1024 * 1024
+
+
+def document_name(path: str) -> str:
+    """Return the relative path an uploaded file or archive member is stored under.
+
+    The name identifies the document across uploads, so files sharing a basename in different directories stay
+    apart. Absolute prefixes and ``.``/``..`` components are dropped.
+    """
+    parts = path.replace("\\", "/").split("/")
+    return "/".join(part for part in parts if part not in ("", ".", ".."))
+
+
+def _spool(source: IO[bytes], filename: str) -> str:
+    """Copy a stream into its own temporary directory and return the new file path."""
+    file_path = os.path.join(tempfile.mkdtemp(), os.path.basename(filename))
+    with open(file_path, "wb") as dest:
+        shutil.copyfileobj(source, dest, _COPY_BUFSIZE)
+    return file_path
+
+
+def spool_upload(source: IO[bytes], filename: str) -> List[Tuple[str, str]]:
+    """Write an uploaded file, or every member of an uploaded archive, to disk.
+
+    Files are copied in fixed-size blocks so neither the upload nor the archive members are ever held in memory.
+    Each file lands in its own temporary directory so it can be cleaned up independently once parsed. Archive
+    members are named by their path inside the archive, see :func:`document_name`.
+
+    :returns: ``(file_path, filename)`` pairs ready to be submitted for ingestion.
+    """
+    lowered = filename.lower()
+    if not lowered.endswith(ARCHIVE_SUFFIXES):
+        return [(_spool(source, filename), filename)]
+
+    spooled = []
+    if lowered.endswith(".zip"):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                name = document_name(info.filename)
+                if info.is_dir() or not name or os.path.basename(name).startswith("."):
+                    continue
+                with archive.open(info) as member:
+                    spooled.append((_spool(member, name), name))
+        return spooled
+
+    # stream mode reads the tarball sequentially, so non seekable sources work as well
+    with tarfile.open(fileobj=source, mode="r|*") as archive:
+        for info in archive:
+            name = document_name(info.name)
+            if not info.isfile() or not name or os.path.basename(name).startswith("."):
+                continue
+            member = archive.extractfile(info)
+            if member is not None:
+                spooled.append((_spool(member, name), name))
+    return spooled
+
+
+@dataclass
+class IngestJob:
+    """The progress of a single uploaded file through the pipeline."""
+
+    filename: str
+    file_path: str
+    cleanup: bool = False
+    upsert: bool = True
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = JOB_QUEUED
+    num_chunks: int = 0
+    num_inserted: int = 0
+    num_unchanged: int = 0
+    num_deleted: int = 0
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the public view of the job."""
+        output = asdict(self)
+        del output["file_path"], output["cleanup"], output["upsert"]
+        return output
+
+
+class IngestionPipeline:
+    """Parse, chunk, embed and insert uploaded files in the background."""
+
+    def __init__(
+        self,
+        parse_workers: int = 2,
+        queue_size: int = 8,
+        embed_batch_size: int = 32,
+        max_jobs: int = 1000,
+        page_batch_size: int = 16,
+        fast_parsing: bool = True,
+    ) -> None:
+        """Start the pipeline stages."""
+        self._embed_batch_size = max(1, embed_batch_size)
+        self._page_batch_size = page_batch_size
+        self._fast_parsing = fast_parsing
+        # page batches of one file parsed ahead of the chunker; at least two, so the last batch is always known
+        self._batches_ahead = max(2, parse_workers)
+        self._max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        # the job ingesting every filename, and the jobs of the same filename waiting for it to finish
+        self._active: Dict[str, str] = {}
+        self._waiting: Dict[str, Deque[IngestJob]] = {}
+        # the diff of every running job, taken by whichever stage completes the job
+        self._diffs: Dict[str, Optional[chains.ChunkDiff]] = {}
+
+        # spawn rather than fork so workers never inherit the CUDA context of the embedding model
+        self._parse_pool = ProcessPoolExecutor(
+            max_workers=parse_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        # uploads are accepted without blocking; every later stage applies back pressure
+        self._intake: "queue.Queue[IngestJob]" = queue.Queue()
+        self._chunk_queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._embed_queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._insert_queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+
+        # one feeder per parse worker keeps the process pool busy without queueing unbounded work in it
+        for idx in range(parse_workers):
+            self._start_stage(f"ingest-parse-{idx}", self._parse_stage)
+        self._start_stage("ingest-chunk", self._chunk_stage)
+        self._start_stage("ingest-embed", self._embed_stage)
+        self._start_stage("ingest-insert", self._insert_stage)
+
+    @staticmethod
+    def _start_stage(name: str, target: Any) -> None:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+
+    def submit(self, file_path: str, filename: str, cleanup: bool = False, upsert: bool = True) -> IngestJob:
+        """Queue a file for ingestion and return its job.
+
+        When ``cleanup`` is set, the directory holding ``file_path`` is removed once the file has been parsed.
+        When ``upsert`` is set, the file replaces the chunks stored under the same filename and only changed
+        chunks are embedded. Jobs of the same filename run one after the other, in the order they were submitted.
+        """
+        job = IngestJob(filename=filename, file_path=file_path, cleanup=cleanup, upsert=upsert)
+        with self._jobs_lock:
+            self._jobs[job.job_id] = job
+            self._trim_jobs()
+        self._intake.put(job)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestJob]:
+        """Look up a job by id."""
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def _trim_jobs(self) -> None:
+        """Forget the oldest finished jobs once more than ``max_jobs`` are tracked."""
+        excess = len(self._jobs) - self._max_jobs
+        for job_id in list(self._jobs.keys()):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].finished is not None:
+                del self._jobs[job_id]
+                excess -= 1
+
+    def _acquire(self, job: IngestJob) -> bool:
+        """Make ``job`` the one ingesting its filename, or queue it behind the job that already is."""
+        with self._jobs_lock:
+            active = self._active.setdefault(job.filename, job.job_id)
+            if active == job.job_id:
+                return True
+            self._waiting.setdefault(job.filename, deque()).append(job)
+            return False
+
+    def _release(self, job: IngestJob) -> None:
+        """Hand the filename of a finished job to the next job waiting for it."""
+        with self._jobs_lock:
+            if self._active.get(job.filename) != job.job_id:
+                return
+            waiting = self._waiting.get(job.filename)
+            if not waiting:
+                del self._active[job.filename]
+                self._waiting.pop(job.filename, None)
+                return
+            next_job = waiting.popleft()
+            self._active[job.filename] = next_job.job_id
+        self._intake.put(next_job)
+
+    def _try_complete(self, job: IngestJob) -> None:
+        """Complete a job once its last batch was queued and every queued chunk is inserted.
+
+        Only then are the stored chunks missing from the new version deleted, so a job failing on the way leaves the
+        previous version of the file in place.
+        """
+        with self._jobs_lock:
+            if job.status != JOB_EMBEDDING or job.num_inserted < job.num_chunks or job.job_id not in self._diffs:
+                return
+            # the chunk and insert stages may both see the job through; only the first one completes it
+            diff = self._diffs.pop(job.job_id)
+        if diff is not None:
+            try:
+                job.num_deleted = diff.finish()
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                self._fail(job, err)
+                return
+        job.status = JOB_DONE
+        job.finished = time.time()
+        self._release(job)
+
+    def _fail(self, job: IngestJob, err: Exception) -> None:
+        _LOGGER.error("Ingestion of %s failed: %s", job.filename, err)
+        job.status = JOB_FAILED
+        job.error = str(err)
+        job.finished = time.time()
+        with self._jobs_lock:
+            self._diffs.pop(job.job_id, None)
+        self._release(job)
+
+    def _parse_stage(self) -> None:
+        while True:
+            job = self._intake.get()
+            # jobs of the same file would diff against the same stored chunks and delete each other's
+            if not self._acquire(job):
+                continue
+            job.status = JOB_PARSING
+            try:
+                self._parse(job)
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                self._fail(job, err)
+            finally:
+                if job.cleanup:
+                    shutil.rmtree(os.path.dirname(job.file_path), ignore_errors=True)
+
+    def _parse(self, job: IngestJob) -> None:
+        """Parse a file batch by batch of pages and hand every batch to the chunker in page order."""
+        doc_hash = hash_file(job.file_path)
+        diff = chains.ChunkDiff(job.filename) if job.upsert else None
+        with self._jobs_lock:
+            self._diffs[job.job_id] = diff
+        # files seen before skip both parsing and chunking
+        nodes = chains.load_cached_chunks(doc_hash, job.filename)
+        if nodes is not None:
+            chains.index_document_facts(job.filename, doc_hash)
+            self._queue_nodes(job, nodes, diff, last=True)
+            return
+
+        chunker = chains.DocumentChunker(job.filename, doc_hash)
+        pending: "Deque[Future[Any]]" = deque()
+        try:
+            for pages in page_batches(job.file_path, self._page_batch_size):
+                if job.status == JOB_FAILED:
+                    return
+                pending.append(self._parse_pool.submit(parse_file, job.file_path, pages, self._fast_parsing))
+                if len(pending) >= self._batches_ahead:
+                    self._chunk_queue.put((job, chunker, diff, pending.popleft().result(), False))
+            while pending:
+                batch = pending.popleft().result()
+                self._chunk_queue.put((job, chunker, diff, batch, not pending))
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _chunk_stage(self) -> None:
+        while True:
+            job, chunker, diff, batch, last = self._chunk_queue.get()
+            if job.status == JOB_FAILED:
+                continue
+            try:
+                nodes = chunker.add(batch)
+                if last:
+                    chunker.finish()
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                self._fail(job, err)
+                continue
+            self._queue_nodes(job, nodes, diff, last)
+
+    def _queue_nodes(
+        self, job: IngestJob, nodes: List["BaseNode"], diff: Optional[chains.ChunkDiff], last: bool
+    ) -> None:
+        """Hand the chunks of a batch of pages to the embedder in fixed size batches.
+
+        The job is complete once the ``last`` batch of the file was queued and every queued chunk is inserted.
+        """
+        if diff is not None:
+            try:
+                changed = diff.changed(nodes)
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                self._fail(job, err)
+                return
+            job.num_unchanged += len(nodes) - len(changed)
+            nodes = changed
+        job.num_chunks += len(nodes)
+        if last:
+            job.status = JOB_EMBEDDING
+            self._try_complete(job)
+            if job.status != JOB_EMBEDDING:
+                return
+        for start in range(0, len(nodes), self._embed_batch_size):
+            self._embed_queue.put((job, nodes[start : start + self._embed_batch_size]))
+
+    def _embed_stage(self) -> None:
+        while True:
+            job, nodes = self._embed_queue.get()
+            if job.status == JOB_FAILED:
+                continue
+            try:
+                nodes = chains.embed_nodes(nodes)
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                self._fail(job, err)
+                continue
+            self._insert_queue.put((job, nodes))
+
+    def _insert_stage(self) -> None:
+        while True:
+            job, nodes = self._insert_queue.get()
+            if job.status == JOB_FAILED:
+                continue
+            try:
+                chains.insert_nodes(nodes)
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                self._fail(job, err)
+                continue
+            job.num_inserted += len(nodes)
+            # chunks of earlier page batches are inserted while later ones are still being parsed
+            self._try_complete(job)
+
+
+@lru_cache
+def get_ingestion_pipeline() -> IngestionPipeline:
+    """Create the shared ingestion pipeline."""
+    config = chains.get_config().ingestion
+    return IngestionPipeline(
+        parse_workers=config.parse_workers,
+        queue_size=config.queue_size,
+        embed_batch_size=config.embed_batch_size,
+        max_jobs=config.max_jobs,
+        page_batch_size=config.page_batch_size,
+        fast_parsing=config.fast_parsing,
+    )
@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent, connection pooling clients for the LLM backends.
+
+Clients are keyed by the backend they talk to only. Sampling parameters such as temperature or the number of
+tokens are passed with every request, so moving a slider in the UI never creates a new client. Each request
+selects its backend explicitly, so concurrent requests against different endpoints never share mutable module
+state such as ``openai.base_url``.
+
+Clients evicted from the registry are closed, releasing their connection pools, once the last request streaming
+from them is done; the client getters lease the client to the request for as long as it uses it.
+"""
+import asyncio
+import importlib.util
+import inspect
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Set, Tuple
+
+import httpx
+import openai
+from text_generation import AsyncClient
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class LLMClientRegistry:
+    """A bounded LRU registry of LLM clients, one per backend and client flavour."""
+
+    def __init__(
+        self,
+        max_clients: int = 16,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        http2: bool = True,
+        timeout: float = 120.0,
+    ) -> None:
+        """Initialize the registry."""
+        self._max_clients = max_clients
+        self._limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_keepalive_connections
+        )
+        # httpx only speaks HTTP/2 when the optional h2 package is installed
+        self._http2 = http2 and importlib.util.find_spec("h2") is not None
+        self._timeout = timeout
+        self._clients: "OrderedDict[Tuple[str, ...], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._created = 0
+        self._evicted = 0
+        # requests using every client, evicted clients waiting for their last request, and async clients evicted
+        # off the event loop, closed by the next request on it
+        self._leases: Dict[int, int] = {}
+        self._retired: Dict[int, Any] = {}
+        self._async_retired: List[Any] = []
+        self._closing: Set["asyncio.Task[Any]"] = set()
+
+    @contextmanager
+    def _lease(self, key: Tuple[str, ...], factory: Callable[[], Any]) -> Iterator[Any]:
+        """Hold the client of a backend for the duration of a request, so it is not closed while the request
+        streams from it.
+
+        The client is looked up, or created, and leased under one lock, so it cannot be evicted and closed in
+        between.
+        """
+        idle = []
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self._hits += 1
+            else:
+                client = factory()
+                self._clients[key] = client
+                self._created += 1
+            self._leases[id(client)] = self._leases.get(id(client), 0) + 1
+            while len(self._clients) > self._max_clients:
+                _, evicted = self._clients.popitem(last=False)
+                self._evicted += 1
+                # requests still streaming from an evicted client close it when they are done
+                if self._leases.get(id(evicted)):
+                    self._retired[id(evicted)] = evicted
+                else:
+                    idle.append(evicted)
+        for evicted in idle:
+            self._close(evicted)
+        try:
+            yield client
+        finally:
+            with self._lock:
+                self._leases[id(client)] -= 1
+                done = not self._leases[id(client)]
+                if done:
+                    del self._leases[id(client)]
+                retired = self._retired.pop(id(client), None) if done else None
+                pending = []
+                if self._async_retired and _running_loop() is not None:
+                    pending, self._async_retired = self._async_retired, []
+            for idle_client in ([retired] if retired is not None else []) + pending:
+                self._close(idle_client)
+
+    def _close(self, client: Any) -> None:
+        """Close a client and its connection pool; async clients are closed on the running event loop."""
+        # the text-generation clients open a session per request and hold no pool
+        close = getattr(client, "close", None)
+        if close is None:
+            return
+        try:
+            result = close()
+            if not inspect.isawaitable(result):
+                return
+            loop = _running_loop()
+            if loop is None:
+                # the connections of an async client belong to the event loop, so it is closed there
+                result.close()  # type: ignore[attr-defined]
+                with self._lock:
+                    self._async_retired.append(client)
+                return
+            task = loop.create_task(result)
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            _LOGGER.warning("Closing an evicted LLM client failed: %s", err)
+
+    def async_openai_client(self, base_url: str, api_key: str) -> ContextManager[openai.AsyncOpenAI]:
+        """Lease the async client of an OpenAI compatible endpoint for the duration of a request."""
+        return self._lease(
+            ("async_openai", base_url, api_key),
+            lambda: openai.AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                http_client=httpx.AsyncClient(limits=self._limits, http2=self._http2, timeout=self._timeout),
+            ),
+        )
+
+    def async_tgi_client(self, base_url: str) -> ContextManager[AsyncClient]:
+        """Lease the async client of a text-generation-inference server for the duration of a request."""
+        return self._lease(("async_tgi", base_url), lambda: AsyncClient(base_url, timeout=int(self._timeout)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the registry counters."""
+        with self._lock:
+            return {
+                "size": len(self._clients),
+                "max_size": self._max_clients,
+                "hits": self._hits,
+                "created": self._created,
+                "evicted": self._evicted,
+                "retired": len(self._retired) + len(self._async_retired),
+                "backends": ["|".join(key[:2]) for key in self._clients],
+            }
+
+
+def _running_loop() -> Any:
+    """Return the event loop running in this thread, if any."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
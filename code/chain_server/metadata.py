@@ -0,0 +1,191 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Structured metadata of financial documents and the retrieval filters built on it.
+
+Every chunk carries the issuer, fiscal year and quarter, filing type and page it comes from. The fields are
+declared in the Milvus schema with scalar indexes, so filters on them are evaluated by Milvus before the vector
+search instead of after it. The embedded vector store evaluates the same filters in process with
+:func:`matches_filters`.
+"""
+import json
+import operator
+import os
+import re
+from typing import Any, Dict, Optional
+
+# Milvus 2.3 has no nullable fields, so unknown values are stored as these defaults
+METADATA_DEFAULTS: Dict[str, Any] = {
+    "issuer": "",
+    "fiscal_year": 0,
+    "fiscal_quarter": 0,
+    "filing_type": "",
+    "page": 0,
+}
+STRING_FIELDS = ("issuer", "filing_type")
+INTEGER_FIELDS = ("fiscal_year", "fiscal_quarter", "page")
+
+# how much of a document is searched for its cover page details
+_HEADER_CHARS = 6000
+
+_FORM = re.compile(r"\bFORM\s+(10-K|10-Q|8-K|20-F|40-F|6-K|S-1|DEF\s*14A)\b", re.IGNORECASE)
+_FILENAME_FORM = re.compile(r"(?<![a-z0-9])(10-?k|10-?q|8-?k|20-?f|40-?f|6-?k)(?![a-z0-9])", re.IGNORECASE)
+_REGISTRANT = re.compile(r"([^\n]{2,120})\n\s*\(Exact name of registrant as specified in its charter\)", re.IGNORECASE)
+_PERIOD_ENDED = re.compile(
+    r"for the (fiscal year|quarterly period|quarter) ended\s+[A-Za-z]+\s+\d{1,2},?\s+(\d{4})", re.IGNORECASE
+)
+_FISCAL_YEAR = re.compile(r"\b(?:fiscal(?:\s+year)?\s+|FY\s?)(20\d{2}|\d{2})\b", re.IGNORECASE)
+_QUARTER = re.compile(r"\b(?:Q([1-4])|(first|second|third|fourth)\s+(?:fiscal\s+)?quarter)\b", re.IGNORECASE)
+_YEAR = re.compile(r"(?<!\d)(20\d{2})(?!\d)")
+_QUARTER_WORDS = {"first": 1, "second": 2, "third": 3, "fourth": 4}
+
+
+def _fiscal_year(value: str) -> int:
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def _quarter(match: "re.Match[str]") -> int:
+    if match.group(1):
+        return int(match.group(1))
+    return _QUARTER_WORDS[match.group(2).lower()]
+
+
+def extract_document_metadata(filename: str, text: str) -> Dict[str, Any]:
+    """Extract the issuer, fiscal period and filing type of a document from its cover page and filename."""
+    metadata = dict(METADATA_DEFAULTS)
+    header = text[:_HEADER_CHARS]
+    stem = os.path.splitext(os.path.basename(filename))[0]
+
+    form = _FORM.search(header)
+    if form:
+        metadata["filing_type"] = re.sub(r"\s+", " ", form.group(1).upper())
+    else:
+        form = _FILENAME_FORM.search(stem)
+        if form:
+            value = form.group(1).upper()
+            metadata["filing_type"] = value if "-" in value else f"{value[:-1]}-{value[-1]}"
+        elif re.search(r"annual report", header, re.IGNORECASE):
+            metadata["filing_type"] = "ANNUAL REPORT"
+        elif re.search(r"(earnings|press) release|reports? (first|second|third|fourth) quarter", header, re.IGNORECASE):
+            metadata["filing_type"] = "EARNINGS RELEASE"
+
+    registrant = _REGISTRANT.search(header)
+    if registrant:
+        metadata["issuer"] = registrant.group(1).strip().upper()
+    else:
+        # filings are usually named like NVIDIA_10K_2024.pdf or aapl-20230930.htm
+        prefix = re.split(r"[_\-\s\d]", stem, maxsplit=1)[0]
+        metadata["issuer"] = prefix.upper() if len(prefix) > 1 else ""
+
+    # an explicit fiscal year wins over the calendar year of the period end, which differs for many issuers
+    fiscal_year = _FISCAL_YEAR.search(header) or _FISCAL_YEAR.search(stem)
+    period = _PERIOD_ENDED.search(header)
+    if fiscal_year:
+        metadata["fiscal_year"] = _fiscal_year(fiscal_year.group(1))
+    elif period:
+        metadata["fiscal_year"] = int(period.group(2))
+    else:
+        year = _YEAR.search(stem) or _YEAR.search(header)
+        if year:
+            metadata["fiscal_year"] = int(year.group(1))
+
+    if metadata["filing_type"] != "10-K":
+        quarter = _QUARTER.search(stem) or _QUARTER.search(header)
+        if quarter:
+            metadata["fiscal_quarter"] = _quarter(quarter)
+    return metadata
+
+
+def _literal(field: str, value: Any) -> str:
+    if field in STRING_FIELDS:
+        if not isinstance(value, str):
+            raise ValueError(f"Filter on {field} expects a string.")
+        # json string escaping is valid Milvus string literal syntax
+        return json.dumps(value.upper())
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"Filter on {field} expects an integer.")
+    return str(value)
+
+
+def _prefix_pattern(field: str, value: Any) -> str:
+    """Return a ``like`` pattern matching the strings starting with ``value``, whose wildcards match literally."""
+    _literal(field, value)
+    escaped = value.upper().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return json.dumps(escaped + "%")
+
+
+_RANGE_OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+def build_filter_expression(filters: Optional[Dict[str, Any]]) -> str:
+    """Translate API filters into a Milvus boolean expression.
+
+    Every field accepts a single value, a list of values, or for the integer fields a range such as
+    ``{"gte": 2022, "lte": 2024}``. String values are matched case insensitively, and an issuer matches by
+    prefix so ``"NVIDIA"`` finds ``"NVIDIA CORPORATION"``. Conditions on different fields are combined with
+    ``and``.
+
+    :raises ValueError: If a field is unknown or a value has the wrong type.
+    """
+    clauses = []
+    for field, value in (filters or {}).items():
+        if field not in METADATA_DEFAULTS:
+            raise ValueError(f"Unknown filter field {field!r}, expected one of {', '.join(METADATA_DEFAULTS)}.")
+        if isinstance(value, dict):
+            if field in STRING_FIELDS or not value or set(value) - set(_RANGE_OPERATORS):
+                raise ValueError(f"Filter on {field} expects gt, gte, lt or lte bounds.")
+            clauses.extend(f"{field} {_RANGE_OPERATORS[op]} {_literal(field, bound)}" for op, bound in value.items())
+        elif isinstance(value, list):
+            if not value:
+                raise ValueError(f"Filter on {field} expects at least one value.")
+            if field == "issuer":
+                clauses.append("(" + " or ".join(f"issuer like {_prefix_pattern(field, v)}" for v in value) + ")")
+            else:
+                clauses.append(f"{field} in [{', '.join(_literal(field, v) for v in value)}]")
+        elif field == "issuer":
+            clauses.append(f"issuer like {_prefix_pattern(field, value)}")
+        else:
+            clauses.append(f"{field} == {_literal(field, value)}")
+    return " and ".join(clauses)
+
+
+_COMPARISONS = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+
+
+def _matches(field: str, value: Any, expected: Any) -> bool:
+    if field == "issuer":
+        return str(value).upper().startswith(expected.upper())
+    if field in STRING_FIELDS:
+        return str(value).upper() == expected.upper()
+    return value == expected
+
+
+def matches_filters(metadata: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate API filters against the metadata of a chunk, with the semantics of :func:`build_filter_expression`.
+
+    The filters are expected to be valid, i.e. accepted by :func:`build_filter_expression`.
+    """
+    for field, expected in (filters or {}).items():
+        value = metadata.get(field, METADATA_DEFAULTS[field])
+        if isinstance(expected, dict):
+            if not all(_COMPARISONS[op](value, bound) for op, bound in expected.items()):
+                return False
+        elif isinstance(expected, list):
+            if not any(_matches(field, value, item) for item in expected):
+                return False
+        elif not _matches(field, value, expected):
+            return False
+    return True
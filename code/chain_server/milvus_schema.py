@@ -0,0 +1,234 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The explicit schema and indexes of the Milvus collection holding the document chunks.
+
+Left to itself llama_index creates a collection with only an id and a vector, and stores every metadata key in
+the dynamic JSON field, which Milvus cannot index. Declaring the filterable fields lets Milvus keep scalar
+indexes on them and apply filters before the vector search. Other metadata still lands in the dynamic field.
+
+The vector index type and its build and search parameters come from :class:`configuration.MilvusConfig`.
+:func:`rebuild_index` applies a changed configuration to an existing collection, and :func:`migrate_collection`
+copies a collection created by an older version into the current schema. :func:`export_vectors` reads the stored
+embeddings back, to seed the exact re-scoring file of a compressed index.
+"""
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Tuple
+
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
+
+from chain_server.metadata import INTEGER_FIELDS, METADATA_DEFAULTS, STRING_FIELDS
+
+if TYPE_CHECKING:
+    from chain_server.configuration import MilvusConfig
+
+_LOGGER = logging.getLogger(__name__)
+
+ID_FIELD = "id"
+EMBEDDING_FIELD = "embedding"
+_CONNECTION = "chain-server-schema"
+_MAX_VARCHAR_LENGTH = 65_535
+
+
+def chunk_schema(dim: int) -> CollectionSchema:
+    """Return the schema of the chunk collection."""
+    fields = [
+        FieldSchema(ID_FIELD, DataType.VARCHAR, is_primary=True, max_length=_MAX_VARCHAR_LENGTH),
+        FieldSchema(EMBEDDING_FIELD, DataType.FLOAT_VECTOR, dim=dim),
+        FieldSchema("filename", DataType.VARCHAR, max_length=_MAX_VARCHAR_LENGTH),
+    ]
+    fields.extend(FieldSchema(name, DataType.VARCHAR, max_length=1024) for name in STRING_FIELDS)
+    fields.extend(FieldSchema(name, DataType.INT64) for name in INTEGER_FIELDS)
+    return CollectionSchema(fields, enable_dynamic_field=True)
+
+
+def index_params(config: "MilvusConfig") -> Dict[str, Any]:
+    """Return the build parameters of the configured vector index."""
+    index_type = config.index_type.upper()
+    params: Dict[str, Any] = {}
+    if index_type == "HNSW":
+        params = {"M": config.hnsw_m, "efConstruction": config.hnsw_ef_construction}
+    elif index_type in ("IVF_FLAT", "IVF_SQ8"):
+        params = {"nlist": config.nlist}
+    elif index_type == "IVF_PQ":
+        params = {"nlist": config.nlist, "m": config.pq_m, "nbits": config.pq_nbits}
+    elif index_type not in ("DISKANN", "AUTOINDEX", "FLAT"):
+        raise ValueError(f"Unsupported Milvus index type {config.index_type!r}.")
+    return {"index_type": index_type, "metric_type": config.metric_type.upper(), "params": params}
+
+
+def search_params(config: "MilvusConfig") -> Dict[str, Any]:
+    """Return the search parameters matching the configured vector index."""
+    index_type = config.index_type.upper()
+    params: Dict[str, Any] = {}
+    if index_type == "HNSW":
+        params = {"ef": config.ef}
+    elif index_type.startswith("IVF_"):
+        params = {"nprobe": config.nprobe}
+    elif index_type == "DISKANN":
+        params = {"search_list": config.search_list}
+    return {"metric_type": config.metric_type.upper(), "params": params}
+
+
+def create_scalar_indexes(collection: Collection) -> None:
+    """Index the filterable fields: a trie for strings and a sorted array for integers."""
+    indexed = {index.field_name for index in collection.indexes}
+    for name in ("filename", *STRING_FIELDS):
+        if name not in indexed:
+            collection.create_index(name, index_params={"index_type": "Trie"}, index_name=f"{name}_index")
+    for name in INTEGER_FIELDS:
+        if name not in indexed:
+            collection.create_index(name, index_params={"index_type": "STL_SORT"}, index_name=f"{name}_index")
+
+
+def _connect(config: "MilvusConfig") -> None:
+    connections.connect(alias=_CONNECTION, uri=config.url)
+
+
+def has_metadata_schema(collection: Collection) -> bool:
+    """Whether a collection declares the filterable metadata fields."""
+    return "issuer" in {field.name for field in collection.schema.fields}
+
+
+def _create_collection(name: str, dim: int, config: "MilvusConfig") -> Collection:
+    collection = Collection(name, schema=chunk_schema(dim), using=_CONNECTION)
+    collection.create_index(EMBEDDING_FIELD, index_params=index_params(config))
+    create_scalar_indexes(collection)
+    return collection
+
+
+def ensure_collection(config: "MilvusConfig", dim: int) -> None:
+    """Create the chunk collection with its schema and indexes unless it already exists."""
+    _connect(config)
+    try:
+        if utility.has_collection(config.collection_name, using=_CONNECTION):
+            collection = Collection(config.collection_name, using=_CONNECTION)
+            if not has_metadata_schema(collection):
+                _LOGGER.warning(
+                    "Collection %s predates the metadata schema; filters work but are not indexed until it is "
+                    "migrated with scripts/helpers/milvus-index.py migrate.",
+                    config.collection_name,
+                )
+            return
+        _create_collection(config.collection_name, dim, config).load()
+    finally:
+        connections.disconnect(_CONNECTION)
+
+
+def describe_collection(config: "MilvusConfig") -> Dict[str, Any]:
+    """Report the row count, schema and indexes of the chunk collection."""
+    _connect(config)
+    try:
+        collection = Collection(config.collection_name, using=_CONNECTION)
+        return {
+            "collection": config.collection_name,
+            "rows": collection.num_entities,
+            "metadata_schema": has_metadata_schema(collection),
+            "indexes": {index.field_name: index.params for index in collection.indexes},
+        }
+    finally:
+        connections.disconnect(_CONNECTION)
+
+
+def rebuild_index(config: "MilvusConfig") -> float:
+    """Replace the vector index of the chunk collection with the configured one, in place.
+
+    The collection is unavailable for search while the index builds.
+
+    :returns: The number of seconds the build took.
+    """
+    _connect(config)
+    try:
+        collection = Collection(config.collection_name, using=_CONNECTION)
+        collection.release()
+        for index in collection.indexes:
+            if index.field_name == EMBEDDING_FIELD:
+                collection.drop_index(index_name=index.index_name)
+        start = time.time()
+        collection.create_index(EMBEDDING_FIELD, index_params=index_params(config))
+        utility.wait_for_index_building_complete(config.collection_name, using=_CONNECTION)
+        if has_metadata_schema(collection):
+            create_scalar_indexes(collection)
+        elapsed = time.time() - start
+        collection.load()
+        return elapsed
+    finally:
+        connections.disconnect(_CONNECTION)
+
+
+def migrate_collection(config: "MilvusConfig", dim: int, batch_size: int = 1000) -> int:
+    """Copy every chunk into a new collection with the current schema and indexes, then swap it in.
+
+    Metadata fields missing from older chunks are filled with their defaults; re-uploading the files extracts
+    the real values.
+
+    :returns: The number of chunks copied.
+    """
+    _connect(config)
+    target_name = f"{config.collection_name}_migration"
+    try:
+        source = Collection(config.collection_name, using=_CONNECTION)
+        source.load()
+        if utility.has_collection(target_name, using=_CONNECTION):
+            utility.drop_collection(target_name, using=_CONNECTION)
+        target = Collection(target_name, schema=chunk_schema(dim), using=_CONNECTION)
+
+        copied = 0
+        iterator = source.query_iterator(batch_size=batch_size, expr=f'{ID_FIELD} != ""', output_fields=["*"])
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            for row in rows:
+                for key, default in METADATA_DEFAULTS.items():
+                    row.setdefault(key, default)
+                row.setdefault("filename", "")
+            target.insert(rows)
+            copied += len(rows)
+        iterator.close()
+        target.flush()
+
+        # indexing after the bulk copy is much faster than maintaining the index during it
+        target.create_index(EMBEDDING_FIELD, index_params=index_params(config))
+        create_scalar_indexes(target)
+        utility.wait_for_index_building_complete(target_name, using=_CONNECTION)
+
+        source.release()
+        utility.drop_collection(config.collection_name, using=_CONNECTION)
+        utility.rename_collection(target_name, config.collection_name, using=_CONNECTION)
+        Collection(config.collection_name, using=_CONNECTION).load()
+        return copied
+    finally:
+        connections.disconnect(_CONNECTION)
+
+
+def export_vectors(config: "MilvusConfig", batch_size: int = 1000) -> Iterator[List[Tuple[str, List[float]]]]:
+    """Yield the id and embedding of every stored chunk, in batches."""
+    _connect(config)
+    try:
+        collection = Collection(config.collection_name, using=_CONNECTION)
+        collection.load()
+        iterator = collection.query_iterator(
+            batch_size=batch_size, expr=f'{ID_FIELD} != ""', output_fields=[ID_FIELD, EMBEDDING_FIELD]
+        )
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            yield [(row[ID_FIELD], row[EMBEDDING_FIELD]) for row in rows]
+        iterator.close()
+    finally:
+        connections.disconnect(_CONNECTION)
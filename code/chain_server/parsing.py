@@ -0,0 +1,597 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parsing of uploaded files into page tagged elements, run in the worker processes of the ingestion pipeline.
+
+Files are routed by format. HTML filings, inline XBRL included, and plain text are parsed directly; born-digital
+PDFs are read from their text layer with pypdf. Only PDFs without a text layer, i.e. scans, and formats without a
+parser of their own go through unstructured, whose layout analysis is an order of magnitude slower. Pages of PDFs
+whose text layer holds a table, told by lines of several numeric cells, are read again in pypdf's layout mode, which
+keeps the columns of the table apart, so the table comes out whole.
+
+XBRL filings, inline in HTML or as instance documents, also yield their tagged numeric facts for the fact store, see
+:mod:`chain_server.xbrl`. The narrative of an instance document is read from its text block facts.
+
+Long PDFs are not parsed in one go: their pages are cut into batches, each copied into a small PDF of its own and
+parsed by a separate task, so a worker never holds more than one batch and the chunks of the first pages are embedded
+while later pages are still being parsed. This module stays free of the embedding and LLM imports of
+:mod:`chain_server.chains` so the worker processes start quickly and small.
+"""
+import html
+import io
+import logging
+import os
+import re
+from itertools import groupby
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from chain_server.xbrl import (
+    FactCollector,
+    concept_title,
+    inline_value,
+    is_inline_xbrl,
+    is_xbrl_instance,
+    parse_instance,
+)
+
+FORMAT_PDF = "pdf"
+FORMAT_HTML = "html"
+FORMAT_INLINE_XBRL = "ixbrl"
+FORMAT_XBRL = "xbrl"
+FORMAT_TEXT = "text"
+FORMAT_OTHER = "other"
+
+_PDF_MAGIC = b"%PDF-"
+_HTML_SUFFIXES = (".htm", ".html", ".xhtml")
+_TEXT_SUFFIXES = (".txt", ".md")
+# a range of PDF pages with less text than this per page is taken for a scan and sent to unstructured
+_MIN_TEXT_CHARS_PER_PAGE = 100
+# amounts as tables print them: with thousands separators or decimals, optionally in parentheses; bare integers are
+# too often years or note numbers
+_NUMERIC_CELL = re.compile(r"(?<![\w.,])\(?(?:\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+\.\d+)\)?(?![\w,]|\.\d)")
+# a line with this many numeric cells is a table row, and a page with this many rows holds a table
+_MIN_ROW_CELLS = 2
+_MIN_TABLE_ROWS = 3
+# cells of a line of pypdf layout text, i.e. words separated by single spaces, and the number of blank or single
+# cell lines a table may span
+_LAYOUT_CELL = re.compile(r"\S+(?: \S+)*")
+_MAX_TABLE_GAP_LINES = 2
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ParsedElement(NamedTuple):
+    """A text element of a parsed file, in a form cheap to send back from a worker process.
+
+    :param page: The 1-based page number, 0 when the format has no pages.
+    :param category: The unstructured element category, e.g. ``Title``, ``NarrativeText`` or ``Table``.
+    :param text: The text of the element.
+    :param html: The HTML of a table element, when its structure was inferred.
+    """
+
+    page: int
+    category: str
+    text: str
+    html: Optional[str] = None
+
+
+class ParsedBatch(NamedTuple):
+    """What a worker process returns for a file, or for a range of pages of a PDF.
+
+    :param elements: The text elements, in reading order.
+    :param facts: The numeric XBRL facts, see :meth:`xbrl.FactCollector.rows`.
+    :param fields: The document metadata stated by the file itself, e.g. by XBRL cover page facts; it overrides the
+                   metadata extracted from the text.
+    """
+
+    elements: List[ParsedElement]
+    facts: List[Dict[str, Any]]
+    fields: Dict[str, Any]
+
+
+def is_pdf(file_path: str) -> bool:
+    """Whether a file is a PDF, judged by its content rather than its name."""
+    with open(file_path, "rb") as f:
+        return f.read(len(_PDF_MAGIC)) == _PDF_MAGIC
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """Count the pages of a PDF by reading its page tree only."""
+    # pylint: disable=import-outside-toplevel
+    from pypdf import PdfReader
+
+    return len(PdfReader(file_path).pages)
+
+
+def page_batches(file_path: str, batch_size: int) -> List[Optional[Tuple[int, int]]]:
+    """Split a file into the ``(start, stop)`` page ranges parsed by separate tasks.
+
+    Files that are not PDFs, PDFs of at most ``batch_size`` pages and every file when ``batch_size`` is 0 are parsed
+    whole, which is a single ``None`` range.
+    """
+    if batch_size <= 0 or not is_pdf(file_path):
+        return [None]
+    try:
+        num_pages = count_pdf_pages(file_path)
+    except Exception:  # pylint: disable=broad-exception-caught
+        # a page tree pypdf cannot read is left to unstructured, whole
+        return [None]
+    if num_pages <= batch_size:
+        return [None]
+    return [(start, min(start + batch_size, num_pages)) for start in range(0, num_pages, batch_size)]
+
+
+def _extract_pages(file_path: str, start: int, stop: int) -> io.BytesIO:
+    """Copy a range of pages of a PDF into a new in-memory PDF."""
+    # pylint: disable=import-outside-toplevel
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for idx in range(start, stop):
+        writer.add_page(reader.pages[idx])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def file_format(file_path: str) -> str:
+    """Tell which parser a file goes to: one of the ``FORMAT_*`` constants."""
+    if is_pdf(file_path):
+        return FORMAT_PDF
+    suffix = os.path.splitext(file_path)[1].lower()
+    if suffix in _HTML_SUFFIXES:
+        return FORMAT_INLINE_XBRL if is_inline_xbrl(file_path) else FORMAT_HTML
+    if suffix == ".xml" and is_xbrl_instance(file_path):
+        return FORMAT_XBRL
+    if suffix in _TEXT_SUFFIXES:
+        return FORMAT_TEXT
+    return FORMAT_OTHER
+
+
+def parse_text(file_path: str) -> List[ParsedElement]:
+    """Read a plain text or Markdown file as one element per paragraph; Markdown headings become titles."""
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        paragraphs = [text.strip() for text in re.split(r"\n\s*\n", f.read())]
+    return [
+        ParsedElement(0, "Title", text.lstrip("#").strip())
+        if text.startswith("#") and "\n" not in text
+        else ParsedElement(0, "NarrativeText", text)
+        for text in paragraphs
+        if text
+    ]
+
+
+def parse_pdf_text(file_path: str, pages: Optional[Tuple[int, int]] = None) -> Optional[List[ParsedElement]]:
+    """Read a PDF, or a ``(start, stop)`` range of its pages, from its text layer, one element per page.
+
+    :returns: None when the pages hold too little text to be born-digital, or the text layer cannot be read.
+    """
+    # pylint: disable=import-outside-toplevel
+    from pypdf import PdfReader
+
+    try:
+        reader = PdfReader(file_path)
+        start, stop = pages or (0, len(reader.pages))
+        texts = [reader.pages[idx].extract_text() or "" for idx in range(start, stop)]
+    except Exception:  # pylint: disable=broad-exception-caught
+        # malformed PDFs raise more than PyPdfError, e.g. KeyError or struct.error, and go to unstructured instead
+        return None
+    if sum(len(text.strip()) for text in texts) < _MIN_TEXT_CHARS_PER_PAGE * max(len(texts), 1):
+        return None
+    return [
+        ParsedElement(page, "NarrativeText", text.strip())
+        for page, text in enumerate(texts, start=start + 1)
+        if text.strip()
+    ]
+
+
+def has_table(text: str) -> bool:
+    """Whether the text layer of a page holds a table, judged by its lines of several numeric cells."""
+    rows = sum(len(_NUMERIC_CELL.findall(line)) >= _MIN_ROW_CELLS for line in text.splitlines())
+    return rows >= _MIN_TABLE_ROWS
+
+
+def _layout_cells(line: str) -> List[Tuple[int, int, str]]:
+    """Return the ``(start, end, text)`` cells of a line of layout text, which runs of spaces separate."""
+    return [(match.start(), match.end(), match.group()) for match in _LAYOUT_CELL.finditer(line)]
+
+
+def _table_html(lines: List[List[Tuple[int, int, str]]]) -> str:
+    """Lay the cells of the lines of a table out in columns by their position, as an HTML table.
+
+    Cells of different rows overlapping horizontally share a column, whether the column is aligned left or right.
+    """
+    columns: List[List[int]] = []
+    for start, end, _ in sorted(cell for cells in lines for cell in cells):
+        if columns and start < columns[-1][1]:
+            columns[-1][1] = max(columns[-1][1], end)
+        else:
+            columns.append([start, end])
+    rows = []
+    for cells in lines:
+        row = [""] * len(columns)
+        for start, _, text in cells:
+            col = next(idx for idx, (_, end) in enumerate(columns) if start < end)
+            row[col] = f"{row[col]} {text}".strip()
+        rows.append("<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in row) + "</tr>")
+    return "<table>" + "".join(rows) + "</table>"
+
+
+def split_layout_tables(text: str, page: int) -> List[ParsedElement]:
+    """Split the layout text of a PDF page into narrative text and tables.
+
+    A table is a run of lines of several cells, which may be interrupted by a few blank lines or lines of a single
+    cell such as a section label, holding at least as many numeric rows as :func:`has_table` requires.
+    """
+    lines = text.splitlines()
+    cells = [_layout_cells(line) for line in lines]
+    blocks: List[Tuple[int, int]] = []
+    gap = 0
+    for idx, line_cells in enumerate(cells):
+        if len(line_cells) < 2:
+            gap += 1
+            continue
+        if blocks and gap <= _MAX_TABLE_GAP_LINES:
+            blocks[-1] = (blocks[-1][0], idx + 1)
+        else:
+            blocks.append((idx, idx + 1))
+        gap = 0
+
+    elements: List[ParsedElement] = []
+    narrative: List[str] = []
+
+    def flush() -> None:
+        paragraph = "\n".join(narrative).strip()
+        if paragraph:
+            elements.append(ParsedElement(page, "NarrativeText", paragraph))
+        narrative.clear()
+
+    position = 0
+    for start, stop in blocks:
+        if not has_table("\n".join(lines[start:stop])):
+            continue
+        narrative.extend(" ".join(line.split()) for line in lines[position:start])
+        flush()
+        table_lines = [line_cells for line_cells in cells[start:stop] if line_cells]
+        elements.append(
+            ParsedElement(
+                page,
+                "Table",
+                "\n".join(" ".join(cell[2] for cell in line_cells) for line_cells in table_lines),
+                _table_html(table_lines),
+            )
+        )
+        position = stop
+    narrative.extend(" ".join(line.split()) for line in lines[position:])
+    flush()
+    return elements
+
+
+def _parse_pdf_tables(file_path: str, elements: List[ParsedElement]) -> List[ParsedElement]:
+    """Rebuild the tables on the pages of a PDF read from its text layer from the layout text of those pages.
+
+    pypdf's layout mode keeps the horizontal position of the text, so the cells of a row stay apart and line up with
+    the cells of the other rows. When the layout text cannot be read, the plain text of the pages is kept.
+    """
+    table_pages = {element.page for element in elements if has_table(element.text)}
+    if not table_pages:
+        return elements
+    # pylint: disable=import-outside-toplevel
+    from pypdf import PdfReader
+
+    try:
+        reader = PdfReader(file_path)
+        layouts = {page: reader.pages[page - 1].extract_text(extraction_mode="layout") for page in table_pages}
+    except Exception as err:  # pylint: disable=broad-exception-caught
+        _LOGGER.warning("Unable to read the layout of pages %s of %s: %s", sorted(table_pages), file_path, err)
+        return elements
+    parsed = []
+    for element in elements:
+        layout = layouts.get(element.page)
+        parsed.extend(split_layout_tables(layout, element.page) if layout else [element])
+    return parsed
+
+
+# elements that start a new block of text
+_BLOCK_TAGS = {
+    "p", "div", "li", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "section", "article", "center",
+    "blockquote", "pre", "body", "table",
+}
+_HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+_SKIPPED_TAGS = {"script", "style", "head", "title", "ix:header"}
+_VOID_TAGS = {"br", "hr", "img", "meta", "link", "input", "col", "wbr"}
+_PAGE_BREAK_BEFORE = re.compile(r"break-before\s*:\s*(always|page)", re.IGNORECASE)
+_PAGE_BREAK_AFTER = re.compile(r"break-after\s*:\s*(always|page)", re.IGNORECASE)
+_BOLD = re.compile(r"font-weight\s*:\s*(bold|[6-9]00)", re.IGNORECASE)
+# bold blocks longer than this are emphasised prose rather than headings
+_MAX_TITLE_CHARS = 200
+
+
+class _HtmlElementParser(HTMLParser):
+    """Split an HTML document into titles, narrative text blocks and tables, counting page breaks.
+
+    The hidden header of inline XBRL filings is skipped; the facts tagged in the body are read as plain text.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.elements: List[ParsedElement] = []
+        self._page = 1
+        # the skipped element being read and how deep elements of its name are nested
+        self._skip_tag: Optional[str] = None
+        self._skip_depth = 0
+        # the open elements, whether each makes its text bold and whether a page break follows it
+        self._open: List[Tuple[str, bool, bool]] = []
+        self._text: List[str] = []
+        self._bold_chars = 0
+        self._heading = False
+        # the raw HTML of the table being read and how deep tables are nested
+        self._table: List[str] = []
+        self._table_depth = 0
+
+    def _flush(self) -> None:
+        text = " ".join("".join(self._text).split())
+        if text:
+            bold = self._bold_chars >= len(text.replace(" ", "")) and len(text) <= _MAX_TITLE_CHARS
+            category = "Title" if self._heading or (bold and not text.endswith(".")) else "NarrativeText"
+            self.elements.append(ParsedElement(self._page, category, text))
+        self._text, self._bold_chars, self._heading = [], 0, False
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self._skip_tag is not None or tag in _SKIPPED_TAGS:
+            if tag == (self._skip_tag or tag):
+                self._skip_tag, self._skip_depth = tag, self._skip_depth + 1
+            return
+        if self._table_depth:
+            self._table_depth += tag == "table"
+            self._table.append(self.get_starttag_text() or "")
+            return
+
+        style = dict(attrs).get("style") or ""
+        if tag in _BLOCK_TAGS:
+            self._flush()
+        if _PAGE_BREAK_BEFORE.search(style):
+            self._new_page()
+        break_after = bool(_PAGE_BREAK_AFTER.search(style))
+        if tag == "table":
+            self._table_depth, self._table = 1, [self.get_starttag_text() or ""]
+        elif tag == "br":
+            self._text.append(" ")
+        elif tag in _VOID_TAGS:
+            # EDGAR separates pages with <hr style="page-break-after: always">
+            if break_after:
+                self._new_page()
+        else:
+            self._heading = self._heading or tag in _HEADING_TAGS
+            self._open.append((tag, tag in ("b", "strong") or bool(_BOLD.search(style)), break_after))
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if not self._skip_depth:
+                    self._skip_tag = None
+            return
+        if self._table_depth:
+            self._table.append(f"</{tag}>")
+            self._table_depth -= tag == "table"
+            if not self._table_depth:
+                self._add_table("".join(self._table))
+            return
+
+        if tag in _BLOCK_TAGS:
+            self._flush()
+        # filings are often sloppy HTML: closing a tag also closes the unclosed tags opened inside it
+        if any(name == tag for name, _, _ in self._open):
+            break_after = False
+            while True:
+                name, _, closed_break_after = self._open.pop()
+                break_after = break_after or closed_break_after
+                if name == tag:
+                    break
+            if break_after:
+                self._new_page()
+
+    def _new_page(self) -> None:
+        self._flush()
+        self._page += 1
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_tag is not None:
+            return
+        if self._table_depth:
+            self._table.append(html.escape(data, quote=False))
+            return
+        self._text.append(data)
+        if any(bold for _, bold, _ in self._open):
+            self._bold_chars += len("".join(data.split()))
+
+    def _add_table(self, table_html: str) -> None:
+        text = " ".join(html.unescape(re.sub(r"<[^>]+>", " ", table_html)).split())
+        if text:
+            self.elements.append(ParsedElement(self._page, "Table", text, table_html))
+
+    def close(self) -> None:
+        super().close()
+        self._flush()
+
+
+def parse_html(file_path: str) -> List[ParsedElement]:
+    """Parse an HTML file into titles, text blocks and tables, numbering pages by their breaks."""
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        content = f.read()
+    parser = _HtmlElementParser()
+    parser.feed(content)
+    parser.close()
+    return parser.elements
+
+
+# inline XBRL fact elements and whether their text is numeric
+_IX_FACTS = {"ix:nonfraction": True, "ix:nonnumeric": False}
+
+
+class _InlineXbrlParser(_HtmlElementParser):
+    """Read an inline XBRL filing like any HTML document, collecting its tagged facts on the way."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.facts = FactCollector()
+        # the fact elements being read, with their attributes and, for those whose value is kept, their text
+        self._ix: List[Tuple[str, Dict[str, Optional[str]], Optional[List[str]]]] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attributes = dict(attrs)
+        self.facts.start(tag, attributes)
+        if tag in _IX_FACTS:
+            # the text of narrative text blocks is read as narrative, not as a fact
+            keep = _IX_FACTS[tag] or (attributes.get("name") or "").startswith("dei:")
+            self._ix.append((tag, attributes, [] if keep else None))
+        super().handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag: str) -> None:
+        self.facts.end(tag)
+        if tag in _IX_FACTS and self._ix and self._ix[-1][0] == tag:
+            _, attributes, parts = self._ix.pop()
+            if parts is not None:
+                self._add_fact(tag, attributes, "".join(parts))
+        super().handle_endtag(tag)
+
+    def handle_data(self, data: str) -> None:
+        self.facts.data(data)
+        for _, _, parts in self._ix:
+            if parts is not None:
+                parts.append(data)
+        super().handle_data(data)
+
+    def _add_fact(self, tag: str, attributes: Dict[str, Optional[str]], text: str) -> None:
+        concept = attributes.get("name") or ""
+        if not _IX_FACTS[tag]:
+            self.facts.add_text_fact(concept, text)
+            return
+        if attributes.get("xsi:nil") == "true":
+            return
+        value = inline_value(text, attributes.get("format"), attributes.get("scale"), attributes.get("sign"))
+        if value is not None:
+            self.facts.add_fact(
+                concept,
+                attributes.get("contextref") or "",
+                attributes.get("unitref") or "",
+                value,
+                attributes.get("decimals"),
+            )
+
+
+def parse_inline_xbrl(file_path: str) -> ParsedBatch:
+    """Parse an inline XBRL filing into its narrative elements and its numeric facts, in a single pass."""
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        content = f.read()
+    parser = _InlineXbrlParser()
+    parser.feed(content)
+    parser.close()
+    return ParsedBatch(parser.elements, parser.facts.rows(), parser.facts.metadata())
+
+
+def parse_xbrl_instance(file_path: str) -> ParsedBatch:
+    """Parse an XBRL instance document into its numeric facts and the narrative of its text blocks."""
+    collector, text_blocks = parse_instance(file_path)
+    elements = []
+    for concept, block in text_blocks:
+        elements.append(ParsedElement(0, "Title", concept_title(concept)))
+        # text blocks are escaped HTML; instance documents have no pages
+        parser = _HtmlElementParser()
+        parser.feed(block)
+        parser.close()
+        elements.extend(element._replace(page=0) for element in parser.elements)
+    return ParsedBatch(elements, collector.rows(), collector.metadata())
+
+
+@lru_cache
+def _unstructured() -> Tuple[Callable[..., Any], Callable[..., Any]]:
+    """Import unstructured's partitioners once per process, installing unstructured on first use."""
+    # pylint: disable=import-outside-toplevel
+    from llama_index import download_loader
+
+    download_loader("UnstructuredReader")
+    from unstructured.partition.auto import partition
+    from unstructured.partition.pdf import partition_pdf
+
+    return partition, partition_pdf
+
+
+def parse_unstructured(file_path: str, pages: Optional[Tuple[int, int]] = None) -> List[ParsedElement]:
+    """Parse any format unstructured knows, including scanned PDFs, with its layout analysis.
+
+    Table structure inference needs unstructured's hi_res layout model for PDFs, so it is only requested for scans;
+    PDFs with a text layer are partitioned with the fast strategy.
+    """
+    partition, partition_pdf = _unstructured()
+    if is_pdf(file_path):
+        if parse_pdf_text(file_path, pages) is not None:
+            options: Dict[str, Any] = {"strategy": "fast"}
+        else:
+            options = {"strategy": "hi_res", "infer_table_structure": True}
+        if pages is None:
+            elements, first_page = partition_pdf(filename=file_path, **options), 0
+        else:
+            elements, first_page = partition_pdf(file=_extract_pages(file_path, *pages), **options), pages[0]
+    else:
+        # the option only affects PDFs and images, which need the layout model anyway; other formats carry their
+        # tables as HTML
+        elements, first_page = partition(filename=file_path, infer_table_structure=True), 0
+
+    parsed = []
+    for element in elements:
+        text = str(element)
+        if not text.strip():
+            continue
+        page = getattr(element.metadata, "page_number", None)
+        parsed.append(
+            ParsedElement(
+                page=first_page + page if page else 0,
+                category=element.category,
+                text=text,
+                html=getattr(element.metadata, "text_as_html", None) if element.category == "Table" else None,
+            )
+        )
+    return parsed
+
+
+def parse_file(file_path: str, pages: Optional[Tuple[int, int]] = None, fast: bool = True) -> ParsedBatch:
+    """Parse a file, or the ``(start, stop)`` range of pages of a PDF, into its non-empty elements and XBRL facts.
+
+    XBRL facts are always read natively. With ``fast``, HTML and plain text are parsed directly and PDFs are read
+    from their text layer, the tables from its layout; scanned PDFs and every other format go through unstructured.
+    This is the CPU heavy stage of ingestion and is safe to run in a worker process.
+    """
+    kind = file_format(file_path)
+    if kind == FORMAT_XBRL:
+        return parse_xbrl_instance(file_path)
+    if kind == FORMAT_INLINE_XBRL:
+        batch = parse_inline_xbrl(file_path)
+        return batch if fast else batch._replace(elements=parse_unstructured(file_path))
+    if fast:
+        if kind == FORMAT_HTML:
+            return ParsedBatch(parse_html(file_path), [], {})
+        if kind == FORMAT_TEXT:
+            return ParsedBatch(parse_text(file_path), [], {})
+        if kind == FORMAT_PDF:
+            elements = parse_pdf_text(file_path, pages)
+            if elements is not None:
+                return ParsedBatch(_parse_pdf_tables(file_path, elements), [], {})
+    return ParsedBatch(parse_unstructured(file_path, pages), [], {})
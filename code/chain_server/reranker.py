@@ -0,0 +1,53 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cross-encoder reranking of retrieved chunks.
+
+The vector search cheaply returns a wide set of candidates; a small cross-encoder then reads every
+(query, chunk) pair and keeps the few chunks that actually answer the query, so the prompt stays short.
+"""
+import threading
+from typing import TYPE_CHECKING, List
+
+from sentence_transformers import CrossEncoder
+
+if TYPE_CHECKING:
+    from llama_index.schema import NodeWithScore
+
+
+class CrossEncoderReranker:
+    """Score query and chunk pairs with a cross-encoder and keep the best chunks."""
+
+    def __init__(self, model_name: str, device: str = "cpu", batch_size: int = 32, max_length: int = 512) -> None:
+        """Load the cross-encoder.
+
+        :param batch_size: Number of pairs scored per forward pass.
+        :param max_length: Number of tokens of each pair the model reads; longer chunks are truncated.
+        """
+        self._model = CrossEncoder(model_name, device=device, max_length=max_length)
+        self._batch_size = batch_size
+        # the model is shared by the retrieval threads and torch modules are not safe to call concurrently
+        self._lock = threading.Lock()
+
+    def rerank(self, query: str, nodes: List["NodeWithScore"], top_n: int) -> List["NodeWithScore"]:
+        """Return the ``top_n`` nodes most relevant to the query, with their cross-encoder scores."""
+        if not nodes:
+            return []
+        pairs = [(query, node.node.get_content()) for node in nodes]
+        with self._lock:
+            scores = self._model.predict(pairs, batch_size=self._batch_size, show_progress_bar=False)
+        for node, score in zip(nodes, scores):
+            node.score = float(score)
+        return sorted(nodes, key=lambda node: node.score or 0.0, reverse=True)[:top_n]
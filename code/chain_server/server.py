@@ -19,21 +19,33 @@ import os
 import shutil
 import json
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, AsyncGenerator, Dict, List, Optional
 import tempfile
+import threading
+import time
 
 from fastapi import FastAPI, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 from chain_server import chains
+from chain_server.ingestion import document_name, get_ingestion_pipeline, spool_upload
+from chain_server.metadata import METADATA_DEFAULTS, build_filter_expression
 
 # create the FastAPI server
 app = FastAPI()
-# prestage the embedding model
+# prestage the embedding and reranking models
 _ = chains.get_embedding_model()
+_ = chains.get_reranker()
+# load the index of the XBRL facts answering single number questions
+_ = chains.get_fact_index()
 # set the global service context for Llama Index
-chains.set_service_context("local", "playground_mistral_7b", "10.123.45.678", 256, 0.7, 1.0, 0.0)
+chains.set_service_context()
+# start the background ingestion workers
+_ = get_ingestion_pipeline()
+# index the chunks stored before hybrid retrieval was enabled
+threading.Thread(target=chains.backfill_sparse_index, name="sparse-backfill", daemon=True).start()
 
 
 class Prompt(BaseModel):
@@ -53,6 +65,11 @@ class Prompt(BaseModel):
     top_p: float
     freq_pen: float
     pres_pen: float
+    return_context: bool = False
+    num_docs: int = 4
+    coalesce_tokens: int = 1
+    coalesce_ms: float = 0.0
+    filters: Optional[Dict[str, Any]] = None
 
 
 class DocumentSearch(BaseModel):
@@ -60,6 +77,7 @@ class DocumentSearch(BaseModel):
 
     content: str
     num_docs: int = 4
+    filters: Optional[Dict[str, Any]] = None
 
 
 @app.get("/health")
@@ -69,74 +87,233 @@ async def health() -> JSONResponse:
     )
 
 
+@app.get("/metrics")
+async def metrics() -> JSONResponse:
+    """Report the chain server's cache and client counters."""
+    return JSONResponse(
+        content={
+            "query_embedding_cache": chains.get_query_embedding_cache().stats(),
+            "query_embedding_batcher": chains.get_embedding_batcher().stats(),
+            "llm_clients": chains.get_llm_clients().stats(),
+        },
+        status_code=200,
+    )
+
+
 @app.post("/uploadDocument")
-async def upload_document(file: UploadFile = File(...)) -> JSONResponse:
-    """Upload a document to the vector store."""
+async def upload_document(file: UploadFile = File(...), upsert: bool = True) -> JSONResponse:
+    """Upload a document to the vector store.
+
+    With ``upsert`` the document replaces any previous version uploaded under the same filename, which is the relative
+    path the file was uploaded with.
+    """
     if not file.filename:
         return JSONResponse(content={"message": "No files provided"}, status_code=200)
 
     upload_folder = tempfile.mkdtemp()
-    upload_file = os.path.basename(file.filename)
+    upload_file = document_name(file.filename)
     if not upload_file:
         raise RuntimeError("Error parsing uploaded filename.")
-    file_path = os.path.join(upload_folder, upload_file)
+    file_path = os.path.join(upload_folder, os.path.basename(upload_file))
     uploads_dir = Path(upload_folder)
     uploads_dir.mkdir(parents=True, exist_ok=True)
 
     with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+        await run_in_threadpool(shutil.copyfileobj, file.file, f)
 
-    chains.ingest_docs(file_path, upload_file)
+    job = get_ingestion_pipeline().submit(file_path, upload_file, cleanup=True, upsert=upsert)
 
     return JSONResponse(
-        content={"message": "File uploaded successfully"}, status_code=200
+        content={"message": "File uploaded successfully", "job_id": job.job_id}, status_code=200
     )
 
+
+@app.post("/uploadDocuments")
+async def upload_documents(files: List[UploadFile] = File(...), upsert: bool = True) -> JSONResponse:
+    """Upload many documents, or tar/zip archives of documents, to the vector store in one request.
+
+    Every file, and every member of an archive, gets its own status naming the uploaded file it came from in
+    ``upload``; accepted files also carry the ``job_id`` their progress is reported under.
+    """
+    pipeline = get_ingestion_pipeline()
+    output = []
+    for file in files:
+        upload_file = document_name(file.filename or "")
+        if not upload_file:
+            output.append(
+                {"filename": file.filename, "upload": file.filename, "status": "rejected", "message": "Missing filename"}
+            )
+            continue
+        try:
+            spooled = await run_in_threadpool(spool_upload, file.file, upload_file)
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            output.append({"filename": upload_file, "upload": upload_file, "status": "rejected", "message": str(err)})
+            continue
+        for file_path, filename in spooled:
+            job = pipeline.submit(file_path, filename, cleanup=True, upsert=upsert)
+            output.append({"filename": filename, "upload": upload_file, "status": job.status, "job_id": job.job_id})
+
+    return JSONResponse(content={"message": "Files uploaded successfully", "files": output}, status_code=200)
+
+
+@app.get("/uploadStatus/{job_id}")
+async def upload_status(job_id: str) -> JSONResponse:
+    """Report the ingestion progress of an uploaded document."""
+    job = get_ingestion_pipeline().get_job(job_id)
+    if job is None:
+        return JSONResponse(content={"message": "Unknown job id"}, status_code=404)
+    return JSONResponse(content=job.to_dict(), status_code=200)
+
+def _node_to_dict(node: Any) -> Dict[str, Any]:
+    """Serialize a retrieved node for the API."""
+    file_name = node.metadata["filename"]
+    decoded_filename = base64.b64decode(file_name.encode("utf-8")).decode("utf-8")
+    return {
+        "score": node.score,
+        "source": decoded_filename,
+        "content": node.text,
+        "metadata": {key: node.metadata.get(key, default) for key, default in METADATA_DEFAULTS.items()},
+    }
+
+
+def _event(event: str, data: Dict[str, Any]) -> str:
+    """Encode one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _generate_events(prompt: Prompt) -> AsyncGenerator[str, None]:
+    """Run the requested chain and stream its output as typed server-sent events.
+
+    The stream is made of ``meta`` events (retrieval results and per stage timings, merged by the client),
+    ``token`` events with the generated text, one ``usage`` event and a closing ``done`` event. Failures are
+    reported as an ``error`` event since the HTTP status has already been sent.
+    """
+    start = time.time()
+    retrieval_ms = 0
+    stages: Dict[str, int] = {}
+    try:
+        fact_answer = None
+        if prompt.use_knowledge_base:
+            fact_answer = chains.answer_from_facts(prompt.question, prompt.filters)
+            stages["facts_ms"] = int((time.time() - start) * 1000)
+        if fact_answer is not None and chains.get_config().retrieval.fact_answers == "direct":
+            # a single number question matched a fact stated by a filing, so retrieval and generation are skipped
+            retrieval_ms = int((time.time() - start) * 1000)
+            yield _event("meta", {"retrieval_ms": retrieval_ms, "stages": stages, "facts": [fact_answer.fact]})
+            generator = chains.fact_answer_streaming_async(fact_answer)
+        elif prompt.use_knowledge_base:
+            # retrieve once; the chain builds its prompt from the best of these nodes
+            num_nodes = chains.get_rag_num_nodes(prompt.inference_mode, prompt.nvcf_model_id)
+            nodes, search_stages = await chains.search_nodes_async(
+                prompt.question,
+                num_nodes=max(prompt.num_docs, num_nodes) if prompt.return_context else num_nodes,
+                filters=prompt.filters,
+            )
+            stages.update(search_stages)
+            candidates = nodes[:num_nodes]
+            if fact_answer is not None:
+                # the matched fact leads the context, next to the retrieved chunks in case it answers another question
+                candidates = [chains.fact_context_node(fact_answer, candidates), *candidates]
+            pack_start = time.time()
+            context_nodes = await chains.pack_nodes_async(prompt.question,
+                                                          candidates,
+                                                          prompt.num_tokens,
+                                                          prompt.inference_mode,
+                                                          prompt.local_model_id,
+                                                          prompt.nvcf_model_id)
+            stages["pack_ms"] = int((time.time() - pack_start) * 1000)
+            retrieval_ms = int((time.time() - start) * 1000)
+            meta: Dict[str, Any] = {"retrieval_ms": retrieval_ms, "stages": stages}
+            if prompt.return_context:
+                meta["nodes"] = [_node_to_dict(node) for node in nodes[:prompt.num_docs]]
+            if fact_answer is not None:
+                meta["facts"] = [fact_answer.fact]
+            yield _event("meta", meta)
+            generator = chains.rag_chain_streaming_async(prompt.question,
+                                                         prompt.num_tokens,
+                                                         prompt.inference_mode,
+                                                         prompt.local_model_id,
+                                                         prompt.nvcf_model_id,
+                                                         prompt.nim_model_ip,
+                                                         prompt.nim_model_port,
+                                                         prompt.nim_model_id,
+                                                         prompt.temp,
+                                                         prompt.top_p,
+                                                         prompt.freq_pen,
+                                                         prompt.pres_pen,
+                                                         retrieved_nodes=context_nodes)
+        else:
+            generator = chains.llm_chain_streaming_async(prompt.context,
+                                                         prompt.question,
+                                                         prompt.num_tokens,
+                                                         prompt.inference_mode,
+                                                         prompt.local_model_id,
+                                                         prompt.nvcf_model_id,
+                                                         prompt.nim_model_ip,
+                                                         prompt.nim_model_port,
+                                                         prompt.nim_model_id,
+                                                         prompt.temp,
+                                                         prompt.top_p,
+                                                         prompt.freq_pen,
+                                                         prompt.pres_pen)
+
+        # the chains report the time to first token as their first chunk
+        ttft_ms = int(await generator.__anext__())
+        yield _event("meta", {"ttft_ms": ttft_ms})
+
+        # coalesce chunks so the client handles one event per batch of tokens rather than per token
+        pending: List[str] = []
+        num_chunks = 0
+        last_flush = time.time()
+        async for chunk in generator:
+            pending.append(chunk)
+            num_chunks += 1
+            if len(pending) >= prompt.coalesce_tokens or (
+                prompt.coalesce_ms > 0 and (time.time() - last_flush) * 1000 >= prompt.coalesce_ms
+            ):
+                yield _event("token", {"text": "".join(pending)})
+                pending = []
+                last_flush = time.time()
+        if pending:
+            yield _event("token", {"text": "".join(pending)})
+
+        yield _event("usage", {
+            "completion_chunks": num_chunks,
+            "retrieval_ms": retrieval_ms,
+            "retrieval_stages": stages,
+            "ttft_ms": ttft_ms,
+            "total_ms": int((time.time() - start) * 1000),
+        })
+    except Exception as err:  # pylint: disable=broad-exception-caught
+        yield _event("error", {"message": str(err)})
+    yield _event("done", {})
+
+
 @app.post("/generate")
-async def generate_answer(prompt: Prompt) -> StreamingResponse:
-    """Generate and stream the response to the provided prompt."""
-    
-    if prompt.use_knowledge_base:
-        generator = chains.rag_chain_streaming(prompt.question, 
-                                               prompt.num_tokens, 
-                                               prompt.inference_mode, 
-                                               prompt.local_model_id,
-                                               prompt.nvcf_model_id,
-                                               prompt.nim_model_ip,
-                                               prompt.nim_model_port, 
-                                               prompt.nim_model_id,
-                                               prompt.temp,
-                                               prompt.top_p,
-                                               prompt.freq_pen,
-                                               prompt.pres_pen)
-        return StreamingResponse(generator, media_type="text/event-stream")  
-
-    generator = chains.llm_chain_streaming(prompt.context, 
-                                           prompt.question, 
-                                           prompt.num_tokens, 
-                                           prompt.inference_mode, 
-                                           prompt.local_model_id,
-                                           prompt.nvcf_model_id,
-                                           prompt.nim_model_ip,
-                                           prompt.nim_model_port,
-                                           prompt.nim_model_id,
-                                           prompt.temp,
-                                           prompt.top_p,
-                                           prompt.freq_pen,
-                                           prompt.pres_pen)
-    return StreamingResponse(generator, media_type="text/event-stream")    
+async def generate_answer(prompt: Prompt) -> Any:
+    """Generate and stream the response to the provided prompt as server-sent events.
+
+    With ``return_context`` the first ``meta`` event also carries the retrieved documents. ``filters`` restrict
+    retrieval to chunks whose metadata match, see :func:`metadata.build_filter_expression`. Questions matching an
+    XBRL fact, see :meth:`fact_index.FactIndex.answer`, carry the fact in their first ``meta`` event; depending on
+    ``retrieval.factAnswers`` the fact is the answer or leads the retrieved context.
+    """
+    try:
+        # malformed filters are rejected before the stream starts
+        build_filter_expression(prompt.filters)
+    except ValueError as err:
+        return JSONResponse(content={"message": str(err)}, status_code=400)
+    return StreamingResponse(
+        _generate_events(prompt), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
 
 
 @app.post("/documentSearch")
-def document_search(data: DocumentSearch) -> List[Dict[str, Any]]:
+async def document_search(data: DocumentSearch) -> Any:
     """Search for the most relevant documents for the given search parameters."""
-    retriever = chains.get_doc_retriever(num_nodes=data.num_docs)
-    nodes = retriever.retrieve(data.content)
-    output = []
-    for node in nodes:
-        file_name = nodes[0].metadata["filename"]
-        decoded_filename = base64.b64decode(file_name.encode("utf-8")).decode("utf-8")
-        entry = {"score": node.score, "source": decoded_filename, "content": node.text}
-        output.append(entry)
-
-    return output
+    try:
+        build_filter_expression(data.filters)
+    except ValueError as err:
+        return JSONResponse(content={"message": str(err)}, status_code=400)
+    nodes = await chains.retrieve_nodes_async(data.content, num_nodes=data.num_docs, filters=data.filters)
+    return [_node_to_dict(node) for node in nodes]
@@ -0,0 +1,302 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process BM25 inverted index kept next to the vector db.
+
+Dense embeddings match paraphrases well but miss exact terms such as tickers, line items or "Q3 FY2024"; a sparse
+index catches those, and the two rankings are combined with reciprocal rank fusion.
+
+The index is a list of immutable segments on disk::
+
+    manifest.json               the live segments, replaced atomically
+    seg-<n>/terms.json          term -> [offset, document frequency] into the postings
+    seg-<n>/postings.npy        int32 document ordinals, memory mapped
+    seg-<n>/frequencies.npy     uint16 term frequencies, memory mapped
+    seg-<n>/lengths.npy         int32 document lengths
+    seg-<n>/ids.json            the node id of every document ordinal
+    seg-<n>/deleted.npy         tombstones of deleted documents
+
+Every batch of inserted nodes becomes a new segment, and segments of similar size are merged as they accumulate,
+dropping deleted documents, so the cost of a merge stays logarithmic in the size of the index. Updating a node
+deletes its previous version.
+"""
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-/&][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the their this to was were what which "
+    "with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a text into lower case terms, keeping tokens such as ``fy2024``, ``10-k`` or ``s&p`` whole."""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class _Segment:
+    """An immutable slice of the index; only its tombstones change."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "terms.json"), encoding="utf-8") as f:
+            self.terms: Dict[str, List[int]] = json.load(f)
+        with open(os.path.join(path, "ids.json"), encoding="utf-8") as f:
+            self.ids: List[str] = json.load(f)
+        self.postings = np.load(os.path.join(path, "postings.npy"), mmap_mode="r")
+        self.frequencies = np.load(os.path.join(path, "frequencies.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(path, "lengths.npy"))
+        deleted_path = os.path.join(path, "deleted.npy")
+        if os.path.exists(deleted_path):
+            self.deleted = np.load(deleted_path)
+        else:
+            self.deleted = np.zeros(len(self.ids), dtype=bool)
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def num_live(self) -> int:
+        return len(self.ids) - int(self.deleted.sum())
+
+    def save_deleted(self) -> None:
+        _save_array(os.path.join(self.path, "deleted.npy"), self.deleted)
+
+    def documents(self) -> Iterable[Tuple[str, Dict[str, int], int]]:
+        """Yield the node id, term frequencies and length of every live document."""
+        terms: List[Dict[str, int]] = [{} for _ in self.ids]
+        for term, (offset, count) in self.terms.items():
+            for ordinal, frequency in zip(
+                self.postings[offset : offset + count], self.frequencies[offset : offset + count]
+            ):
+                terms[ordinal][term] = int(frequency)
+        for ordinal, node_id in enumerate(self.ids):
+            if not self.deleted[ordinal]:
+                yield node_id, terms[ordinal], int(self.lengths[ordinal])
+
+
+def _write_segment(path: str, documents: Sequence[Tuple[str, Dict[str, int], int]]) -> None:
+    """Write the postings of ``(node id, term frequencies, length)`` documents as a new segment."""
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    for ordinal, (_, frequencies, _) in enumerate(documents):
+        for term, frequency in frequencies.items():
+            postings.setdefault(term, []).append((ordinal, frequency))
+
+    terms: Dict[str, List[int]] = {}
+    ordinals: List[int] = []
+    counts: List[int] = []
+    for term in sorted(postings):
+        terms[term] = [len(ordinals), len(postings[term])]
+        for ordinal, frequency in postings[term]:
+            ordinals.append(ordinal)
+            counts.append(min(frequency, np.iinfo(np.uint16).max))
+
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".seg-")
+    np.save(os.path.join(tmp_path, "postings.npy"), np.asarray(ordinals, dtype=np.int32))
+    np.save(os.path.join(tmp_path, "frequencies.npy"), np.asarray(counts, dtype=np.uint16))
+    np.save(os.path.join(tmp_path, "lengths.npy"), np.asarray([doc[2] for doc in documents], dtype=np.int32))
+    with open(os.path.join(tmp_path, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f)
+    with open(os.path.join(tmp_path, "ids.json"), "w", encoding="utf-8") as f:
+        json.dump([doc[0] for doc in documents], f)
+    os.replace(tmp_path, path)
+
+
+class SparseIndex:
+    """A persistent BM25 index of node texts supporting incremental inserts, updates and deletes."""
+
+    def __init__(self, directory: str, k1: float = 1.2, b: float = 0.75, merge_factor: int = 4) -> None:
+        """Open the index stored in ``directory``, creating it if needed.
+
+        :param merge_factor: Segments are merged once this many of similar size have accumulated.
+        """
+        self._directory = directory
+        self._k1 = k1
+        self._b = b
+        self._merge_factor = max(2, merge_factor)
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments: List[_Segment] = []
+        self._next_segment = 0
+        manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._next_segment = manifest["next_segment"]
+            self._segments = [_Segment(os.path.join(directory, name)) for name in manifest["segments"]]
+        # where the live version of every node is stored
+        self._locations: Dict[str, Tuple[_Segment, int]] = {}
+        for segment in self._segments:
+            for ordinal, node_id in enumerate(segment.ids):
+                if not segment.deleted[ordinal]:
+                    self._locations[node_id] = (segment, ordinal)
+
+    def __len__(self) -> int:
+        """Return the number of live documents."""
+        with self._lock:
+            return len(self._locations)
+
+    def _save_manifest(self) -> None:
+        manifest = {"next_segment": self._next_segment, "segments": [segment.name for segment in self._segments]}
+        _write_atomic(os.path.join(self._directory, "manifest.json"), json.dumps(manifest).encode("utf-8"))
+
+    def _new_segment(self, documents: Sequence[Tuple[str, Dict[str, int], int]]) -> _Segment:
+        path = os.path.join(self._directory, f"seg-{self._next_segment:08d}")
+        self._next_segment += 1
+        _write_segment(path, documents)
+        return _Segment(path)
+
+    def add(self, documents: Iterable[Tuple[str, str]]) -> None:
+        """Index ``(node id, text)`` pairs, replacing earlier versions of the same nodes."""
+        batch: Dict[str, Tuple[str, Dict[str, int], int]] = {}
+        for node_id, text in documents:
+            tokens = tokenize(text)
+            frequencies: Dict[str, int] = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            batch[node_id] = (node_id, frequencies, len(tokens))
+        if not batch:
+            return
+
+        with self._lock:
+            self._delete_locked(batch.keys())
+            segment = self._new_segment(list(batch.values()))
+            self._segments.append(segment)
+            for ordinal, node_id in enumerate(segment.ids):
+                self._locations[node_id] = (segment, ordinal)
+            self._merge_locked()
+            self._save_manifest()
+
+    def delete(self, node_ids: Iterable[str]) -> None:
+        """Remove nodes from the index."""
+        with self._lock:
+            self._delete_locked(node_ids)
+            self._save_manifest()
+
+    def _delete_locked(self, node_ids: Iterable[str]) -> None:
+        touched = {}
+        for node_id in node_ids:
+            location = self._locations.pop(node_id, None)
+            if location is not None:
+                segment, ordinal = location
+                segment.deleted[ordinal] = True
+                touched[segment.name] = segment
+        for segment in touched.values():
+            segment.save_deleted()
+        # segments with no live documents left are dropped without waiting for a merge
+        empty = [segment for segment in self._segments if segment.num_live == 0]
+        if empty:
+            self._segments = [segment for segment in self._segments if segment.num_live > 0]
+            self._save_manifest()
+            for segment in empty:
+                shutil.rmtree(segment.path, ignore_errors=True)
+
+    def _merge_locked(self) -> None:
+        """Merge the newest segments while ``merge_factor`` of them are of comparable size."""
+        while len(self._segments) >= self._merge_factor:
+            tail = self._segments[-self._merge_factor :]
+            if len(tail[0].ids) > self._merge_factor * max(len(segment.ids) for segment in tail[1:]):
+                break
+            documents = [doc for segment in tail for doc in segment.documents()]
+            merged = self._new_segment(documents)
+            self._segments = self._segments[: -self._merge_factor] + [merged]
+            for ordinal, node_id in enumerate(merged.ids):
+                self._locations[node_id] = (merged, ordinal)
+            self._save_manifest()
+            for segment in tail:
+                shutil.rmtree(segment.path, ignore_errors=True)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """Return the ids and BM25 scores of the ``top_k`` best matching nodes."""
+        terms = set(tokenize(query))
+        with self._lock:
+            segments = list(self._segments)
+            num_docs = len(self._locations)
+        if not terms or not num_docs:
+            return []
+
+        total_length = sum(int(segment.lengths[~segment.deleted].sum()) for segment in segments)
+        avg_length = total_length / num_docs or 1.0
+        # deleted documents keep their postings until their segment is merged, so only live postings are counted
+        idf = {}
+        for term in terms:
+            df = 0
+            for segment in segments:
+                entry = segment.terms.get(term)
+                if entry is not None:
+                    df += int(np.count_nonzero(~segment.deleted[segment.postings[entry[0] : entry[0] + entry[1]]]))
+            if df:
+                idf[term] = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+        results: List[Tuple[str, float]] = []
+        for segment in segments:
+            scores = np.zeros(len(segment.ids), dtype=np.float32)
+            norm = self._k1 * (1 - self._b + self._b * segment.lengths / avg_length)
+            for term, weight in idf.items():
+                entry = segment.terms.get(term)
+                if entry is None:
+                    continue
+                ordinals = segment.postings[entry[0] : entry[0] + entry[1]]
+                frequencies = segment.frequencies[entry[0] : entry[0] + entry[1]].astype(np.float32)
+                scores[ordinals] += weight * frequencies * (self._k1 + 1) / (frequencies + norm[ordinals])
+            scores[segment.deleted] = 0
+            hits = np.flatnonzero(scores > 0)
+            if len(hits) > top_k:
+                hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+            results.extend((segment.ids[ordinal], float(scores[ordinal])) for ordinal in hits)
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:top_k]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists, scoring every id by the sum of ``1 / (k + rank)`` over the lists holding it."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking, start=1):
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,270 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tables of financial documents, kept whole as chunks and with their numbers in a columnar store.
+
+A balance sheet split by a text splitter ends up in several chunks, none of which pairs a line item with its
+column headers. Tables are instead serialised to Markdown and chunked by whole rows, each chunk repeating the
+header rows, and their numeric cells are written to a Parquet file per document::
+
+    <directory>/<file sha256>.parquet    one row per numeric cell: table id, page, row and column positions,
+                                         row and column headers, parsed value and raw text
+
+Table chunks carry ``content_type="table"`` and the ``table_id`` linking them to their cells.
+"""
+import os
+import re
+import tempfile
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, List, Optional
+
+CONTENT_TYPE = "content_type"
+TABLE_ID = "table_id"
+TABLE = "table"
+TEXT = "text"
+# metadata of table chunks, on top of the document metadata
+TABLE_METADATA_KEYS = (CONTENT_TYPE, TABLE_ID)
+
+_NUMBER = re.compile(r"[0-9]{1,3}(?:,[0-9]{3})+(?:\.[0-9]+)?|[0-9]+(?:\.[0-9]+)?|\.[0-9]+")
+_YEAR = re.compile(r"(19|20)[0-9]{2}")
+_FOOTNOTE = re.compile(r"(?<=\S)\s*(\(\d\)|\*+|†+)$")
+
+
+class _TableParser(HTMLParser):
+    """Collect the cell texts of the rows of an HTML table, repeating cells spanning several columns."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.rows: List[List[str]] = []
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+        self._colspan = 1
+
+    def handle_starttag(self, tag: str, attrs: List[Any]) -> None:
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+            colspan = dict(attrs).get("colspan") or "1"
+            self._colspan = int(colspan) if colspan.isdigit() else 1
+        elif tag == "br" and self._cell is not None:
+            self._cell.append(" ")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in ("td", "th") and self._row is not None and self._cell is not None:
+            text = " ".join("".join(self._cell).split())
+            self._row.extend([text] * max(self._colspan, 1))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if any(self._row):
+                self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data: str) -> None:
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+# cells EDGAR tables use for layout around the numbers
+_FILLER_CELLS = {"", "$", ")", "%", ")%"}
+
+
+def parse_html_table(html: str) -> List[List[str]]:
+    """Return the rows of an HTML table as lists of cell texts, padded to the same width.
+
+    Columns holding only currency signs, closing parentheses or nothing below the header rows are dropped; a
+    header spanning a number and its currency sign column repeats over both, so it is not taken into account.
+    """
+    parser = _TableParser()
+    parser.feed(html)
+    parser.close()
+    width = max((len(row) for row in parser.rows), default=0)
+    rows = [row + [""] * (width - len(row)) for row in parser.rows]
+    for row in rows:
+        for col in range(1, width):
+            if row[col] in (")", "%", ")%") and row[col - 1]:
+                row[col - 1], row[col] = row[col - 1] + row[col], ""
+    body = rows[num_header_rows(rows) :]
+    keep = [col for col in range(width) if any(row[col] not in _FILLER_CELLS for row in body)]
+    return [[row[col] for col in keep] for row in rows]
+
+
+def parse_number(text: str) -> Optional[float]:
+    """Parse a financial table cell such as ``$1,234.5``, ``(56)`` for -56, or ``12.5%``; None if not a number."""
+    text = _FOOTNOTE.sub("", text.strip()).replace("$", "").replace("\u2212", "-").strip()
+    negative = False
+    # EDGAR tables often put the closing parenthesis of a negative number in a cell of its own
+    if text.startswith("("):
+        negative, text = True, text[1:].rstrip(")").strip()
+    if text.startswith("-"):
+        negative, text = True, text[1:].strip()
+    text = text.rstrip("%").strip()
+    if not _NUMBER.fullmatch(text):
+        return None
+    value = float(text.replace(",", ""))
+    return -value if negative else value
+
+
+def _is_header_row(row: List[str]) -> bool:
+    # column headers of financial tables are text or fiscal years
+    return all(parse_number(cell) is None or _YEAR.fullmatch(cell.strip()) for cell in row[1:])
+
+
+def num_header_rows(rows: List[List[str]]) -> int:
+    """Count the leading rows holding column headers, at least one for a table of several rows."""
+    if len(rows) < 2:
+        return 0
+    count = 0
+    while count < len(rows) - 1 and _is_header_row(rows[count]):
+        count += 1
+    return max(count, 1)
+
+
+def _markdown_row(cells: List[str]) -> str:
+    return "| " + " | ".join(cell.replace("|", "\\|") for cell in cells) + " |"
+
+
+def to_markdown(header: List[List[str]], body: List[List[str]]) -> str:
+    """Serialise header and body rows to a Markdown table."""
+    width = len((header or body)[0])
+    header = header or [[""] * width]
+    lines = [_markdown_row(row) for row in header]
+    lines.insert(1, _markdown_row(["---"] * width))
+    lines.extend(_markdown_row(row) for row in body)
+    return "\n".join(lines)
+
+
+def table_chunks(
+    rows: List[List[str]], max_tokens: int, count_tokens: Callable[[str], int], title: str = ""
+) -> List[str]:
+    """Serialise a table to Markdown chunks of whole rows, each repeating the header rows, of about ``max_tokens``.
+
+    A single row longer than the budget still makes a chunk of its own.
+
+    :param count_tokens: Counts the tokens of a text with the embedding model's tokenizer.
+    :param title: A caption placed above every chunk, e.g. the text preceding the table.
+    """
+    if not rows:
+        return []
+    num_header = num_header_rows(rows)
+    header, body = rows[:num_header], rows[num_header:]
+    prefix = f"{title}\n\n" if title else ""
+    if not body:
+        return [prefix + to_markdown(header, [])]
+
+    # rows are measured one by one; a line break between rows is about one token
+    budget = max_tokens - count_tokens(prefix + to_markdown(header, []))
+    chunks: List[str] = []
+    group: List[List[str]] = []
+    used = 0
+    for row in body:
+        cost = count_tokens(_markdown_row(row)) + 1
+        if group and used + cost > budget:
+            chunks.append(prefix + to_markdown(header, group))
+            group, used = [], 0
+        group.append(row)
+        used += cost
+    chunks.append(prefix + to_markdown(header, group))
+    return chunks
+
+
+def numeric_cells(rows: List[List[str]], table_id: str, page: int) -> List[Dict[str, Any]]:
+    """Return the numeric cells of a table with their row and column headers."""
+    num_header = num_header_rows(rows)
+    header = rows[:num_header]
+    cells = []
+    for row_idx, row in enumerate(rows[num_header:], start=num_header):
+        row_header = row[0]
+        for col_idx, text in enumerate(row[1:], start=1):
+            value = parse_number(text)
+            if value is None:
+                continue
+            column_header = " ".join(dict.fromkeys(h[col_idx] for h in header if h[col_idx]))
+            cells.append(
+                {
+                    "table_id": table_id,
+                    "page": page,
+                    "row": row_idx,
+                    "column": col_idx,
+                    "row_header": row_header,
+                    "column_header": column_header,
+                    "value": value,
+                    "raw": text,
+                }
+            )
+    return cells
+
+
+class TableStore:
+    """The numeric cells of every parsed table, one Parquet file per document.
+
+    :param directory: The directory holding the Parquet files.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _path(self, doc_hash: str) -> str:
+        return os.path.join(self.directory, f"{doc_hash}.parquet")
+
+    def has(self, doc_hash: str) -> bool:
+        """Whether the cells of a document are stored."""
+        return os.path.exists(self._path(doc_hash))
+
+    def put(self, doc_hash: str, cells: List[Dict[str, Any]]) -> None:
+        """Write the cells of a document, atomically so concurrent readers see the old or the new file."""
+        # pylint: disable=import-outside-toplevel; pyarrow is only needed by ingestion and table lookups
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.directory, exist_ok=True)
+        table = pa.Table.from_pylist(cells, schema=_schema())
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_path, compression="zstd")
+            os.replace(tmp_path, self._path(doc_hash))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def cells(self, table_id: str) -> List[Dict[str, Any]]:
+        """Return the numeric cells of one table, in row then column order."""
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq
+
+        doc_hash = table_id.split(":", 1)[0]
+        if not self.has(doc_hash):
+            return []
+        table = pq.read_table(self._path(doc_hash), filters=[("table_id", "=", table_id)])
+        return sorted(table.to_pylist(), key=lambda cell: (cell["row"], cell["column"]))
+
+
+def _schema() -> Any:
+    # pylint: disable=import-outside-toplevel
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("table_id", pa.string()),
+            ("page", pa.int32()),
+            ("row", pa.int32()),
+            ("column", pa.int32()),
+            ("row_header", pa.string()),
+            ("column_header", pa.string()),
+            ("value", pa.float64()),
+            ("raw", pa.string()),
+        ]
+    )
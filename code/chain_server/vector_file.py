@@ -0,0 +1,195 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The full precision embeddings of the stored chunks, kept in a memory mapped file next to the vector db.
+
+With a compressed IVF_SQ8 or IVF_PQ index Milvus only holds quantized codes in memory, which shuffles the order of
+near ties. The vector db is asked for a few times more candidates than needed, and this file re-scores them exactly
+so only the page cache of the candidates' rows is touched per query::
+
+    vectors.bin     one row of ``dim`` values per appended embedding, memory mapped
+    rows.jsonl      the append log: ``[node id, row]`` for an insert, ``[node id, -1]`` for a delete
+
+Rows are never rewritten; re-inserting a node appends a new row and the log maps its id to the latest one. Rows
+beyond the last logged one, left by an interrupted append, are ignored and overwritten. The file also backs the
+embedded vector store, see :mod:`chain_server.embedded_store`, which scans it exactly with :meth:`VectorFile.search`.
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DTYPES = {"float32": np.float32, "float16": np.float16}
+# rows scored per matrix product of an exact scan, bounding the memory of the copied block
+_SCAN_BLOCK = 16384
+
+
+def read_log(path: str) -> List[Any]:
+    """Read the entries of a JSON lines append log, dropping the torn last line of an interrupted append."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        f.truncate(end)
+    return [json.loads(line) for line in data[:end].decode("utf-8").splitlines()]
+
+
+class VectorFile:
+    """An append-only store of embeddings keyed by node id.
+
+    :param directory: The directory holding the file.
+    :param dim: The dimension of the embeddings.
+    :param dtype: ``float32``, or ``float16`` to halve the file at a negligible cost in scoring precision.
+    """
+
+    def __init__(self, directory: str, dim: int, dtype: str = "float32") -> None:
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector file dtype {dtype!r}, expected one of {', '.join(DTYPES)}.")
+        self.directory = directory
+        self.dim = dim
+        self.dtype = np.dtype(DTYPES[dtype])
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._row_ids: Dict[int, str] = {}
+        self._live: Optional[Tuple[List[str], np.ndarray]] = None
+        self._num_rows = 0
+        self._matrix = np.zeros((0, dim), dtype=self.dtype)
+
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.bin")
+        self._log_path = os.path.join(directory, "rows.jsonl")
+        for node_id, row in read_log(self._log_path):
+            if row < 0:
+                self._row_ids.pop(self._rows.pop(node_id, -1), None)
+            else:
+                self._row_ids.pop(self._rows.get(node_id, -1), None)
+                self._rows[node_id] = row
+                self._row_ids[row] = node_id
+                self._num_rows = max(self._num_rows, row + 1)
+        self._remap()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def num_rows(self) -> int:
+        """The number of rows in the file, including those of deleted and replaced nodes."""
+        return self._num_rows
+
+    def node_id(self, row: int) -> Optional[str]:
+        """Return the node whose current embedding is at a row, if any."""
+        return self._row_ids.get(row)
+
+    def rows(self, start: int, stop: int) -> np.ndarray:
+        """Return a range of rows as float32."""
+        return np.asarray(self._matrix[start:stop], dtype=np.float32)
+
+    def _remap(self) -> None:
+        if self._num_rows:
+            self._matrix = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(self._num_rows, self.dim))
+
+    def add(self, items: Iterable[Tuple[str, Sequence[float]]]) -> None:
+        """Append the embeddings of a batch of nodes, replacing their previous versions."""
+        items = list(items)
+        if not items:
+            return
+        vectors = np.asarray([vector for _, vector in items], dtype=self.dtype)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim} dimensional embeddings, got {vectors.shape[1]}.")
+        with self._lock:
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(self._num_rows * self.dim * self.dtype.itemsize)
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._log_path, "a", encoding="utf-8") as f:
+                for offset, (node_id, _) in enumerate(items):
+                    f.write(json.dumps([node_id, self._num_rows + offset]) + "\n")
+            for offset, (node_id, _) in enumerate(items):
+                self._row_ids.pop(self._rows.get(node_id, -1), None)
+                self._rows[node_id] = self._num_rows + offset
+                self._row_ids[self._num_rows + offset] = node_id
+            self._num_rows += len(items)
+            self._live = None
+            self._remap()
+
+    def delete(self, node_ids: Iterable[str]) -> None:
+        """Forget the embeddings of the given nodes."""
+        with self._lock:
+            deleted = [node_id for node_id in node_ids if node_id in self._rows]
+            for node_id in deleted:
+                self._row_ids.pop(self._rows.pop(node_id), None)
+            if deleted:
+                self._live = None
+                with open(self._log_path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps([node_id, -1]) + "\n" for node_id in deleted)
+
+    def get(self, node_ids: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+        """Return the ids found in the file and their embeddings as float32, in the order requested."""
+        with self._lock:
+            found = [node_id for node_id in node_ids if node_id in self._rows]
+            rows = [self._rows[node_id] for node_id in found]
+            matrix = self._matrix
+        return found, np.asarray(matrix[rows], dtype=np.float32).reshape(len(rows), self.dim)
+
+    def score(self, query: Sequence[float], node_ids: Sequence[str], metric_type: str = "IP") -> Dict[str, float]:
+        """Score nodes against a query exactly, as Milvus does: inner product, or squared euclidean distance for L2.
+
+        Nodes missing from the file are left out.
+        """
+        found, vectors = self.get(node_ids)
+        query = np.asarray(query, dtype=np.float32)
+        if metric_type.upper() == "L2":
+            scores = ((vectors - query) ** 2).sum(axis=1)
+        else:
+            scores = vectors @ query
+        return dict(zip(found, scores.tolist()))
+
+    def search(
+        self, query: Sequence[float], top_k: int, metric_type: str = "IP", node_ids: Optional[Sequence[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """Return the ``top_k`` best nodes for a query by exact scan, best first.
+
+        :param node_ids: Restrict the scan to these nodes, e.g. those matching a metadata filter.
+        """
+        with self._lock:
+            if node_ids is None:
+                if self._live is None:
+                    self._live = (list(self._rows), np.fromiter(self._rows.values(), dtype=np.int64))
+                ids, rows = self._live
+            else:
+                ids = [node_id for node_id in node_ids if node_id in self._rows]
+                rows = np.asarray([self._rows[node_id] for node_id in ids], dtype=np.int64)
+            matrix = self._matrix
+        if not ids or top_k <= 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32)
+        l2 = metric_type.upper() == "L2"
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _SCAN_BLOCK):
+            # reading the rows in file order keeps the scan sequential
+            block_rows = rows[start : start + _SCAN_BLOCK]
+            order = np.argsort(block_rows)
+            block = np.asarray(matrix[block_rows[order]], dtype=np.float32)
+            scores[start + order] = -((block - query) ** 2).sum(axis=1) if l2 else block @ query
+
+        top_k = min(top_k, len(ids))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(ids[idx], float(-scores[idx] if l2 else scores[idx])) for idx in best]
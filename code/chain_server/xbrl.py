@@ -0,0 +1,381 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The tagged facts of XBRL filings, extracted at ingestion into a columnar fact table.
+
+EDGAR filings tag every number of their financial statements with a concept, a context giving the reporting entity,
+the period and any dimensions, and a unit. Those facts are read from inline XBRL (the ``ix:`` tags of the HTML
+filing) and from XBRL instance documents, and stored as one Parquet file per document::
+
+    <directory>/<file sha256>.parquet    one row per numeric fact: concept, entity, issuer, period start and end,
+                                         unit, dimensions, value, decimals and the issuer's fiscal year end
+    <directory>/documents.json           the file sha256 of the current version of every uploaded filename
+
+Instants have no period start. Dimensions are ``axis=member`` pairs joined by ``;``, empty for the facts of the
+entity as a whole. The ``dei:`` cover page facts also give the issuer, fiscal period and filing type of the document,
+and the fiscal year end as ``--MM-DD``.
+"""
+import datetime
+import decimal
+import json
+import os
+import re
+import tempfile
+import threading
+import xml.etree.ElementTree as ElementTree
+from typing import Any, Dict, List, Optional, Tuple
+
+_NUMBER = re.compile(r"[0-9]+(?:\.[0-9]+)?|\.[0-9]+")
+_NUMBER_WORDS = {"no": 0, "none": 0, "nil": 0, "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5}
+# the cover page facts kept for the document metadata
+_DEI_CONCEPTS = {
+    "dei:EntityRegistrantName",
+    "dei:DocumentType",
+    "dei:DocumentFiscalYearFocus",
+    "dei:DocumentFiscalPeriodFocus",
+    "dei:CurrentFiscalYearEndDate",
+}
+_INSTANCE_NAMESPACE = "http://www.xbrl.org/2003/instance"
+_INLINE_NAMESPACE = b"http://www.xbrl.org/2013/inlineXBRL"
+# inline XBRL filings declare their namespaces in the opening html tag
+_SNIFF_BYTES = 64 * 1024
+
+
+def local_name(name: str) -> str:
+    """Strip the prefix or the ``{namespace}`` of an XML name."""
+    return name.rsplit("}", 1)[-1].rsplit(":", 1)[-1]
+
+
+def is_inline_xbrl(file_path: str) -> bool:
+    """Whether an HTML file is an inline XBRL filing."""
+    with open(file_path, "rb") as f:
+        return _INLINE_NAMESPACE in f.read(_SNIFF_BYTES)
+
+
+def is_xbrl_instance(file_path: str) -> bool:
+    """Whether an XML file is an XBRL instance document."""
+    with open(file_path, "rb") as f:
+        return _INSTANCE_NAMESPACE.encode("ascii") in f.read(_SNIFF_BYTES)
+
+
+def inline_value(text: str, fmt: Optional[str], scale: Optional[str], sign: Optional[str]) -> Optional[float]:
+    """Parse the displayed text of an ``ix:nonFraction`` fact with its transformation format, scale and sign."""
+    fmt = local_name(fmt or "").lower()
+    text = text.strip()
+    if "zero" in fmt or text in ("-", "\u2013", "\u2014"):
+        value = 0.0
+    elif "word" in fmt:
+        if text.lower() not in _NUMBER_WORDS:
+            return None
+        value = float(_NUMBER_WORDS[text.lower()])
+    else:
+        # num-comma-decimal writes 1.234,5; every other numeric format 1,234.5
+        if "commadecimal" in fmt.replace("-", ""):
+            text = text.replace(".", "").replace(" ", "").replace(",", ".")
+        text = re.sub(r"[,\s]", "", text)
+        if not _NUMBER.fullmatch(text):
+            return None
+        value = float(text)
+    if scale and scale.lstrip("-").isdigit():
+        value *= 10 ** int(scale)
+    return -value if sign == "-" else value
+
+
+def instance_value(text: str) -> Optional[float]:
+    """Parse the value of a numeric fact of an instance document, an ``xsd:decimal`` or ``xsd:double`` literal.
+
+    Unlike the displayed text of inline facts, the literal carries its own sign and may use exponent notation.
+    """
+    try:
+        value = decimal.Decimal(text.strip())
+    except decimal.InvalidOperation:
+        return None
+    return float(value) if value.is_finite() else None
+
+
+def _date(text: str) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(text.strip()[:10])
+    except ValueError:
+        return None
+
+
+class FactCollector:
+    """The contexts, units and facts of one filing, read as a stream of XML events.
+
+    Contexts and units may be declared after the facts using them, so facts are resolved by :meth:`rows` once the
+    whole filing was read.
+    """
+
+    def __init__(self) -> None:
+        self._contexts: Dict[str, Dict[str, Any]] = {}
+        self._units: Dict[str, str] = {}
+        self._facts: List[Tuple[str, str, str, float, Optional[int]]] = []
+        self.dei: Dict[str, str] = {}
+        # the context or unit being read, the element whose text is awaited and its text so far
+        self._context: Optional[Dict[str, Any]] = None
+        self._unit: Optional[Tuple[str, List[str], List[str]]] = None
+        self._in_denominator = False
+        self._element: Optional[Tuple[str, Optional[str]]] = None
+        self._text: List[str] = []
+
+    def start(self, name: str, attrs: Dict[str, Optional[str]]) -> None:
+        """Handle the opening tag of a context or unit element, or of one of their children."""
+        name = local_name(name).lower()
+        if name == "context":
+            self._context = {"id": attrs.get("id") or "", "entity": "", "start": None, "end": None, "dims": []}
+        elif name == "unit":
+            self._unit = (attrs.get("id") or "", [], [])
+        elif name == "unitdenominator":
+            self._in_denominator = True
+        elif name in ("identifier", "startdate", "enddate", "instant", "measure", "explicitmember", "typedmember"):
+            self._element = (name, attrs.get("dimension"))
+            self._text = []
+
+    def data(self, text: str) -> None:
+        """Handle the text inside an element."""
+        if self._element is not None:
+            self._text.append(text)
+
+    def end(self, name: str) -> None:
+        """Handle a closing tag."""
+        name = local_name(name).lower()
+        if self._element is not None and name == self._element[0]:
+            self._close_element(" ".join("".join(self._text).split()))
+        elif name == "context" and self._context is not None:
+            self._contexts[self._context["id"]] = self._context
+            self._context = None
+        elif name == "unit" and self._unit is not None:
+            unit_id, numerator, denominator = self._unit
+            self._units[unit_id] = "*".join(numerator) + ("/" + "*".join(denominator) if denominator else "")
+            self._unit = None
+        elif name == "unitdenominator":
+            self._in_denominator = False
+
+    def _close_element(self, text: str) -> None:
+        name, dimension = self._element or ("", None)
+        self._element = None
+        if self._unit is not None and name == "measure":
+            self._unit[2 if self._in_denominator else 1].append(local_name(text))
+        elif self._context is not None:
+            if name == "identifier":
+                self._context["entity"] = text
+            elif name in ("startdate", "enddate", "instant"):
+                self._context["start" if name == "startdate" else "end"] = _date(text)
+            elif dimension:
+                self._context["dims"].append(f"{dimension}={text}")
+
+    def add_fact(self, concept: str, context_ref: str, unit_ref: str, value: float, decimals: Optional[str]) -> None:
+        """Record a numeric fact."""
+        places = int(decimals) if decimals and decimals.lstrip("-").isdigit() else None
+        self._facts.append((concept, context_ref, unit_ref, value, places))
+
+    def add_text_fact(self, concept: str, text: str) -> None:
+        """Record a non-numeric fact; only the cover page facts of the document metadata are kept."""
+        if concept in _DEI_CONCEPTS and concept not in self.dei:
+            self.dei[concept] = " ".join(text.split())
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """Return the numeric facts with their contexts and units resolved, each reported once."""
+        issuer = self.dei.get("dei:EntityRegistrantName", "")
+        year_end = self.dei.get("dei:CurrentFiscalYearEndDate") or None
+        seen = set()
+        rows = []
+        for concept, context_ref, unit_ref, value, decimals in self._facts:
+            context = self._contexts.get(context_ref)
+            # filings repeat the same fact wherever it is displayed
+            if context is None or context["end"] is None or (concept, context_ref, unit_ref) in seen:
+                continue
+            seen.add((concept, context_ref, unit_ref))
+            rows.append(
+                {
+                    "concept": concept,
+                    "entity": context["entity"],
+                    "issuer": issuer,
+                    "period_start": context["start"],
+                    "period_end": context["end"],
+                    "unit": self._units.get(unit_ref, unit_ref),
+                    "dimensions": ";".join(sorted(context["dims"])),
+                    "value": value,
+                    "decimals": decimals,
+                    "fiscal_year_end": year_end,
+                }
+            )
+        return rows
+
+    def metadata(self) -> Dict[str, Any]:
+        """Return the document metadata given by the cover page facts, see :data:`metadata.METADATA_DEFAULTS`."""
+        fields: Dict[str, Any] = {}
+        if self.dei.get("dei:EntityRegistrantName"):
+            fields["issuer"] = self.dei["dei:EntityRegistrantName"].upper()
+        if self.dei.get("dei:DocumentType"):
+            fields["filing_type"] = self.dei["dei:DocumentType"].upper()
+        year = self.dei.get("dei:DocumentFiscalYearFocus", "")
+        if year.isdigit():
+            fields["fiscal_year"] = int(year)
+        period = self.dei.get("dei:DocumentFiscalPeriodFocus", "").upper()
+        if period in ("Q1", "Q2", "Q3", "Q4"):
+            fields["fiscal_quarter"] = int(period[1])
+        return fields
+
+
+def parse_instance(file_path: str) -> Tuple[FactCollector, List[Tuple[str, str]]]:
+    """Read the facts of an XBRL instance document.
+
+    :returns: The collected facts, and the ``(concept, html)`` text blocks holding the narrative of the filing.
+    """
+    collector = FactCollector()
+    text_blocks: List[Tuple[str, str]] = []
+    prefixes: Dict[str, str] = {}
+    depth = 0
+    for event, item in ElementTree.iterparse(file_path, events=("start-ns", "start", "end")):
+        if event == "start-ns":
+            prefix, uri = item
+            prefixes.setdefault(uri, prefix)
+            continue
+        tag = item.tag
+        if event == "start":
+            depth += 1
+            collector.start(tag, dict(item.attrib))
+            continue
+        depth -= 1
+        if item.text:
+            collector.data(item.text)
+        collector.end(tag)
+        # facts are the children of the root element carrying a context
+        context_ref = item.get("contextRef")
+        if depth == 1 and context_ref:
+            uri, _, name = tag[1:].partition("}") if tag.startswith("{") else ("", "", tag)
+            concept = f"{prefixes.get(uri, '')}:{name}".lstrip(":")
+            text = item.text or ""
+            unit_ref = item.get("unitRef")
+            if unit_ref:
+                value = instance_value(text)
+                if value is not None:
+                    collector.add_fact(concept, context_ref, unit_ref, value, item.get("decimals"))
+            elif concept.endswith("TextBlock"):
+                text_blocks.append((concept, text))
+            else:
+                collector.add_text_fact(concept, text)
+        if depth <= 1:
+            # facts are read one at a time, so the tree of a large instance never builds up
+            item.clear()
+    return collector, text_blocks
+
+
+def concept_title(concept: str) -> str:
+    """Turn a concept name such as ``us-gaap:RevenueRecognitionPolicyTextBlock`` into a section title."""
+    name = re.sub(r"TextBlock$", "", local_name(concept))
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", " ", name).strip()
+
+
+class FactStore:
+    """The numeric XBRL facts of every parsed filing, one Parquet file per document.
+
+    :param directory: The directory holding the Parquet files.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._manifest = os.path.join(directory, "documents.json")
+        self._lock = threading.Lock()
+
+    def _path(self, doc_hash: str) -> str:
+        return os.path.join(self.directory, f"{doc_hash}.parquet")
+
+    def has(self, doc_hash: str) -> bool:
+        """Whether the facts of a document are stored."""
+        return os.path.exists(self._path(doc_hash))
+
+    def linked(self) -> Dict[str, str]:
+        """Return the hash of the current version of every filename whose facts are stored."""
+        if not os.path.exists(self._manifest):
+            return {}
+        with open(self._manifest, encoding="utf-8") as f:
+            return json.load(f)  # type: ignore[no-any-return]
+
+    def link(self, filename: str, doc_hash: Optional[str]) -> Optional[str]:
+        """Make ``doc_hash`` the current version of a filename, or forget the filename when None.
+
+        The facts of the version replaced are deleted once no filename links to them any more.
+
+        :returns: The hash of the version replaced, if any.
+        """
+        with self._lock:
+            linked = self.linked()
+            replaced = linked.pop(filename, None)
+            if doc_hash is not None:
+                linked[filename] = doc_hash
+            if replaced == doc_hash:
+                return replaced
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(linked, f)
+                os.replace(tmp_path, self._manifest)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            if replaced is not None and replaced not in linked.values() and self.has(replaced):
+                os.unlink(self._path(replaced))
+        return replaced
+
+    def put(self, doc_hash: str, facts: List[Dict[str, Any]]) -> None:
+        """Write the facts of a document, atomically so concurrent readers see the old or the new file."""
+        # pylint: disable=import-outside-toplevel
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.directory, exist_ok=True)
+        table = pa.Table.from_pylist(facts, schema=_schema())
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            # the repeated concept, entity, issuer and unit strings are dictionary encoded
+            pq.write_table(table, tmp_path, compression="zstd")
+            os.replace(tmp_path, self._path(doc_hash))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def facts(self, doc_hash: str) -> List[Dict[str, Any]]:
+        """Return the facts of one document."""
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq
+
+        if not self.has(doc_hash):
+            return []
+        return pq.read_table(self._path(doc_hash)).to_pylist()  # type: ignore[no-any-return]
+
+
+def _schema() -> Any:
+    # pylint: disable=import-outside-toplevel
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("concept", pa.string()),
+            ("entity", pa.string()),
+            ("issuer", pa.string()),
+            ("period_start", pa.date32()),
+            ("period_end", pa.date32()),
+            ("unit", pa.string()),
+            ("dimensions", pa.string()),
+            ("value", pa.float64()),
+            ("decimals", pa.int32()),
+            ("fiscal_year_end", pa.string()),
+        ]
+    )
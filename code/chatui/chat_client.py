@@ -14,8 +14,12 @@
 # limitations under the License.
 
 """The API client for the langchain-esque service."""
+import codecs
+import contextlib
+import json
 import logging
 import mimetypes
+import os
 import typing
 
 import requests
@@ -38,10 +42,13 @@ class ChatClient:
         return self._model_name
 
     def search(
-        self, prompt: str
+        self, prompt: str, filters: typing.Optional[typing.Dict[str, typing.Any]] = None
     ) -> typing.List[typing.Dict[str, typing.Union[str, float]]]:
-        """Search for relevant documents and return json data."""
-        data = {"content": prompt, "num_docs": 4}
+        """Search for relevant documents and return json data.
+
+        ``filters`` restrict the search by issuer, fiscal_year, fiscal_quarter, filing_type or page.
+        """
+        data = {"content": prompt, "num_docs": 4, "filters": filters}
         headers = {"accept": "application/json", "Content-Type": "application/json"}
         url = f"{self.server_url}/documentSearch"
         _LOGGER.debug(
@@ -94,25 +101,118 @@ class ChatClient:
         msg = str({"server_url": url, "post_data": data})
         print(f"making inference request - {msg}")
 
+        # keep the historic contract: time to first token first, then the generated text
+        for event, payload in self._stream_events(url, data):
+            if event == "meta" and "ttft_ms" in payload:
+                yield str(payload["ttft_ms"])
+            elif event == "token":
+                yield payload["text"]
+            elif event == "error":
+                raise RuntimeError(payload["message"])
+
+    def predict_with_context(
+        self, 
+        query: str, 
+        mode: str, 
+        local_model_id: str,
+        nvcf_model_id: str, 
+        nim_model_ip: str,
+        nim_model_port: str, 
+        nim_model_id: str,
+        temp_slider: float,
+        top_p_slider: float,
+        freq_pen_slider: float,
+        pres_pen_slider: float,
+        num_tokens: int,
+        num_docs: int = 4,
+        coalesce_tokens: int = 4,
+        filters: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> typing.Generator[typing.Tuple[str, typing.Dict[str, typing.Any]], None, None]:
+        """Retrieve documents and make a model prediction in a single request.
+
+        Yields ``(event, data)`` pairs: ``meta`` events with the retrieved documents and timings, ``token``
+        events with the generated text, then ``usage`` and ``done``. ``filters`` restrict retrieval as in
+        :meth:`search`.
+        """
+        data = {
+            "question": query,
+            "context": "",
+            "use_knowledge_base": True,
+            "return_context": True,
+            "num_docs": num_docs,
+            "coalesce_tokens": coalesce_tokens,
+            "filters": filters,
+            "num_tokens": num_tokens,
+            "inference_mode": mode,
+            "local_model_id": local_model_id,
+            "nvcf_model_id": nvcf_model_id,
+            "nim_model_ip": nim_model_ip,
+            "nim_model_port": nim_model_port, 
+            "nim_model_id": nim_model_id,
+            "temp": temp_slider,
+            "top_p": top_p_slider,
+            "freq_pen": freq_pen_slider,
+            "pres_pen": pres_pen_slider,
+        }
+        url = f"{self.server_url}/generate"
+        _LOGGER.info(
+            "making inference request - %s", str({"server_url": url, "post_data": data})
+        )
+
+        yield from self._stream_events(url, data)
+
+    @staticmethod
+    def _stream_events(
+        url: str, data: typing.Dict[str, typing.Any]
+    ) -> typing.Generator[typing.Tuple[str, typing.Dict[str, typing.Any]], None, None]:
+        """POST a request and parse the server-sent events of the response."""
+        # decode incrementally so multi-byte characters split across network reads stay intact
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
         with requests.post(url, stream=True, json=data, timeout=30) as req:
-            for chunk in req.iter_content(16):
-                yield chunk.decode("UTF-8")
+            if req.status_code != 200:
+                # requests rejected before streaming starts, such as invalid filters, come back as plain json;
+                # errors from a proxy in between may not be json at all
+                try:
+                    message = req.json().get("message", req.text)
+                except ValueError:
+                    message = req.text or f"Request failed with status code {req.status_code}"
+                yield "error", {"message": message}
+                return
+            for raw in req.iter_content(chunk_size=None):
+                buffer += decoder.decode(raw)
+                while "\n\n" in buffer:
+                    block, buffer = buffer.split("\n\n", 1)
+                    event, lines = "message", []
+                    for line in block.split("\n"):
+                        if line.startswith("event:"):
+                            event = line[len("event:"):].strip()
+                        elif line.startswith("data:"):
+                            lines.append(line[len("data:"):].lstrip())
+                    if lines:
+                        yield event, json.loads("\n".join(lines))
 
     def upload_documents(self, file_paths: typing.List[str]) -> None:
         """Upload documents to the kb."""
-        url = f"{self.server_url}/uploadDocument"
+        url = f"{self.server_url}/uploadDocuments"
         headers = {
             "accept": "application/json",
         }
+        if not file_paths:
+            return
 
-        for fpath in file_paths:
-            mime_type, _ = mimetypes.guess_type(fpath)
-            # pylint: disable-next=consider-using-with # with pattern is not intuitive here
-            files = {"file": (fpath, open(fpath, "rb"), mime_type)}
+        with contextlib.ExitStack() as stack:
+            files = []
+            for fpath in file_paths:
+                mime_type, _ = mimetypes.guess_type(fpath)
+                # the server stores uploads under the name they were sent with; the UI's temporary directory is no
+                # part of that name, so a file uploaded again replaces its earlier version
+                name = os.path.basename(fpath)
+                files.append(("files", (name, stack.enter_context(open(fpath, "rb")), mime_type)))
 
             _LOGGER.debug(
-                "uploading file - %s",
-                str({"server_url": url, "file": fpath}),
+                "uploading files - %s",
+                str({"server_url": url, "files": file_paths}),
             )
 
             _ = requests.post(
@@ -256,6 +256,8 @@ def build_page(client: chat_client.ChatClient) -> gr.Blocks:
                                               file_types=["text",
                                                           ".pdf",
                                                           ".html",
+                                                          ".htm",
+                                                          ".xml",
                                                           ".doc",
                                                           ".docx",
                                                           ".txt",
@@ -880,39 +882,41 @@ def _stream_predict(
             retrieval_ftime = ""
             chunks = ""
             e2e_stime = time.time()
-            retrieval_stime = time.time()
-            documents = client.search(question)
-            retrieval_ftime = str((time.time() - retrieval_stime) * 1000).split('.', 1)[0]
-
-            # Generate the output
-            chunk_num = 0
-            for chunk in client.predict(question, 
-                                        utils.inference_to_config(inference_mode), 
-                                        local_model_id,
-                                        utils.cloud_to_config(nvcf_model_id), 
-                                        "local_nim" if is_local_nim else nim_model_ip, 
-                                        "8000" if is_local_nim else nim_model_port, 
-                                        utils.nim_extract_model(nim_local_model_id) if is_local_nim else nim_model_id,
-                                        temp_slider,
-                                        top_p_slider,
-                                        freq_pen_slider,
-                                        pres_pen_slider,
-                                        True, 
-                                        int(num_token_slider)):
-                
-                # The first chunk returned will always be the time to first token. Let's process that first.
-                if chunk_num == 0:
-                    chunk_num += 1
-                    ttft = chunk
-                    updated_metrics_history = utils.get_initial_metrics(metrics_history, response_num, inference_mode, nvcf_model_id, local_model_id, 
-                                                                        nim_local_model_id, is_local_nim, nim_model_id, retrieval_ftime, ttft)
-                    yield "", chat_history, documents, gr.update(value=updated_metrics_history), updated_metrics_history
-                
-                # Every next chunk will be the generated response. Let's append to the output and render it in real time. 
-                else:
-                    chunks += chunk
-                    chunk_num += 1
-                yield "", chat_history + [[question, chunks]], documents, gr.update(value=metrics_history), metrics_history
+            ttft = ""
+
+            # Retrieve the documents and generate the output in a single request
+            for event, data in client.predict_with_context(question, 
+                                                     utils.inference_to_config(inference_mode), 
+                                                     local_model_id,
+                                                     utils.cloud_to_config(nvcf_model_id), 
+                                                     "local_nim" if is_local_nim else nim_model_ip, 
+                                                     "8000" if is_local_nim else nim_model_port, 
+                                                     utils.nim_extract_model(nim_local_model_id) if is_local_nim else nim_model_id,
+                                                     temp_slider,
+                                                     top_p_slider,
+                                                     freq_pen_slider,
+                                                     pres_pen_slider,
+                                                     int(num_token_slider)):
+
+                # Meta events carry the retrieved documents first, then the time to first token.
+                if event == "meta":
+                    if "nodes" in data:
+                        documents = data["nodes"]
+                    if "retrieval_ms" in data:
+                        retrieval_ftime = str(data["retrieval_ms"])
+                    if "ttft_ms" in data:
+                        ttft = str(data["ttft_ms"])
+                        utils.get_initial_metrics(metrics_history, response_num, inference_mode, nvcf_model_id, local_model_id, 
+                                                  nim_local_model_id, is_local_nim, nim_model_id, retrieval_ftime, ttft)
+                    yield "", chat_history + [[question, chunks]], documents, gr.update(value=metrics_history), metrics_history
+
+                # Token events carry the generated response. Let's append to the output and render it in real time. 
+                elif event == "token":
+                    chunks += data["text"]
+                    yield "", chat_history + [[question, chunks]], documents, gr.update(value=metrics_history), metrics_history
+
+                elif event == "error":
+                    raise RuntimeError(data["message"])
 
             # With final output generated, run some final calculations and display them as metrics to the user
             gen_time, e2e_ftime, tokens, tokens_sec, itl = utils.get_final_metrics(time.time(), e2e_stime, ttft, retrieval_ftime, chunks)
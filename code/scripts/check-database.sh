@@ -1,3 +1,8 @@
+# The embedded vector store lives in the chain server; there is no database to wait for.
+if [ "${APP_VECTORSTORE_BACKEND:-milvus}" = "embedded" ]; then
+    exit 0
+fi
+
 # Wait for service to be reachable.
 ATTEMPTS=0
 MAX_ATTEMPTS=30
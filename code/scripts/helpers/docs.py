@@ -31,10 +31,11 @@ def in_jupyter():
         return False
 
 class DocProcessor:
-    def __init__(self, docs_dir, mount_docs_dir, upload_url, log=False):
+    def __init__(self, docs_dir, mount_docs_dir, upload_url, log=False, batch_size=50):
         self.docs_dir = docs_dir
         self.mount_docs_dir = mount_docs_dir
         self.upload_url = upload_url
+        self.batch_size = batch_size
         self.record_file = os.path.join(docs_dir, ".file_cache.json")
         self.record_lock_file = os.path.join(docs_dir, ".file_cache.lock")
         self.record = dict()
@@ -72,37 +73,57 @@ class DocProcessor:
         filehash = self._calculate_hash(filepath)
         return self.record.get(filepath) == filehash, filehash
 
-    def _process_doc(self, filepath):
-        """Process the file if it hasn't been processed or if the content has changed."""
-        has_been_processed, filehash = self._has_been_processed(filepath)
-        if not has_been_processed:
-            try:
-                self._upload_document(filepath)
+    def _process_batch(self, batch):
+        """Upload a batch of new or changed files in a single request and record the ones accepted."""
+        try:
+            statuses = self._upload_documents([(filepath, name) for filepath, name, _ in batch])
+        except Exception as err:
+            for filepath, _, _ in batch:
+                print(f"{filepath} - failed: {err}")
+            return
+
+        # an archive yields one status per member, so every status is matched back to the file it was uploaded in
+        by_upload = {}
+        for status in statuses.values():
+            by_upload.setdefault(status.get("upload"), []).append(status)
+
+        for filepath, name, filehash in batch:
+            file_statuses = by_upload.get(name, [])
+            rejected = [status for status in file_statuses if status.get("status") == "rejected"]
+            if file_statuses and not rejected:
                 self.record[filepath] = filehash
-
                 if self.log:
                     print(f"{filepath} - processed.")
-            except Exception as err:
-                    print(f"{filepath} - failed: {err}")
-        else:
-            if self.log:
-                print(f"Skipping {filepath}, already processed.")
+            else:
+                message = rejected[0].get("message") if rejected else "missing from server response"
+                print(f"{filepath} - failed: {message}")
+
+    def _upload_documents(self, uploads):
+        """Send many ``(file_path, name)`` files to the bulk upload endpoint and return the per-file status keyed by job id.
 
-    def _upload_document(self, file_path):
+        The server stores every file under its name, the path relative to the scanned directory.
+        """
         headers = {
             'accept': 'application/json'
         }
-        mime_type, _ = mimetypes.guess_type(file_path)
-        files = {
-            'file': (file_path, open(file_path, 'rb'), mime_type)
-        }
-        response = requests.post(self.upload_url, headers=headers, files=files)
+        files = []
+        try:
+            for file_path, name in uploads:
+                mime_type, _ = mimetypes.guess_type(file_path)
+                files.append(('files', (name, open(file_path, 'rb'), mime_type)))
+            response = requests.post(self.upload_url, headers=headers, files=files)
+        finally:
+            for _, (_, handle, _) in files:
+                handle.close()
 
         if response.status_code != 200:
             raise Exception(f"Document upload failed with status code {response.status_code}: {response.text}")
-        
-        if "File uploaded successfully" not in response.text:
-            raise Exception(f"Document upload failed: {response.text}")
+
+        # rejected files have no job id, their position in the response keeps them apart
+        return {
+            status.get("job_id") or f"rejected-{idx}": status
+            for idx, status in enumerate(response.json().get("files", []))
+        }
     
     def _count_files(self, dir_list):
         file_count = 0
@@ -125,6 +146,7 @@ class DocProcessor:
 
         try:
             with tqdm(total=total_files) as pbar:
+                batch = []
                 for directory in dir_list:
                     for root, _, files in os.walk(directory):
                         for file in files:
@@ -133,13 +155,32 @@ class DocProcessor:
                                 continue
                                 
                             file_path = os.path.join(root, file)
-                            self._process_doc(file_path)
-                            pbar.update(1)
+                            has_been_processed, filehash = self._has_been_processed(file_path)
+                            if has_been_processed:
+                                if self.log:
+                                    print(f"Skipping {file_path}, already processed.")
+                                pbar.update(1)
+                                continue
+
+                            # statuses are matched by upload name, so a batch never holds the same name twice
+                            name = os.path.relpath(file_path, directory).replace(os.sep, "/")
+                            if any(other == name for _, other, _ in batch):
+                                self._process_batch(batch)
+                                pbar.update(len(batch))
+                                batch = []
+                            batch.append((file_path, name, filehash))
+                            if len(batch) >= self.batch_size:
+                                self._process_batch(batch)
+                                pbar.update(len(batch))
+                                batch = []
+                if batch:
+                    self._process_batch(batch)
+                    pbar.update(len(batch))
         finally:
             # save cache data and unlock
             self._save()
 
 
 if __name__ == "__main__":
-    p = DocProcessor("../data/documents", "/mnt/docs", "http://localhost:8000/uploadDocument", True)
+    p = DocProcessor("../data/documents", "/mnt/docs", "http://localhost:8000/uploadDocuments", True)
     p.process()
\ No newline at end of file
@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compare an embedding backend against the fp32 reference model.
+#
+# Usage: python embedding-parity.py [--backend onnx-int8] [--corpus DIR] [--threshold 0.99]
+#
+# Every text of the corpus is embedded with both models and the cosine similarity of each pair is reported.
+# The script exits with a non-zero status when the mean similarity falls below the threshold.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from chain_server.chains import EMBEDDING_MODEL, get_embedding_device  # noqa: E402
+from chain_server.embedding_backends import BACKEND_TORCH, BACKENDS, create_embeddings  # noqa: E402
+
+SAMPLE_TEXTS = [
+    "query: What was the total revenue for fiscal year 2023?",
+    "query: How did operating margin change compared to the prior quarter?",
+    "passage: Net income increased 12% year over year to $4.2 billion, driven by higher data center sales.",
+    "passage: Gross margin was 64.6%, down from 65.2% in the prior year due to inventory provisions.",
+    "passage: The Company repurchased 8.4 million shares of common stock for $3.4 billion during the quarter.",
+    "passage: Cash, cash equivalents and marketable securities were $13.3 billion as of January 29, 2023.",
+    "passage: Risk factors include supply chain constraints, export controls and customer concentration.",
+    "passage: Diluted earnings per share for the third quarter were $0.27, compared with $0.58 a year ago.",
+]
+
+
+def load_corpus(directory):
+    texts = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                # paragraphs are closer to the size of real chunks than whole files
+                texts.extend("passage: " + p.strip() for p in f.read().split("\n\n") if p.strip())
+    return texts
+
+
+def embed(model, texts):
+    start = time.perf_counter()
+    vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+    return vectors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare an embedding backend against the fp32 model.")
+    parser.add_argument("--backend", default=os.environ.get("EMBEDDING_BACKEND", "onnx-int8"), choices=BACKENDS)
+    parser.add_argument("--corpus", help="directory of text files to embed instead of the built-in sample")
+    parser.add_argument("--threshold", type=float, default=0.99, help="minimum mean cosine similarity")
+    parser.add_argument("--model-dir", default=os.environ.get("EMBEDDING_MODEL_DIR", "/project/data/models"))
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus) if args.corpus else SAMPLE_TEXTS
+    device = get_embedding_device()
+    reference, ref_time = embed(create_embeddings(BACKEND_TORCH, EMBEDDING_MODEL, device, args.model_dir), texts)
+    candidate, cand_time = embed(create_embeddings(args.backend, EMBEDDING_MODEL, device, args.model_dir), texts)
+
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate /= np.linalg.norm(candidate, axis=1, keepdims=True)
+    similarity = (reference * candidate).sum(axis=1)
+
+    print(f"Texts: {len(texts)}")
+    print(f"Reference ({BACKEND_TORCH}): {ref_time:.2f}s")
+    print(f"Candidate ({args.backend}): {cand_time:.2f}s")
+    print(f"Cosine similarity: mean {similarity.mean():.5f}, min {similarity.min():.5f}")
+
+    if similarity.mean() < args.threshold:
+        print(f"FAIL: mean similarity is below {args.threshold}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,27 +15,32 @@
 
 import os
 import shutil
-from milvus import default_server
-from pymilvus import connections, utility, Collection
 
-# Get connection to DB
-connections.connect(host='localhost', port=19530)
+if os.environ.get("APP_VECTORSTORE_BACKEND", "milvus") == "embedded":
+    # the embedded store is only files; restart the chain server afterwards
+    if os.path.exists("/project/data/vector-store"):
+        shutil.rmtree("/project/data/vector-store")
+else:
+    from pymilvus import connections, utility, Collection
 
-# Get collection
-collection = Collection(utility.list_collections()[0])
+    # Get connection to DB
+    connections.connect(host='localhost', port=19530)
 
-# Delete entities
-expr = "id!=''"
-collection.delete(expr)
+    # Get collection
+    collection = Collection(utility.list_collections()[0])
 
-# Query all entities
-result = collection.query(expr="id!=''", output_fields=["id"])
+    # Delete entities
+    expr = "id!=''"
+    collection.delete(expr)
 
-# Extract all IDs
-id_array = [entity["id"] for entity in result]
+    # Query all entities
+    result = collection.query(expr="id!=''", output_fields=["id"])
 
-# Ensure database is empty
-print(id_array)
+    # Extract all IDs
+    id_array = [entity["id"] for entity in result]
+
+    # Ensure database is empty
+    print(id_array)
 
 if os.path.exists("/project/data/documents/.file_cache.json"):
     os.remove("/project/data/documents/.file_cache.json")
@@ -44,4 +49,16 @@ if os.path.exists("/project/data/documents/.file_cache.lock"):
     os.remove("/project/data/documents/.file_cache.lock")
 
 if os.path.exists("/project/data/documents/.ipynb_checkpoints"):
-    shutil.rmtree("/project/data/documents/.ipynb_checkpoints")
\ No newline at end of file
+    shutil.rmtree("/project/data/documents/.ipynb_checkpoints")
+
+if os.path.exists("/project/data/sparse-index"):
+    shutil.rmtree("/project/data/sparse-index")
+
+if os.path.exists("/project/data/vectors"):
+    shutil.rmtree("/project/data/vectors")
+
+if os.path.exists("/project/data/tables"):
+    shutil.rmtree("/project/data/tables")
+
+if os.path.exists("/project/data/facts"):
+    shutil.rmtree("/project/data/facts")
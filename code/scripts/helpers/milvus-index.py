@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Inspect, rebuild or migrate the Milvus collection of the chain server.
+#
+# Usage: python milvus-index.py status
+#        python milvus-index.py rebuild [--index-type IVF_PQ --nlist 4096 --pq-m 64 ...]
+#        python milvus-index.py migrate
+#        python milvus-index.py compress [--index-type IVF_SQ8 --vector-file-dtype float32]
+#        python milvus-index.py export-vectors
+#
+# compress writes the exact embeddings of every chunk to the re-scoring file and rebuilds the vector index as a
+# compressed IVF_SQ8 (or IVF_PQ) index; then set indexType and rescore in the milvus configuration section.
+# export-vectors only rewrites the re-scoring file. Restart the chain server afterwards.
+#
+# The index settings come from the chain server configuration (APP_CONFIG_FILE / APP_MILVUS_* variables) and can
+# be overridden on the command line. Remember to persist overrides in the configuration so searches use matching
+# parameters. Stop ingestion while rebuilding or migrating.
+
+import argparse
+import dataclasses
+import json
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from chain_server.configuration import AppConfig  # noqa: E402
+from chain_server.milvus_schema import (  # noqa: E402
+    describe_collection,
+    export_vectors,
+    index_params,
+    migrate_collection,
+    rebuild_index,
+)
+from chain_server.vector_file import VectorFile  # noqa: E402
+
+EMBEDDING_DIM = 1024
+OVERRIDES = (
+    "index_type",
+    "metric_type",
+    "hnsw_m",
+    "hnsw_ef_construction",
+    "nlist",
+    "pq_m",
+    "pq_nbits",
+    "vector_file_dtype",
+)
+
+
+def write_vector_file(config):
+    """Rewrite the re-scoring file from the collection, swapping it in once complete."""
+    directory = config.vector_file_directory.rstrip("/")
+    staging = f"{directory}.export"
+    shutil.rmtree(staging, ignore_errors=True)
+    vector_file = VectorFile(staging, EMBEDDING_DIM, dtype=config.vector_file_dtype)
+    for batch in export_vectors(config):
+        vector_file.add(batch)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(staging, directory)
+    return len(vector_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the Milvus collection of the chain server.")
+    parser.add_argument("command", choices=("status", "rebuild", "migrate", "compress", "export-vectors"))
+    parser.add_argument("--index-type")
+    parser.add_argument("--metric-type")
+    parser.add_argument("--hnsw-m", type=int)
+    parser.add_argument("--hnsw-ef-construction", type=int)
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--pq-m", type=int)
+    parser.add_argument("--pq-nbits", type=int)
+    parser.add_argument("--vector-file-dtype", choices=("float32", "float16"))
+    args = parser.parse_args()
+
+    config = AppConfig.from_file(os.environ.get("APP_CONFIG_FILE", "/dev/null")).milvus
+    overrides = {name: getattr(args, name) for name in OVERRIDES if getattr(args, name) is not None}
+    if args.command == "compress":
+        overrides.setdefault("index_type", "IVF_SQ8")
+    config = dataclasses.replace(config, **overrides)
+
+    if args.command == "status":
+        print(json.dumps(describe_collection(config), indent=2, default=str))
+    elif args.command == "rebuild":
+        print(f"Building {json.dumps(index_params(config))} on {config.collection_name}")
+        elapsed = rebuild_index(config)
+        print(f"Index built in {elapsed:.1f}s")
+    elif args.command in ("compress", "export-vectors"):
+        print(f"Writing the exact embeddings to {config.vector_file_directory}")
+        print(f"Wrote {write_vector_file(config)} embeddings")
+        if args.command == "compress":
+            print(f"Building {json.dumps(index_params(config))} on {config.collection_name}")
+            elapsed = rebuild_index(config)
+            print(f"Index built in {elapsed:.1f}s")
+    else:
+        print(f"Migrating {config.collection_name} with {json.dumps(index_params(config))}")
+        copied = migrate_collection(config, EMBEDDING_DIM)
+        print(f"Copied {copied} chunks")
+
+
+if __name__ == "__main__":
+    main()
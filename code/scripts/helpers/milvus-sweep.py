@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measure recall and latency of the Milvus index over a range of search parameters.
+#
+# Usage: python milvus-sweep.py [--queries 100] [--k 10] [--values 16,32,64,128,256]
+#
+# Stored chunk vectors are sampled as queries, exact neighbours are computed by a brute force scan of the
+# collection, and each value of the search parameter of the configured index (ef for HNSW, nprobe for IVF,
+# search_list for DISKANN) is timed one query at a time, as the chain server searches.
+
+import argparse
+import dataclasses
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from pymilvus import Collection, connections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from chain_server.configuration import AppConfig  # noqa: E402
+from chain_server.milvus_schema import EMBEDDING_FIELD, ID_FIELD, search_params  # noqa: E402
+
+SEARCH_KNOBS = {"HNSW": "ef", "DISKANN": "search_list"}
+
+
+def sample_queries(collection, num_queries, batch_size):
+    ids = []
+    iterator = collection.query_iterator(batch_size=batch_size, expr=f'{ID_FIELD} != ""', output_fields=[ID_FIELD])
+    while True:
+        rows = iterator.next()
+        if not rows:
+            break
+        ids.extend(row[ID_FIELD] for row in rows)
+    iterator.close()
+    sample = random.sample(ids, min(num_queries, len(ids)))
+    rows = collection.query(expr=f"{ID_FIELD} in {json.dumps(sample)}", output_fields=[ID_FIELD, EMBEDDING_FIELD])
+    return [row[ID_FIELD] for row in rows], np.asarray([row[EMBEDDING_FIELD] for row in rows], dtype=np.float32)
+
+
+def exact_neighbours(collection, query_ids, queries, k, metric, batch_size):
+    """Scan the whole collection and keep the k best ids of every query, excluding the query itself."""
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), "", dtype=object)
+    iterator = collection.query_iterator(
+        batch_size=batch_size, expr=f'{ID_FIELD} != ""', output_fields=[ID_FIELD, EMBEDDING_FIELD]
+    )
+    while True:
+        rows = iterator.next()
+        if not rows:
+            break
+        ids = np.asarray([row[ID_FIELD] for row in rows], dtype=object)
+        vectors = np.asarray([row[EMBEDDING_FIELD] for row in rows], dtype=np.float32)
+        if metric == "IP":
+            scores = queries @ vectors.T
+        else:
+            scores = -((queries**2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors**2).sum(axis=1)[None])
+        scores[ids[None, :] == np.asarray(query_ids, dtype=object)[:, None]] = -np.inf
+
+        merged_scores = np.concatenate([best_scores, scores], axis=1)
+        merged_ids = np.concatenate([best_ids, np.broadcast_to(ids, scores.shape)], axis=1)
+        top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, top, axis=1)
+        best_ids = np.take_along_axis(merged_ids, top, axis=1)
+    iterator.close()
+    return [set(row) for row in best_ids]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep Milvus search parameters for recall and latency.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--values", help="comma separated values of the search parameter")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    config = AppConfig.from_file(os.environ.get("APP_CONFIG_FILE", "/dev/null")).milvus
+    knob = SEARCH_KNOBS.get(config.index_type.upper(), "nprobe")
+    values = [int(v) for v in args.values.split(",")] if args.values else [8, 16, 32, 64, 128, 256]
+
+    connections.connect(uri=config.url)
+    collection = Collection(config.collection_name)
+    collection.load()
+
+    print(f"Index: {config.index_type}, metric: {config.metric_type}, rows: {collection.num_entities}")
+    query_ids, queries = sample_queries(collection, args.queries, args.batch_size)
+    print(f"Computing exact neighbours of {len(query_ids)} queries...")
+    truth = exact_neighbours(collection, query_ids, queries, args.k, config.metric_type.upper(), args.batch_size)
+
+    print(f"{knob:>12} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8} {'qps':>8}")
+    for value in values:
+        params = search_params(dataclasses.replace(config, **{knob: value}))
+        latencies = []
+        recalls = []
+        for query_id, query, expected in zip(query_ids, queries, truth):
+            start = time.perf_counter()
+            # one extra hit since the query vector finds itself
+            hits = collection.search([query.tolist()], EMBEDDING_FIELD, params, limit=args.k + 1)[0]
+            latencies.append((time.perf_counter() - start) * 1000)
+            found = [hit.id for hit in hits if hit.id != query_id][: args.k]
+            recalls.append(len(expected.intersection(found)) / args.k)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        qps = 1000 * len(latencies) / sum(latencies)
+        print(f"{value:>12} {np.mean(recalls):>10.4f} {p50:>8.2f} {p95:>8.2f} {qps:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -37,6 +37,7 @@ def check_setup():
         elif num_gpus == 1:
             if embedding_device != "cpu":
                 print("WARNING: You only have 1 GPU available that will be used for inference. You must set the embedding device to 'cpu'.")
+                print("HINT: Set EMBEDDING_BACKEND=onnx-int8 for much faster embedding on the CPU.")
                     
             if num_shard is not None and num_shard > 1:
                 print("WARNING: You cannot shard with only 1 GPU available.")
@@ -59,6 +60,7 @@ def check_setup():
         print(f"Total Inference VRAM: {inf_mem/(2**30):.2f} GB")
         print(f"Quantize Mode: {quantize}")
         print(f"Embedding Device: {embedding_device}")
+        print(f"Embedding Backend: {os.environ.get('EMBEDDING_BACKEND', 'torch')}")
     else:
         num_gpus = torch.cuda.device_count()
         if num_gpus == 0:
@@ -67,6 +69,7 @@ def check_setup():
         
         print("Inference Mode: Cloud")
         print(f"Embedding Device: {embedding_device}")
+        print(f"Embedding Backend: {os.environ.get('EMBEDDING_BACKEND', 'torch')}")
     
     return inference_mode
         
\ No newline at end of file
@@ -15,5 +15,5 @@
 
 from docs import DocProcessor
 
-p = DocProcessor("/project/data/documents", "/mnt/docs", "http://localhost:8000/uploadDocument", False)
+p = DocProcessor("/project/data/documents", "/mnt/docs", "http://localhost:8000/uploadDocuments", False)
 p.process()
\ No newline at end of file
@@ -4,7 +4,15 @@
 # -x flag only match processes whose name (or command line if -f is
 # specified) exactly match the pattern. 
 
-if pgrep -x "milvus" > /dev/null
+# With APP_VECTORSTORE_BACKEND=embedded the chain server keeps the vectors itself and Milvus is not started.
+VECTOR_STORE="${APP_VECTORSTORE_BACKEND:-milvus}"
+if [ "$VECTOR_STORE" = "embedded" ]; then
+    is_running() { pgrep -f "uvicorn chain_server.server:app" > /dev/null; }
+else
+    is_running() { pgrep -x "milvus" > /dev/null; }
+fi
+
+if is_running
 then
     # Check if the status is not 200
     if [[ $(curl -o /dev/null -s -w "%{http_code}" --max-time 3 "http://localhost:8000/health") -ne 200 ]]; then
@@ -13,7 +21,7 @@ then
     fi
 
     # Check if the status is not 200
-    if [[ $(curl -o /dev/null -s -w "%{http_code}" --max-time 3 "http://localhost:19530/v1/vector/collections") -ne 200 ]]; then
+    if [ "$VECTOR_STORE" != "embedded" ] && [[ $(curl -o /dev/null -s -w "%{http_code}" --max-time 3 "http://localhost:19530/v1/vector/collections") -ne 200 ]]; then
         echo "Error: 'http://localhost:19530/v1/vector/collections' returned HTTP code $(curl -o /dev/null -s -w "%{http_code}" --max-time 3 'http://localhost:19530/v1/vector/collections')"
         exit 2
     fi
@@ -22,8 +30,10 @@ then
     exit 0
 else
     # Start milvus
-    echo "Starting Milvus"
-    $HOME/.local/bin/milvus-server --data /mnt/milvus/ &
+    if [ "$VECTOR_STORE" != "embedded" ]; then
+        echo "Starting Milvus"
+        $HOME/.local/bin/milvus-server --data /mnt/milvus/ &
+    fi
     
     # Start API
     echo "Starting API"
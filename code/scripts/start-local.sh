@@ -7,6 +7,8 @@ pkill -SIGINT -f 'text-generation' &
 sleep 1
 
 CUDA_MEMORY_FRACTION=0.95 # adjust the percentage of the GPU being used. Don't go above 0.95
+# The chain server packs RAG prompts to fit --max-input-tokens/--max-total-tokens; keep llm.localMaxInputTokens
+# and llm.localMaxTotalTokens of its configuration in sync when changing them.
 
 if [ "$2" = "none" ]
 then
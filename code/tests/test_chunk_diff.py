@@ -0,0 +1,70 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the chunk ids and the diff replacing the stored chunks of a re-ingested file.
+
+:mod:`chain_server.chains` needs the serving dependencies, so these tests are skipped where they are not installed.
+"""
+import importlib.util
+import unittest
+from typing import List
+from unittest import mock
+
+_HAS_CHAINS = all(importlib.util.find_spec(name) for name in ("llama_index", "torch", "transformers"))
+
+if _HAS_CHAINS:
+    from llama_index.schema import TextNode
+
+    from chain_server import chains
+
+
+def _nodes(*texts: str) -> List["TextNode"]:
+    return [TextNode(text=text, metadata={"filename": "report.pdf", "page": 1}) for text in texts]
+
+
+@unittest.skipUnless(_HAS_CHAINS, "llama_index, torch and transformers are not installed")
+class ChunkDiffTest(unittest.TestCase):
+    def _diff(self, stored: List[str]) -> "chains.ChunkDiff":
+        with mock.patch.object(chains, "get_document_node_ids", return_value=set(stored)):
+            return chains.ChunkDiff("report.pdf")
+
+    def test_ids_are_stable_and_count_duplicates(self) -> None:
+        first, second = _nodes("a", "b", "a"), _nodes("a", "b", "a")
+        chains.assign_chunk_ids(first, "report.pdf")
+        chains.assign_chunk_ids(second, "report.pdf")
+        self.assertEqual([node.node_id for node in first], [node.node_id for node in second])
+        self.assertEqual(len({node.node_id for node in first}), 3)
+
+    def test_metadata_changes_the_id(self) -> None:
+        first, second = _nodes("a"), _nodes("a")
+        second[0].metadata["page"] = 2
+        chains.assign_chunk_ids(first, "report.pdf")
+        chains.assign_chunk_ids(second, "report.pdf")
+        self.assertNotEqual(first[0].node_id, second[0].node_id)
+
+    def test_only_changed_chunks_are_inserted_and_stale_ones_deleted(self) -> None:
+        previous = _nodes("kept", "dropped")
+        chains.assign_chunk_ids(previous, "report.pdf")
+        diff = self._diff([node.node_id for node in previous])
+
+        changed = diff.changed(_nodes("kept")) + diff.changed(_nodes("added"))
+        self.assertEqual([node.text for node in changed], ["added"])
+        with mock.patch.object(chains, "delete_nodes") as delete_nodes:
+            self.assertEqual(diff.finish(), 1)
+        delete_nodes.assert_called_once_with({previous[1].node_id})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the token chunker."""
+import re
+import unittest
+from typing import Any, Dict, List
+
+from chain_server.chunker import TokenChunker
+
+
+class _WordTokenizer:
+    """A fast tokenizer reading every word and punctuation mark as one token."""
+
+    is_fast = True
+
+    def __call__(self, texts: Any, **_: Any) -> Dict[str, List[Any]]:
+        if isinstance(texts, str):
+            return {"input_ids": re.findall(r"\w+|[^\w\s]", texts)}
+        return {"offset_mapping": [[m.span() for m in re.finditer(r"\w+|[^\w\s]", text)] for text in texts]}
+
+
+class TokenChunkerTest(unittest.TestCase):
+    def test_short_texts_are_one_chunk(self) -> None:
+        chunker = TokenChunker(_WordTokenizer(), chunk_size=10, chunk_overlap=2)
+        self.assertEqual(chunker.split(["Revenue grew.", ""]), [[(0, 13)], []])
+
+    def test_chunks_end_at_sentences_and_overlap(self) -> None:
+        text = "Revenue grew ten percent. Margins were stable across all segments this year."
+        chunker = TokenChunker(_WordTokenizer(), chunk_size=8, chunk_overlap=2)
+        spans = chunker.split([text])[0]
+        self.assertEqual(text[slice(*spans[0])], "Revenue grew ten percent.")
+        # the next chunk starts two tokens before the end of the previous one
+        self.assertTrue(text[slice(*spans[1])].startswith("percent. Margins"))
+        self.assertEqual(spans[-1][1], len(text))
+        for start, end in spans:
+            self.assertLessEqual(chunker.count_tokens(text[start:end]), 8)
+
+    def test_texts_are_split_in_batches(self) -> None:
+        chunker = TokenChunker(_WordTokenizer(), chunk_size=4, chunk_overlap=0, batch_size=2)
+        texts = [f"one two three four five {i}" for i in range(5)]
+        self.assertEqual([len(spans) for spans in chunker.split(texts)], [2] * 5)
+
+    def test_invalid_settings(self) -> None:
+        with self.assertRaises(ValueError):
+            TokenChunker(_WordTokenizer(), chunk_size=4, chunk_overlap=4)
+        slow = _WordTokenizer()
+        slow.is_fast = False
+        with self.assertRaises(ValueError):
+            TokenChunker(slow, chunk_size=4, chunk_overlap=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the fact index answering single number questions."""
+import datetime
+import tempfile
+import unittest
+from typing import Optional
+
+from chain_server.fact_index import FactIndex, FactQuery, parse_question, year_end_month
+from chain_server.xbrl import FactStore
+
+_ENTITIES = ["apple", "nvidia"]
+
+
+def _revenue(start: datetime.date, end: datetime.date, value: float, fiscal_year_end: Optional[str] = None) -> dict:
+    return {
+        "concept": "us-gaap:Revenues",
+        "entity": "0000320193",
+        "issuer": "Apple Inc.",
+        "period_start": start,
+        "period_end": end,
+        "unit": "USD",
+        "dimensions": "",
+        "value": value,
+        "decimals": -6,
+        "fiscal_year_end": fiscal_year_end,
+    }
+
+
+_Q3_2023 = _revenue(datetime.date(2023, 4, 2), datetime.date(2023, 7, 1), 81.8e9)
+_FY_2023 = _revenue(datetime.date(2022, 9, 25), datetime.date(2023, 9, 30), 383.3e9)
+
+
+class ParseQuestionTest(unittest.TestCase):
+    def test_single_number_questions(self) -> None:
+        self.assertEqual(
+            parse_question("What is NVIDIA’s revenue in Q3 FY2024?", _ENTITIES),
+            FactQuery("nvidia", "revenue", 2024, 3),
+        )
+        self.assertEqual(
+            parse_question("What was Apple's net income for fiscal 2023?", _ENTITIES),
+            FactQuery("apple", "net_income", 2023, 0),
+        )
+        self.assertEqual(
+            parse_question("What were total assets at the end of fiscal 2023?", _ENTITIES),
+            FactQuery(None, "total_assets", 2023, 0),
+        )
+
+    def test_other_questions_are_left_to_retrieval(self) -> None:
+        for question in [
+            "sales and marketing expenses",
+            "What was Apple's iPhone revenue in 2023?",
+            "revenue from China",
+            "revenue recognition policy",
+            "Net income attributable to noncontrolling interests",
+            "Apple and NVIDIA revenue 2023",
+            "Why did revenue grow in 2023?",
+            "apple revenue q3 2023 q2",
+        ]:
+            with self.subTest(question=question):
+                self.assertIsNone(parse_question(question, _ENTITIES))
+
+    def test_year_end_month(self) -> None:
+        self.assertEqual(year_end_month("--09-30"), 9)
+        # 52/53 week years ending early in a month belong to the previous one
+        self.assertEqual(year_end_month("--10-01"), 9)
+        self.assertIsNone(year_end_month("September"))
+
+
+class FactIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self._directory.cleanup)
+        self.index = FactIndex(FactStore(self._directory.name))
+
+    def test_annual_report_sets_the_fiscal_calendar(self) -> None:
+        self.index.add("aapl-10q.htm", [_Q3_2023])
+        self.index.add("aapl-10k.htm", [_FY_2023])
+        answer = self.index.answer("What was Apple's revenue in Q3 2023?")
+        self.assertIsNotNone(answer)
+        self.assertEqual(
+            answer.text,
+            "Apple Inc. reported revenue of $81.80 billion for Q3 fiscal 2023 (us-gaap:Revenues, 2023-04-02 to "
+            "2023-07-01).",
+        )
+
+    def test_stated_year_end_is_preferred(self) -> None:
+        self.index.add("aapl-10q.htm", [dict(_Q3_2023, fiscal_year_end="--09-30")])
+        answer = self.index.answer("What was Apple's revenue in Q3 2023?")
+        self.assertIsNotNone(answer)
+        self.assertIn("Q3 fiscal 2023", answer.text)
+
+    def test_removed_filings_no_longer_answer(self) -> None:
+        self.index.add("aapl-10k.htm", [_FY_2023])
+        self.assertIsNotNone(self.index.answer("What was Apple's revenue in fiscal 2023?"))
+        self.index.remove("aapl-10k.htm")
+        self.assertEqual(len(self.index), 0)
+        self.assertIsNone(self.index.answer("What was Apple's revenue in fiscal 2023?"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the parsers that run without unstructured."""
+import os
+import tempfile
+import unittest
+
+from chain_server.parsing import FORMAT_HTML, FORMAT_TEXT, file_format, has_table, parse_html, split_layout_tables
+from chain_server.tables import parse_html_table
+
+# the layout text pypdf extracts from a statement with right aligned amounts
+_LAYOUT_PAGE = """CONSOLIDATED STATEMENTS OF OPERATIONS
+(In millions)
+
+                                              2024            2023
+Net sales                                $ 383,285       $ 394,328
+Cost of sales                              214,137         223,546
+Operating expenses:
+Research and development                    29,915          26,251
+Net income (loss)                          (1,234)          99,803
+
+
+Net sales increased due to higher sales of services.
+"""
+
+
+class HasTableTest(unittest.TestCase):
+    def test_rows_of_amounts_make_a_table(self) -> None:
+        self.assertTrue(has_table(_LAYOUT_PAGE))
+
+    def test_years_and_note_numbers_do_not(self) -> None:
+        self.assertFalse(has_table("In 2024 and 2023, see Note 12 and Note 14.\n" * 5))
+
+
+class SplitLayoutTablesTest(unittest.TestCase):
+    def test_table_between_narrative_text(self) -> None:
+        elements = split_layout_tables(_LAYOUT_PAGE, 7)
+        self.assertEqual([element.category for element in elements], ["NarrativeText", "Table", "NarrativeText"])
+        self.assertTrue(all(element.page == 7 for element in elements))
+        self.assertEqual(elements[0].text, "CONSOLIDATED STATEMENTS OF OPERATIONS\n(In millions)")
+        self.assertEqual(elements[2].text, "Net sales increased due to higher sales of services.")
+        self.assertEqual(
+            parse_html_table(elements[1].html),
+            [
+                ["", "2024", "2023"],
+                ["Net sales", "$ 383,285", "$ 394,328"],
+                ["Cost of sales", "214,137", "223,546"],
+                ["Operating expenses:", "", ""],
+                ["Research and development", "29,915", "26,251"],
+                ["Net income (loss)", "(1,234)", "99,803"],
+            ],
+        )
+
+    def test_text_without_tables_is_kept(self) -> None:
+        elements = split_layout_tables("Item 1.    Business\nWe design products.", 1)
+        self.assertEqual([(element.category, element.text) for element in elements],
+                         [("NarrativeText", "Item 1. Business\nWe design products.")])
+
+
+class ParseHtmlTest(unittest.TestCase):
+    def test_titles_text_and_tables(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "filing.htm")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(
+                    "<html><body><h2>Item 7. Results</h2><p>Revenue grew.</p>"
+                    "<table><tr><td>Revenue</td><td>1,234</td></tr></table></body></html>"
+                )
+            self.assertEqual(file_format(path), FORMAT_HTML)
+            elements = parse_html(path)
+        self.assertEqual([element.category for element in elements], ["Title", "NarrativeText", "Table"])
+        self.assertEqual(parse_html_table(elements[2].html), [["Revenue", "1,234"]])
+
+    def test_text_files_are_routed_by_suffix(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "notes.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("# Notes\n\nSome text.")
+            self.assertEqual(file_format(path), FORMAT_TEXT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the BM25 index."""
+import tempfile
+import unittest
+
+from chain_server.sparse_index import SparseIndex, reciprocal_rank_fusion, tokenize
+
+
+class SparseIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self._directory.cleanup)
+
+    def test_tokenize_keeps_financial_terms_whole(self) -> None:
+        self.assertEqual(tokenize("The 10-K of S&P for FY2024"), ["10-k", "s&p", "fy2024"])
+
+    def test_search_ranks_exact_terms_first(self) -> None:
+        index = SparseIndex(self._directory.name)
+        index.add([("a", "revenue grew in fiscal 2024"), ("b", "EBITDA for Q3 FY2024"), ("c", "cash and equivalents")])
+        self.assertEqual([node_id for node_id, _ in index.search("ebitda fy2024", 3)], ["b"])
+
+    def test_scores_stay_positive_after_deletes(self) -> None:
+        index = SparseIndex(self._directory.name)
+        index.add((f"n{i}", "item 5 market risk") for i in range(10))
+        index.delete(["n1", "n2"])
+        hits = index.search("item 5", 10)
+        self.assertEqual(len(hits), 8)
+        self.assertTrue(all(score > 0 for _, score in hits))
+        self.assertNotIn("n1", dict(hits))
+
+    def test_updates_replace_the_previous_version(self) -> None:
+        index = SparseIndex(self._directory.name)
+        index.add([("a", "goodwill impairment")])
+        index.add([("a", "share repurchases")])
+        self.assertEqual(index.search("goodwill", 5), [])
+        self.assertEqual([node_id for node_id, _ in index.search("repurchases", 5)], ["a"])
+        self.assertEqual(len(index), 1)
+
+    def test_merges_and_reopens(self) -> None:
+        index = SparseIndex(self._directory.name, merge_factor=2)
+        for i in range(8):
+            index.add([(f"n{i}", f"segment {i} operating income")])
+        index.delete(["n3"])
+        reopened = SparseIndex(self._directory.name, merge_factor=2)
+        self.assertEqual(len(reopened), 7)
+        self.assertEqual(
+            sorted(node_id for node_id, _ in reopened.search("operating income", 10)),
+            [f"n{i}" for i in range(8) if i != 3],
+        )
+
+    def test_reciprocal_rank_fusion(self) -> None:
+        fused = reciprocal_rank_fusion([["a", "b"], ["b", "c"]], k=60)
+        self.assertEqual([node_id for node_id, _ in fused], ["b", "a", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the table parsing and chunking."""
+import tempfile
+import unittest
+
+from chain_server.tables import (
+    TableStore,
+    num_header_rows,
+    numeric_cells,
+    parse_html_table,
+    parse_number,
+    table_chunks,
+)
+
+# an EDGAR income statement: the year headers span the currency sign and amount columns, and negative amounts put
+# their closing parenthesis in a cell of its own
+_EDGAR_TABLE = """
+<table>
+  <tr><td></td><td colspan="2">2024</td><td colspan="2">2023</td></tr>
+  <tr><td>Revenue</td><td>$</td><td>1,234</td><td>$</td><td>(56</td><td>)</td></tr>
+  <tr><td>Operating income</td><td></td><td>789</td><td></td><td>12.5</td><td>%</td></tr>
+</table>
+"""
+
+
+class ParseNumberTest(unittest.TestCase):
+    def test_financial_formats(self) -> None:
+        self.assertEqual(parse_number("$1,234.5"), 1234.5)
+        self.assertEqual(parse_number("(56)"), -56)
+        self.assertEqual(parse_number("12.5%"), 12.5)
+        self.assertEqual(parse_number("−3"), -3)
+        self.assertEqual(parse_number("1,234 (1)"), 1234)
+
+    def test_text_is_not_a_number(self) -> None:
+        self.assertIsNone(parse_number("Revenue"))
+        self.assertIsNone(parse_number("$"))
+        self.assertIsNone(parse_number(""))
+
+
+class ParseHtmlTableTest(unittest.TestCase):
+    def test_drops_filler_columns_under_spanning_headers(self) -> None:
+        self.assertEqual(
+            parse_html_table(_EDGAR_TABLE),
+            [["", "2024", "2023"], ["Revenue", "1,234", "(56)"], ["Operating income", "789", "12.5%"]],
+        )
+
+    def test_header_rows(self) -> None:
+        rows = parse_html_table(_EDGAR_TABLE)
+        self.assertEqual(num_header_rows(rows), 1)
+        self.assertEqual(num_header_rows(rows[:1]), 0)
+
+
+class TableChunksTest(unittest.TestCase):
+    def test_every_chunk_repeats_the_header(self) -> None:
+        rows = [["", "2024", "2023"]] + [[f"Line {i}", str(i), str(i + 1)] for i in range(20)]
+        chunks = table_chunks(rows, max_tokens=40, count_tokens=lambda text: len(text.split()), title="Balance sheet")
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertTrue(chunk.startswith("Balance sheet\n\n|  | 2024 | 2023 |\n| --- | --- | --- |"))
+        body = [line for chunk in chunks for line in chunk.splitlines()[4:]]
+        self.assertEqual(body, [f"| Line {i} | {i} | {i + 1} |" for i in range(20)])
+
+    def test_numeric_cells_carry_their_headers(self) -> None:
+        cells = numeric_cells(parse_html_table(_EDGAR_TABLE), "t1", 3)
+        self.assertEqual(
+            [(cell["row_header"], cell["column_header"], cell["value"]) for cell in cells],
+            [("Revenue", "2024", 1234), ("Revenue", "2023", -56), ("Operating income", "2024", 789),
+             ("Operating income", "2023", 12.5)],
+        )
+
+    def test_store_round_trip(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            store = TableStore(directory)
+            cells = numeric_cells(parse_html_table(_EDGAR_TABLE), "doc:0", 3)
+            store.put("doc", cells)
+            self.assertTrue(store.has("doc"))
+            self.assertEqual(store.cells("doc:0"), cells)
+            self.assertEqual(store.cells("doc:1"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the XBRL fact parsing and the fact store."""
+import datetime
+import os
+import tempfile
+import unittest
+
+from chain_server.xbrl import FactStore, concept_title, inline_value, instance_value, parse_instance
+
+_INSTANCE = """<?xml version="1.0"?>
+<xbrli:xbrl xmlns:xbrli="http://www.xbrl.org/2003/instance" xmlns:us-gaap="http://fasb.org/us-gaap/2023"
+            xmlns:dei="http://xbrl.sec.gov/dei/2023" xmlns:iso4217="http://www.xbrl.org/2003/iso4217">
+  <xbrli:context id="c1">
+    <xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000001</xbrli:identifier></xbrli:entity>
+    <xbrli:period><xbrli:startDate>2022-10-01</xbrli:startDate><xbrli:endDate>2023-09-30</xbrli:endDate></xbrli:period>
+  </xbrli:context>
+  <xbrli:unit id="usd"><xbrli:measure>iso4217:USD</xbrli:measure></xbrli:unit>
+  <dei:EntityRegistrantName contextRef="c1">Acme Corp</dei:EntityRegistrantName>
+  <dei:CurrentFiscalYearEndDate contextRef="c1">--09-30</dei:CurrentFiscalYearEndDate>
+  <us-gaap:NetIncomeLoss contextRef="c1" unitRef="usd" decimals="-6">-5000000</us-gaap:NetIncomeLoss>
+  <us-gaap:Revenues contextRef="c1" unitRef="usd" decimals="-6">1.2E8</us-gaap:Revenues>
+  <us-gaap:RevenueRecognitionPolicyTextBlock contextRef="c1">&lt;p&gt;Revenue is recognized.&lt;/p&gt;</us-gaap:RevenueRecognitionPolicyTextBlock>
+</xbrli:xbrl>
+"""
+
+
+def _fact(value: float) -> dict:
+    return {
+        "concept": "us-gaap:Revenues",
+        "entity": "0000001",
+        "issuer": "Acme Corp",
+        "period_start": datetime.date(2022, 10, 1),
+        "period_end": datetime.date(2023, 9, 30),
+        "unit": "USD",
+        "dimensions": "",
+        "value": value,
+        "decimals": -6,
+        "fiscal_year_end": "--09-30",
+    }
+
+
+class ValueTest(unittest.TestCase):
+    def test_inline_values(self) -> None:
+        self.assertEqual(inline_value("1,234", "ixt:num-dot-decimal", "6", "-"), -1234e6)
+        self.assertEqual(inline_value("1.234,5", "ixt:num-comma-decimal", None, None), 1234.5)
+        self.assertEqual(inline_value("-", "ixt:fixed-zero", None, None), 0.0)
+        self.assertEqual(inline_value("three", "ixt-sec:numwordsen", None, None), 3.0)
+        self.assertIsNone(inline_value("n/a", "ixt:num-dot-decimal", None, None))
+
+    def test_instance_values_are_xsd_numbers(self) -> None:
+        self.assertEqual(instance_value("-5000000"), -5e6)
+        self.assertEqual(instance_value(" 1.2E8 "), 1.2e8)
+        self.assertIsNone(instance_value("1,234"))
+        self.assertIsNone(instance_value("INF"))
+
+    def test_concept_title(self) -> None:
+        self.assertEqual(concept_title("us-gaap:RevenueRecognitionPolicyTextBlock"), "Revenue Recognition Policy")
+
+
+class ParseInstanceTest(unittest.TestCase):
+    def test_facts_and_text_blocks(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "acme-20230930.xml")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(_INSTANCE)
+            collector, text_blocks = parse_instance(path)
+        rows = {row["concept"]: row for row in collector.rows()}
+        self.assertEqual(rows["us-gaap:NetIncomeLoss"]["value"], -5e6)
+        self.assertEqual(rows["us-gaap:Revenues"]["value"], 1.2e8)
+        self.assertEqual(rows["us-gaap:Revenues"]["issuer"], "Acme Corp")
+        self.assertEqual(rows["us-gaap:Revenues"]["fiscal_year_end"], "--09-30")
+        self.assertEqual(rows["us-gaap:Revenues"]["period_end"], datetime.date(2023, 9, 30))
+        self.assertEqual(text_blocks, [("us-gaap:RevenueRecognitionPolicyTextBlock", "<p>Revenue is recognized.</p>")])
+
+
+class FactStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self._directory.cleanup)
+        self.store = FactStore(self._directory.name)
+
+    def test_round_trip(self) -> None:
+        self.store.put("h1", [_fact(1.0)])
+        self.assertEqual(self.store.facts("h1"), [_fact(1.0)])
+        self.assertEqual(self.store.facts("missing"), [])
+
+    def test_replaced_versions_are_deleted(self) -> None:
+        self.store.put("h1", [_fact(1.0)])
+        self.store.link("a.htm", "h1")
+        self.store.put("h2", [_fact(2.0)])
+        self.assertEqual(self.store.link("a.htm", "h2"), "h1")
+        self.assertFalse(self.store.has("h1"))
+        self.assertEqual(self.store.linked(), {"a.htm": "h2"})
+
+    def test_shared_versions_are_kept_while_linked(self) -> None:
+        self.store.put("h1", [_fact(1.0)])
+        self.store.link("a.htm", "h1")
+        self.store.link("b.htm", "h1")
+        self.store.link("a.htm", None)
+        self.assertTrue(self.store.has("h1"))
+        self.store.link("b.htm", None)
+        self.assertFalse(self.store.has("h1"))
+        self.assertEqual(self.store.linked(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()